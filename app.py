@@ -1,56 +1,295 @@
 import os
+import re
 import logging
 import base64
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Header, Body
+import hmac
+import json
+import time
+from urllib.parse import quote
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, Request, Header, Body, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, Response
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, LargeBinary
-from sqlalchemy.ext.declarative import declarative_base
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import inspect, text, Index, event, tuple_, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import sessionmaker, Session, declarative_base, relationship
-from passlib.context import CryptContext
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.serialization import load_pem_public_key, load_pem_private_key
-from starlette.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from datetime import datetime, timedelta
 from hashlib import sha256
+from collections import Counter, defaultdict
 # from models import License, User
 # from schemas import LicenseCreate, LicenseResponse
 import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi.staticfiles import StaticFiles
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("server.log"),  # Запись в файл
-        logging.StreamHandler(),  # Вывод в консоль
-    ],
-)
+from chunking import Chunker
+from compressors import KNOWN_CODECS
+from container import CONTAINER_MAGIC, CONTAINER_MAGICS, MAX_FRAME_SIZE, ContainerError, FrameSplitter
+from storage import create_storage
+from tokens import TokenError, TokenSigner, load_secret
+from cache import TTLCache
+from passwords import PasswordHasher, PasswordHasherBusy
+from jobs import JobScheduler
+from license_keys import KeyRegistry, init_verify_worker, license_key_id, verify_licenses
+import metrics
+from logging_setup import SAMPLED, configure_logging
+
+# Настройка логирования: запись через очередь в фоновом потоке (logging_setup.py)
+configure_logging(os.environ.get("LOG_FILE", "server.log"))
 logger = logging.getLogger(__name__)
 
+# Метрики (GET /metrics)
+REQUEST_SECONDS = metrics.Histogram("http_request_duration_seconds",
+                                    "Длительность обработки запроса, включая передачу тела", ["method", "route"])
+REQUESTS = metrics.Counter("http_requests_total", "Число обработанных запросов", ["method", "route", "status"])
+REQUEST_BYTES = metrics.Counter("http_request_bytes_total", "Принято байт в телах запросов", ["route"])
+RESPONSE_BYTES = metrics.Counter("http_response_bytes_total", "Отправлено байт в телах ответов", ["route"])
+ACTIVE_TRANSFERS = metrics.Gauge("backup_transfers_active", "Выполняющиеся загрузки и скачивания", ["direction"])
+DB_QUERY_SECONDS = metrics.Histogram("db_query_seconds", "Длительность SQL-запросов")
+JOB_REMOVED = metrics.Counter("background_job_removed_total",
+                              "Удалено фоновыми задачами: expired_backups - по политикам хранения, "
+                              "chunks - блоки без ссылок, orphan_objects - объекты без записей в базе, "
+                              "upload_sessions - незавершённые загрузки, pending_chunks - учёт в квоте блоков "
+                              "без манифеста", ["kind"])
+UPLOAD_STAGE_SECONDS = metrics.Histogram("upload_stage_seconds",
+                                         "Время этапов приёма файла: hash - разбиение и хеширование, write - запись "
+                                         "блоков в хранилище, db - поиск дубликатов и запись в базу, commit - фиксация",
+                                         ["stage"])
+
 # Настройка базы данных
-DATABASE_URL = "sqlite:///./backup_system.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./backup_system.db")
+# Пул соединений для серверных СУБД (PostgreSQL): постоянные соединения и запас на пики нагрузки
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))  # Пересоздавать соединения старше N секунд
+# SQLite: сколько ждать освобождения блокировки (мс) и режим синхронизации с диском
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", "30000"))
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+
+def create_db_engine(database_url: str):
+    """
+    Создать движок SQLAlchemy с настройками под СУБД.
+
+    SQLite переводится в режим WAL: читатели не блокируют писателя и наоборот, а при
+    занятой блокировке запрос ждёт до SQLITE_BUSY_TIMEOUT вместо немедленной ошибки.
+    synchronous=NORMAL в режиме WAL безопасен для целостности базы и заметно ускоряет
+    фиксацию транзакций. Для остальных СУБД (PostgreSQL) настраивается пул соединений
+    с проверкой соединения перед выдачей (pool_pre_ping).
+    """
+    if not database_url.startswith("sqlite"):
+        return create_engine(database_url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                             pool_pre_ping=True, pool_recycle=DB_POOL_RECYCLE)
+
+    if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise RuntimeError(f"Недопустимое значение SQLITE_SYNCHRONOUS: {SQLITE_SYNCHRONOUS}")
+    sqlite_engine = create_engine(database_url, connect_args={"check_same_thread": False,
+                                                              "timeout": SQLITE_BUSY_TIMEOUT / 1000})
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.close()
+
+    return sqlite_engine
+
+
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL)
+
+
+# Время начала хранится в контексте выполнения запроса: при ошибке after_cursor_execute не
+# вызывается, и запись в общем для соединения списке так бы и осталась
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    observe_query_time(context)
+
+
+@event.listens_for(engine, "handle_error")
+def stop_failed_query_timer(exception_context):
+    observe_query_time(exception_context.execution_context)
+
+
+def observe_query_time(context):
+    start = getattr(context, "query_start", None)
+    if start is not None:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start)
+        context.query_start = None
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Хэширование паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Хэширование паролей: bcrypt в отдельном пуле процессов (passwords.py)
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
 
 # Настройка OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI()
+# Токены доступа подписываются секретом из TOKEN_SECRET или из файла (создаётся при первом запуске)
+TOKEN_SECRET_FILE = os.environ.get("TOKEN_SECRET_FILE", "keys/token_secret")
+ACCESS_TOKEN_TTL = int(os.environ.get("ACCESS_TOKEN_TTL", "900"))  # Срок действия токена, секунды
+TOKEN_REFRESH_WINDOW = int(os.environ.get("TOKEN_REFRESH_WINDOW", str(7 * 24 * 3600)))  # Обновление после истечения
+LICENSE_CACHE_TTL = 60  # Сколько секунд помнить результат проверки лицензии по базе
+_token_secret = os.environ.get("TOKEN_SECRET")
+token_signer = TokenSigner(_token_secret.encode() if _token_secret else load_secret(TOKEN_SECRET_FILE),
+                           ACCESS_TOKEN_TTL)
+license_cache = TTLCache(LICENSE_CACHE_TTL)  # id пользователя -> есть ли активная лицензия
+quota_cache = TTLCache(LICENSE_CACHE_TTL)  # id пользователя -> Quota из активной лицензии
+
+# Ключи подписи лицензий загружаются один раз при запуске (см. license_keys.py)
+LICENSE_KEYS_DIR = os.environ.get("LICENSE_KEYS_DIR", "keys")
+license_keys = KeyRegistry(LICENSE_KEYS_DIR)
+LICENSE_BATCH_MAX = 10000  # Максимум лицензий в одном пакетном запросе
+# Токен администратора (заголовок X-Admin-Token) для назначения квот лицензиям; не задан - квоты не назначаются
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+LICENSE_VERIFY_INLINE = 64  # Пакеты меньше этого проверяются без пула: пересылка дороже проверки
+LICENSE_VERIFY_CHUNK = 256  # Сколько подписей отдавать процессу пула за раз
+LICENSE_VERIFY_WORKERS = int(os.environ.get("LICENSE_VERIFY_WORKERS", str(os.cpu_count() or 1)))
+# Процессы запускаются при первом пакетном запросе; spawn, а не fork, т.к. у сервера есть потоки
+license_verify_pool = ProcessPoolExecutor(LICENSE_VERIFY_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                          initializer=init_verify_worker, initargs=(LICENSE_KEYS_DIR,))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler = create_scheduler() if BACKGROUND_JOBS else None
+    if scheduler:
+        scheduler.start()
+    yield
+    if scheduler:
+        scheduler.stop()
+    license_verify_pool.shutdown(cancel_futures=True)
+    password_hasher.shutdown()
+
+
+def transfer_direction(method: str, path: str) -> Optional[str]:
+    """Направление передачи данных резервной копии для запроса или None."""
+    if method == "GET" and path.startswith("/backups/download/"):
+        return "download"
+    if method in ("POST", "PUT") and path.startswith(("/backups/upload", "/backups/sessions/", "/backups/chunks/")):
+        return "upload"
+    return None
+
+
+class MetricsMiddleware:
+    """
+    ASGI-посредник: длительность, число и объём данных запросов по шаблонам маршрутов.
+
+    Длительность считается до отправки последней порции ответа, поэтому для потоковых
+    скачиваний в неё входит вся передача. Метка route - шаблон пути ("/backups/download/{filename}"),
+    а не сам путь, чтобы число рядов метрик не зависело от имён файлов.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        received = sent = 0
+        status_code = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        direction = transfer_direction(scope["method"], scope["path"])
+        if direction:
+            ACTIVE_TRANSFERS.labels(direction).inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            if direction:
+                ACTIVE_TRANSFERS.labels(direction).dec()
+            # Маршрут известен после сопоставления пути (FastAPI записывает его в scope)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], route).observe(time.perf_counter() - start)
+            REQUESTS.labels(scope["method"], route, status_code).inc()
+            REQUEST_BYTES.labels(route).inc(received)
+            RESPONSE_BYTES.labels(route).inc(sent)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 # Константы
-BACKUP_DIR = "./backups"  # Основная папка для хранения резервных копий
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "./backups")  # Основная папка: локальное хранилище и части незавершённых загрузок
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")  # Хранилище объектов: local или s3 (storage.py)
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Размер блока потокового чтения/записи (1 МБ)
+CHUNK_PREFIX = "chunks"  # Префикс ключей хранилища блоков с адресацией по содержимому
+# INSERT ... ON CONFLICT для СУБД, которые его поддерживают (add_chunk_refs)
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+CHUNK_QUERY_BATCH = 500  # Сколько хешей блоков передавать в одном запросе IN (...)
+BACKUP_PAGE_SIZE = 100  # Размер страницы списка резервных копий по умолчанию
+BACKUP_PAGE_MAX = 1000  # Максимальный размер страницы
+
+
+def optional_int_env(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# Квота хранилища для лицензий без своей квоты (не задана - без ограничений)
+DEFAULT_QUOTA_BYTES = optional_int_env("DEFAULT_QUOTA_BYTES")
+DEFAULT_QUOTA_OBJECTS = optional_int_env("DEFAULT_QUOTA_OBJECTS")
+
+# Фоновые задачи (jobs.py): политики хранения и сборка мусора
+BACKGROUND_JOBS = os.environ.get("BACKGROUND_JOBS", "1") == "1"  # Запускать планировщик в процессе сервера
+# Файл блокировки: задачи по расписанию выполняет один процесс из запущенных на этой машине (jobs.py)
+JOBS_LOCK_FILE = os.environ.get("JOBS_LOCK_FILE", os.path.join(BACKUP_DIR, ".jobs.lock"))
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "3600"))  # Период применения политик, секунды
+GC_INTERVAL = int(os.environ.get("GC_INTERVAL", str(6 * 3600)))  # Период сборки мусора, секунды
+# Объекты без ссылок моложе этого срока не удаляются: их может записывать незавершённая загрузка
+GC_GRACE_PERIOD = int(os.environ.get("GC_GRACE_PERIOD", str(24 * 3600)))
+# Удалять ли файлы старого формата без записи в backups. По умолчанию выключено: старые версии
+# сервера сохраняли изменённый файл под именем с меткой времени, а запись - под исходным именем
+GC_LEGACY_FILES = os.environ.get("GC_LEGACY_FILES", "0") == "1"
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", str(7 * 24 * 3600)))  # Срок без новых блоков
+JOB_BATCH_SIZE = 500  # Записей или объектов в одной порции фоновой задачи
+JOB_BATCH_PAUSE = 0.05  # Пауза между порциями, секунды
+# Политика хранения по умолчанию для пользователей без своей (не задана - хранить всё)
+DEFAULT_RETENTION = {
+    "keep_last": optional_int_env("RETENTION_KEEP_LAST"),
+    "keep_daily": optional_int_env("RETENTION_KEEP_DAILY"),
+    "keep_weekly": optional_int_env("RETENTION_KEEP_WEEKLY"),
+    "keep_monthly": optional_int_env("RETENTION_KEEP_MONTHLY"),
+}
 os.makedirs(BACKUP_DIR, exist_ok=True)
+storage = create_storage(STORAGE_BACKEND, BACKUP_DIR)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -61,13 +300,35 @@ class Backup(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
+    # Имя, под которым клиент загрузил файл; версии одного файла (с меткой времени в filename)
+    # имеют одинаковое значение. NULL - запись создана до появления колонки
+    original_filename = Column(String, nullable=True)
     size = Column(Float, nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"))
     checksum = Column(String, nullable=False)  # Новое поле
+    manifest = Column(Text, nullable=True)  # JSON-список [хеш блока, размер]; NULL - файл целиком на диске
+    codec = Column(String, nullable=True)  # Кодек сжатия блоков на клиенте (compressors.py); NULL - без сжатия
 
     user = relationship("User", back_populates="backups")
 
+    __table_args__ = (
+        # Проверка дубликата при загрузке - поиск по индексу, без чтения файлов с диска
+        Index("ix_backups_user_filename_checksum", "user_id", "filename", "checksum", unique=True),
+        Index("ix_backups_user_checksum", "user_id", "checksum"),
+        # Постраничный вывод списка по (upload_date, id) без сортировки всех записей пользователя
+        Index("ix_backups_user_upload_date", "user_id", "upload_date", "id"),
+    )
+
+
+class Chunk(Base):
+    """Блок данных в хранилище с адресацией по содержимому."""
+    __tablename__ = "chunks"
+
+    hash = Column(String, primary_key=True)  # SHA-256 содержимого блока
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)  # Количество ссылок из манифестов
+
 
 class User(Base):
     __tablename__ = "users"
@@ -76,6 +337,11 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     encryption_key = Column(String)  # Уникальный ключ шифрования
+    # Политика хранения версий (apply_retention); все NULL - политика по умолчанию
+    retention_keep_last = Column(Integer, nullable=True)
+    retention_keep_daily = Column(Integer, nullable=True)
+    retention_keep_weekly = Column(Integer, nullable=True)
+    retention_keep_monthly = Column(Integer, nullable=True)
     backups = relationship("Backup", back_populates="user")
     licenses = relationship("License", back_populates="user")
 
@@ -89,10 +355,60 @@ class License(Base):
     license_data = Column(String, nullable=True)  # Данные цифровой лицензии
     signature = Column(String, nullable=True)  # Подпись цифровой лицензии
     user_id = Column(Integer, ForeignKey("users.id"))  # Привязка к пользователю
+    # Квота хранилища по лицензии; NULL - квота по умолчанию (DEFAULT_QUOTA_BYTES, DEFAULT_QUOTA_OBJECTS)
+    quota_bytes = Column(BigInteger, nullable=True)
+    quota_objects = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="licenses")
 
 
+class UserUsage(Base):
+    """
+    Занятое пользователем место: сумма размеров и число резервных копий.
+
+    Счётчики меняются в той же транзакции, что и записи backups (charge_usage,
+    release_usage), поэтому проверка квоты - чтение одной строки по ключу.
+    """
+    __tablename__ = "user_usage"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    bytes = Column(BigInteger, nullable=False, default=0)
+    objects = Column(Integer, nullable=False, default=0)
+
+
+class UploadSession(Base):
+    """Сессия возобновляемой загрузки: сервер хранит подтверждённое смещение."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, index=True)  # Идентификатор сессии (uuid)
+    filename = Column(String, nullable=False)
+    size = Column(Integer, nullable=True)  # Ожидаемый размер файла, если известен
+    offset = Column(Integer, default=0)  # Количество принятых и записанных байт
+    codec = Column(String, nullable=True)  # Кодек сжатия, указанный клиентом
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Время последнего принятого блока; NULL - сессия создана до появления колонки
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow)
+    user_id = Column(Integer, ForeignKey("users.id"))
+
+    user = relationship("User")
+
+
+class PendingChunk(Base):
+    """
+    Блок, загруженный пользователем через PUT /backups/chunks/{hash}, но ещё не вошедший в манифест.
+
+    Место под такие блоки не учтено в user_usage, поэтому их размер вычитается из квоты
+    (upload_quota_remaining), пока манифест не сошлётся на блок. Записи старше
+    GC_GRACE_PERIOD удаляет сборка мусора - вместе с объектами блоков без записи в chunks.
+    """
+    __tablename__ = "pending_chunks"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    hash = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
 class LicenseActivationRequest(BaseModel):
     key: str
 
@@ -100,6 +416,102 @@ class LicenseActivationRequest(BaseModel):
 Base.metadata.create_all(bind=engine)
 
 
+def iter_query_batches(items):
+    """Разбить список на порции для запросов IN (...)."""
+    items = list(items)
+    for i in range(0, len(items), CHUNK_QUERY_BATCH):
+        yield items[i:i + CHUNK_QUERY_BATCH]
+
+
+def remove_duplicate_backups(conn) -> int:
+    """
+    Удалить повторяющиеся записи (user_id, filename, checksum) перед созданием уникального индекса.
+
+    В старой базе один и тот же файл мог быть записан несколько раз. Остаётся самая ранняя
+    запись; у удалённых уменьшаются ссылки на блоки и счётчики занятого места. Файлы
+    старого формата не удаляются: у повторов тот же ключ в хранилище, что и у оставшейся
+    записи. Возвращает число удалённых записей.
+    """
+    backups = Backup.__table__
+    groups = select(backups.c.user_id, backups.c.filename, backups.c.checksum,
+                    func.min(backups.c.id).label("keep_id")).group_by(
+        backups.c.user_id, backups.c.filename, backups.c.checksum).having(func.count() > 1).subquery()
+    duplicates = conn.execute(
+        select(backups.c.id, backups.c.user_id, backups.c.size, backups.c.manifest).join(
+            groups, (backups.c.user_id == groups.c.user_id) & (backups.c.filename == groups.c.filename)
+            & (backups.c.checksum == groups.c.checksum) & (backups.c.id != groups.c.keep_id))
+    ).all()
+    if not duplicates:
+        return 0
+    refs = Counter()
+    released = defaultdict(lambda: [0, 0])  # id пользователя -> [байт, копий]
+    for row in duplicates:
+        if row.manifest:
+            refs.update(chunk_hash for chunk_hash, _ in json.loads(row.manifest))
+        released[row.user_id][0] += int(row.size or 0)
+        released[row.user_id][1] += 1
+    chunks = Chunk.__table__
+    for chunk_hash, count in refs.items():
+        conn.execute(update(chunks).where(chunks.c.hash == chunk_hash).values(refcount=chunks.c.refcount - count))
+    usage = UserUsage.__table__
+    for user_id, (size, objects) in released.items():
+        conn.execute(update(usage).where(usage.c.user_id == user_id).values(
+            bytes=usage.c.bytes - size, objects=usage.c.objects - objects))
+    for batch in iter_query_batches([row.id for row in duplicates]):
+        conn.execute(backups.delete().where(backups.c.id.in_(batch)))
+    return len(duplicates)
+
+
+def migrate_schema():
+    """Добавить в существующие таблицы новые nullable-колонки (create_all их не добавляет)."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    logger.info(f"В таблицу {table.name} добавлена колонка {column.name}")
+    # create_all не создаёт новые индексы для уже существующих таблиц
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == "ix_backups_user_filename_checksum":
+                with engine.begin() as conn:
+                    removed = remove_duplicate_backups(conn)
+                if removed:
+                    logger.warning(f"Удалено повторяющихся записей резервных копий: {removed}")
+            try:
+                index.create(bind=engine)
+                logger.info(f"Создан индекс {index.name}")
+            except (IntegrityError, OperationalError) as e:
+                if index.unique:
+                    # Без уникального индекса не обнаруживаются параллельные загрузки одного файла
+                    raise RuntimeError(f"Не удалось создать уникальный индекс {index.name}: {e}") from e
+                logger.error(f"Не удалось создать индекс {index.name}: {e}")
+
+
+migrate_schema()
+
+
+def backfill_usage():
+    """Посчитать счётчики занятого места для пользователей, у которых их ещё нет (один раз после обновления)."""
+    missing = select(User.id).where(~select(UserUsage.user_id).where(UserUsage.user_id == User.id).exists())
+    totals = select(
+        User.id, func.coalesce(func.sum(Backup.size), 0).cast(BigInteger), func.count(Backup.id)
+    ).select_from(User).outerjoin(Backup, Backup.user_id == User.id).where(User.id.in_(missing)).group_by(User.id)
+    with engine.begin() as conn:
+        result = conn.execute(UserUsage.__table__.insert().from_select(["user_id", "bytes", "objects"], totals))
+        if result.rowcount:
+            logger.info(f"Посчитано занятое место для пользователей: {result.rowcount}")
+
+
+backfill_usage()
+
+
 # Pydantic модели
 class UserCreate(BaseModel):
     username: str
@@ -115,11 +527,62 @@ class LicenseVerifyRequest(BaseModel):
     signature: str
 
 
+class RetentionPolicy(BaseModel):
+    keep_last: Optional[int] = None  # Последние N версий
+    keep_daily: Optional[int] = None  # Последняя версия за каждый из N последних дней с копиями
+    keep_weekly: Optional[int] = None  # ... за каждую из N последних недель
+    keep_monthly: Optional[int] = None  # ... за каждый из N последних месяцев
+
+
+class UsageResponse(BaseModel):
+    bytes: int
+    objects: int
+    quota_bytes: Optional[int] = None  # None - без ограничения
+    quota_objects: Optional[int] = None
+
+
+class LicenseBatchCreate(BaseModel):
+    username: str
+    count: int
+    quota_bytes: Optional[int] = None  # Квота хранилища выдаваемых лицензий (None - по умолчанию)
+    quota_objects: Optional[int] = None
+
+
+class LicenseBatchVerifyRequest(BaseModel):
+    items: List[LicenseVerifyRequest]
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: Optional[int] = None
+    codec: Optional[str] = None
+
+
+class UploadSessionComplete(BaseModel):
+    checksum: str
+
+
+class ChunkQuery(BaseModel):
+    hashes: List[str]
+    # Размер файла, который клиент собирается загрузить (в первом запросе delta sync):
+    # если он не помещается в квоту, загрузка отклоняется до отправки блоков
+    size: Optional[int] = None
+
+
+class ManifestCreate(BaseModel):
+    filename: str
+    checksum: str  # SHA-256 всего потока (последовательности блоков манифеста)
+    chunks: List[str]  # Хеши блоков в порядке следования
+    codec: Optional[str] = None  # Кодек сжатия блоков на клиенте
+
+
 class LicenseResponse(BaseModel):
     id: int
     key: str
     is_active: bool
     user_id: int | None = None
+    quota_bytes: int | None = None
+    quota_objects: int | None = None
 
     class Config:
         orm_mode = True
@@ -195,8 +658,17 @@ def check_license(
 """
 
 
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
+def password_hasher_busy() -> HTTPException:
+    logger.warning("Очередь хеширования паролей переполнена, запрос отклонён")
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Сервер перегружен, повторите попытку позже", headers={"Retry-After": "1"})
+
+
+async def get_password_hash(password: str):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
 
 
 def generate_encryption_key():
@@ -204,58 +676,929 @@ def generate_encryption_key():
     return Fernet.generate_key().decode()
 
 
-def authenticate_user(db, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not pwd_context.verify(password, user.hashed_password):
+def find_user(db: Session, username: str) -> Optional[User]:
+    return db.query(User).filter(User.username == username).first()
+
+
+async def authenticate_user(db, username: str, password: str):
+    user = await run_in_threadpool(find_user, db, username)
+    if not user:
         return False
+    try:
+        if not await password_hasher.verify(password, user.hashed_password):
+            return False
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
     return user
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
-    user = db.query(User).filter(User.id == int(token)).first()
-    if not user:
+class TokenUser(NamedTuple):
+    """Пользователь, восстановленный из утверждений токена (без запроса к базе)."""
+    id: int
+    username: str
+    license_active: bool
+
+
+def issue_access_token(db: Session, user: User) -> dict:
+    """Выпустить токен; состояние лицензии проверяется по базе один раз и записывается в токен."""
+    license_active = find_active_license(db, user.id) is not None
+    license_cache.set(user.id, license_active)
+    token = token_signer.issue({"sub": user.id, "name": user.username, "lic": license_active})
+    return {"access_token": token, "token_type": "bearer", "expires_in": ACCESS_TOKEN_TTL}
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenUser:
+    """Пользователь из подписанного токена: подпись и срок проверяются в памяти."""
+    try:
+        claims = token_signer.verify(token)
+        return TokenUser(int(claims["sub"]), claims["name"], bool(claims.get("lic")))
+    except (TokenError, KeyError, TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
 
 
 def get_user_backup_dir(user_id: int):
-    """Получить путь к папке пользователя для хранения резервных копий."""
+    """Локальная папка пользователя для частей незавершённых загрузок."""
     user_dir = os.path.join(BACKUP_DIR, str(user_id))
     os.makedirs(user_dir, exist_ok=True)
     return user_dir
 
 
-import os
+def get_chunk_key(chunk_hash: str) -> str:
+    """Ключ блока в хранилище: первые два символа хеша - подкаталог."""
+    return f"{CHUNK_PREFIX}/{chunk_hash[:2]}/{chunk_hash}"
+
+
+def get_legacy_key(user_id: int, filename: str) -> str:
+    """Ключ резервной копии старого формата, хранящейся целиком."""
+    if "/" in filename or filename in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail="Недопустимое имя файла")
+    return f"{user_id}/{filename}"
+
+
+def put_chunk(chunk_hash: str, data: bytes):
+    """Записать блок с уже посчитанным хешем, если его ещё нет в хранилище."""
+    chunk_key = get_chunk_key(chunk_hash)
+    if not storage.exists(chunk_key):
+        storage.put(chunk_key, data)
+
 
+def write_chunk(data: bytes) -> str:
+    """Записать блок в хранилище, если его там ещё нет. Возвращает хеш блока."""
+    chunk_hash = sha256(data).hexdigest()
+    put_chunk(chunk_hash, data)
+    return chunk_hash
 
-def sign_license(data: str, private_key_path: str) -> str:
+
+def find_stored_chunks(db: Session, chunk_hashes) -> dict:
+    """
+    Размеры блоков, которые есть в хранилище: {хеш: размер}.
+
+    Блоки, на которые есть ссылки, берутся из таблицы chunks; хранилище опрашивается
+    только для остальных (например, загруженных, но ещё не вошедших в манифест).
     """
-    Подписать данные лицензии с использованием приватного ключа.
+    chunk_hashes = [chunk_hash for chunk_hash in dict.fromkeys(chunk_hashes) if is_chunk_hash(chunk_hash)]
+    found = {}
+    for batch in iter_query_batches(chunk_hashes):
+        found.update(db.query(Chunk.hash, Chunk.size).filter(Chunk.hash.in_(batch), Chunk.refcount > 0).all())
+    for chunk_hash in chunk_hashes:
+        if chunk_hash not in found:
+            object_stat = storage.stat(get_chunk_key(chunk_hash))
+            if object_stat is not None:
+                found[chunk_hash] = object_stat.size
+    return found
+
+
+class ChunkIngest:
     """
-    if not os.path.exists(private_key_path):
-        logger.error(f"Приватный ключ не найден: {private_key_path}")
-        raise HTTPException(status_code=500, detail="Приватный ключ не найден")
+    Потоковый приём файла в хранилище блоков.
 
-    with open(private_key_path, "rb") as f:
-        private_key = load_pem_private_key(f.read(), password=None)
+    Зашифрованный контейнер клиента (container.py) разбивается по границам кадров:
+    кадры детерминированы, поэтому совпадают с блоками, загруженными через delta sync.
+    Остальные данные разбиваются на блоки по содержимому. На диск попадают только блоки,
+    которых ещё нет в хранилище. Параллельно считается SHA-256 всего файла.
+    """
 
-    signature = private_key.sign(
-        data.encode(),
-        padding.PKCS1v15(),
-        hashes.SHA256()
+    def __init__(self):
+        self.splitter = None  # Chunker или FrameSplitter, выбирается по первым байтам
+        self.digest = sha256()
+        self.size = 0
+        self.manifest = []  # Список [хеш блока, размер]
+        self._head = b""
+        self.hash_seconds = 0.0  # Время разбиения и хеширования
+        self.write_seconds = 0.0  # Время записи блоков в хранилище
+
+    def _store(self, chunks):
+        for chunk in chunks:
+            start = time.perf_counter()
+            chunk_hash = sha256(chunk).hexdigest()
+            hashed = time.perf_counter()
+            put_chunk(chunk_hash, chunk)
+            self.hash_seconds += hashed - start
+            self.write_seconds += time.perf_counter() - hashed
+            self.manifest.append([chunk_hash, len(chunk)])
+
+    def _split(self, data: bytes, final: bool = False) -> list:
+        if self.splitter is None:
+            self._head += data
+            if len(self._head) < len(CONTAINER_MAGIC) and not final:
+                return []
+            is_container = self._head[:len(CONTAINER_MAGIC)] in CONTAINER_MAGICS
+            self.splitter = FrameSplitter() if is_container else Chunker()
+            data, self._head = self._head, b""
+        try:
+            chunks = self.splitter.update(data)
+            if final:
+                chunks += self.splitter.finish()
+        except ContainerError as e:
+            raise HTTPException(status_code=400, detail=f"Повреждённый контейнер: {e}")
+        return chunks
+
+    def update(self, data: bytes):
+        start = time.perf_counter()
+        self.digest.update(data)
+        self.size += len(data)
+        chunks = self._split(data)
+        self.hash_seconds += time.perf_counter() - start
+        self._store(chunks)
+
+    def finish(self):
+        """Записать последний блок. Возвращает (манифест, размер, контрольная сумма)."""
+        self._store(self._split(b"", final=True))
+        UPLOAD_STAGE_SECONDS.labels("hash").observe(self.hash_seconds)
+        UPLOAD_STAGE_SECONDS.labels("write").observe(self.write_seconds)
+        return self.manifest, self.size, self.digest.hexdigest()
+
+
+def save_upload_stream(file: UploadFile):
+    """
+    Потоково принять загружаемый файл в хранилище блоков.
+
+    Файл читается порциями по UPLOAD_CHUNK_SIZE, поэтому потребление памяти не зависит
+    от размера файла. Функция блокирующая (диск, хеширование) - вызывать из пула потоков.
+    Возвращает (манифест, размер, контрольная сумма).
+    """
+    ingest = ChunkIngest()
+    for data in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b""):
+        ingest.update(data)
+    return ingest.finish()
+
+
+def open_session_part(part_path: str, offset: int):
+    """Открыть файл сессии для дозаписи, отбросив неподтверждённый хвост от прерванной записи."""
+    buffer = open(part_path, "r+b")
+    buffer.truncate(offset)
+    buffer.seek(offset)
+    return buffer
+
+
+def store_chunk_data(chunk_hash: str, data: bytes):
+    """Проверить хеш блока и записать его в хранилище (блокирующая функция)."""
+    if sha256(data).hexdigest() != chunk_hash:
+        raise HTTPException(status_code=400, detail="Хеш блока не совпадает с содержимым")
+    put_chunk(chunk_hash, data)
+
+
+def add_chunk_refs(db: Session, manifest: list):
+    """
+    Увеличить счётчики ссылок на блоки манифеста (в текущей транзакции).
+
+    В SQLite и PostgreSQL счётчики обновляются одним INSERT ... ON CONFLICT DO UPDATE:
+    параллельные загрузки файлов с общими новыми блоками не конфликтуют по первичному
+    ключу и не теряют приращения друг друга.
+
+    Объекты блоков удаляет только сборщик мусора, и делает это до фиксации удаления
+    записей (remove_unreferenced_chunks). Поэтому после обновления счётчиков объект мог
+    пропасть лишь у блоков, на которые до этого не было ссылок: их наличие проверяется,
+    и при отсутствии возвращается 409.
+    """
+    counts = Counter(chunk_hash for chunk_hash, _ in manifest)
+    sizes = dict((chunk_hash, size) for chunk_hash, size in manifest)
+    dialect = db.get_bind().dialect.name
+    for batch in iter_query_batches(counts):
+        if dialect in UPSERT_INSERTS:
+            rows = [{"hash": chunk_hash, "size": sizes[chunk_hash], "refcount": counts[chunk_hash]}
+                    for chunk_hash in batch]
+            statement = UPSERT_INSERTS[dialect](Chunk).values(rows)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[Chunk.hash], set_={"refcount": Chunk.refcount + statement.excluded.refcount}))
+            for chunk in db.identity_map.values():
+                if isinstance(chunk, Chunk) and chunk.hash in counts:
+                    db.expire(chunk)  # Счётчик изменён в обход объекта
+        else:
+            existing = {chunk.hash: chunk for chunk in db.query(Chunk).filter(Chunk.hash.in_(batch))}
+            for chunk_hash in batch:
+                if chunk_hash in existing:
+                    existing[chunk_hash].refcount += counts[chunk_hash]
+                else:
+                    db.add(Chunk(hash=chunk_hash, size=sizes[chunk_hash], refcount=counts[chunk_hash]))
+            db.flush()
+        # Счётчик равен нашему приращению - ссылок до этой загрузки не было
+        revived = [chunk_hash for chunk_hash, refcount in
+                   db.query(Chunk.hash, Chunk.refcount).filter(Chunk.hash.in_(batch))
+                   if refcount == counts[chunk_hash]]
+        if not all(storage.exists(get_chunk_key(chunk_hash)) for chunk_hash in revived):
+            raise HTTPException(status_code=409, detail="Блок данных был удалён во время загрузки, повторите")
+
+
+def release_chunk_refs(db: Session, manifest: list) -> int:
+    """
+    Уменьшить счётчики ссылок на блоки манифеста (в текущей транзакции).
+
+    Блоки без ссылок остаются в базе и в хранилище до сборки мусора
+    (remove_unreferenced_chunks): удалять их здесь небезопасно, на них может сослаться
+    параллельная загрузка. Возвращает число блоков, оставшихся без ссылок.
+    """
+    counts = Counter(chunk_hash for chunk_hash, _ in manifest)
+    unreferenced = 0
+    for batch in iter_query_batches(counts):
+        for chunk in db.query(Chunk).filter(Chunk.hash.in_(batch)):
+            chunk.refcount -= counts[chunk.hash]
+            if chunk.refcount <= 0:
+                unreferenced += 1
+    return unreferenced
+
+
+def remove_chunk_files(chunk_hashes: list):
+    """Удалить из хранилища блоки, на которые больше нет ссылок."""
+    for chunk_hash in chunk_hashes:
+        storage.delete(get_chunk_key(chunk_hash))
+
+
+def iter_segments(segments: list, start: int, end: int):
+    """
+    Отдать байты [start, end] (включительно) из последовательности объектов-сегментов.
+
+    segments - список (ключ в хранилище, размер): блоки манифеста или один файл старого
+    формата. Читаются только сегменты, пересекающиеся с диапазоном.
+    """
+    pos = 0
+    for key, size in segments:
+        segment_start, pos = pos, pos + size
+        if pos <= start:
+            continue
+        if segment_start > end:
+            break
+        yield from storage.get_range(key, max(start - segment_start, 0), min(end, pos - 1) - segment_start)
+
+
+def parse_range(range_header: Optional[str], size: int):
+    """
+    Разобрать заголовок Range с одним диапазоном байт.
+
+    Возвращает (start, end) включительно или None, если отдавать нужно весь файл
+    (заголовка нет, он некорректен или содержит несколько диапазонов).
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_value, _, end_value = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_value:
+            # bytes=-N: последние N байт
+            start, end = max(size - int(end_value), 0), size - 1
+        else:
+            start = int(start_value)
+            end = min(int(end_value), size - 1) if end_value else size - 1
+    except ValueError:
+        return None
+    if start < 0 or start > end:
+        raise HTTPException(status_code=416, detail="Недопустимый диапазон",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def content_disposition(filename: str) -> str:
+    """Заголовок Content-Disposition с поддержкой не-ASCII имён файлов (RFC 6266)."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def ranged_response(request: Request, segments: list, size: int, etag: str, filename: str):
+    """Потоковый ответ с поддержкой Range/If-Range и ETag."""
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": content_disposition(filename),
+    }
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    # If-Range: диапазон отдаётся только если файл не изменился с прошлой загрузки
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_segments(segments, 0, size - 1), media_type="application/octet-stream",
+                                 headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_segments(segments, start, end), status_code=206,
+                             media_type="application/octet-stream", headers=headers)
+
+
+def is_chunk_hash(value: str) -> bool:
+    """Проверить, что строка - шестнадцатеричный SHA-256."""
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def find_backup(db: Session, user: TokenUser, filename: str) -> Optional[Backup]:
+    """Последняя версия резервной копии пользователя с указанным именем."""
+    return db.query(Backup).filter(
+        Backup.user_id == user.id,
+        Backup.filename == filename,
+    ).order_by(Backup.id.desc()).first()
+
+
+def is_version_of(candidate: str, filename: str) -> bool:
+    """Является ли candidate именем filename или его версией с меткой времени (см. store_backup)."""
+    if candidate == filename:
+        return True
+    base, ext = os.path.splitext(filename)
+    return re.fullmatch(re.escape(base) + r"_\d{14}" + re.escape(ext), candidate) is not None
+
+
+def find_duplicate_backup(db: Session, user: TokenUser, filename: str, checksum: str) -> Optional[Backup]:
+    """
+    Найти уже сохранённую копию этого файла с тем же содержимым.
+
+    Поиск идёт по индексу (user_id, checksum), поэтому повторная загрузка любой из
+    сохранённых версий файла распознаётся без чтения данных с диска.
+    """
+    candidates = db.query(Backup).filter(Backup.user_id == user.id, Backup.checksum == checksum)
+    for backup in candidates:
+        if is_version_of(backup.filename, filename):
+            return backup
+    return None
+
+
+def find_active_licenses(db: Session, user_id: int) -> list:
+    """Активные лицензии пользователя с действительной подписью (запрос к базе)."""
+    active_licenses = []
+    for active_license in db.query(License).filter(License.user_id == user_id, License.is_active == True
+                                                   ).order_by(License.id):
+        # Проверка цифровой лицензии
+        if active_license.license_data and active_license.signature:
+            if not check_license_signature(active_license.license_data, active_license.signature):
+                logger.warning(f"Недействительная подпись лицензии {active_license.id} пользователя {user_id}")
+                continue
+        active_licenses.append(active_license)
+    return active_licenses
+
+
+def find_active_license(db: Session, user_id: int) -> Optional[License]:
+    """Активная лицензия пользователя (запрос к базе)."""
+    active_licenses = find_active_licenses(db, user_id)
+    return active_licenses[0] if active_licenses else None
+
+
+def check_active_license(db: Session, user: TokenUser):
+    """
+    Проверить, что у пользователя есть активная лицензия.
+
+    Если лицензия была активна при выпуске токена, база не запрашивается. Иначе (например,
+    лицензию активировали после входа) результат проверки по базе кэшируется на
+    LICENSE_CACHE_TTL секунд.
+    """
+    if user.license_active:
+        return
+    license_active = license_cache.get(user.id)
+    if license_active is None:
+        license_active = find_active_license(db, user.id) is not None
+        license_cache.set(user.id, license_active)
+    if not license_active:
+        raise HTTPException(status_code=403, detail="Нет активной лицензии")
+
+
+class Quota(NamedTuple):
+    """Ограничения хранилища пользователя; None - без ограничения."""
+    bytes: Optional[int]
+    objects: Optional[int]
+
+
+def largest_quota(values) -> Optional[int]:
+    """Наибольшая из квот; None (без ограничения) больше любой."""
+    values = list(values)
+    return None if None in values else max(values)
+
+
+def get_user_quota(db: Session, user_id: int) -> Quota:
+    """
+    Квота пользователя по активным лицензиям (кэшируется на LICENSE_CACHE_TTL секунд).
+
+    Лицензия без своей квоты даёт квоту по умолчанию. Если активных лицензий несколько,
+    действует наибольшая квота каждого вида.
+    """
+    quota = quota_cache.get(user_id)
+    if quota is None:
+        active_licenses = find_active_licenses(db, user_id)
+        if not active_licenses:
+            quota = Quota(DEFAULT_QUOTA_BYTES, DEFAULT_QUOTA_OBJECTS)
+        else:
+            quota = Quota(
+                largest_quota(DEFAULT_QUOTA_BYTES if active_license.quota_bytes is None
+                              else active_license.quota_bytes for active_license in active_licenses),
+                largest_quota(DEFAULT_QUOTA_OBJECTS if active_license.quota_objects is None
+                              else active_license.quota_objects for active_license in active_licenses),
+            )
+        quota_cache.set(user_id, quota)
+    return quota
+
+
+def get_usage(db: Session, user_id: int) -> UserUsage:
+    """Счётчики занятого места пользователя; строка создаётся при первом обращении."""
+    usage = db.get(UserUsage, user_id)
+    if usage is None:
+        usage = UserUsage(user_id=user_id, bytes=0, objects=0)
+        db.add(usage)
+        db.flush()
+    return usage
+
+
+def quota_exceeded() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Превышена квота хранилища")
+
+
+def check_quota(db: Session, user: TokenUser, size: Optional[int], objects: int = 1):
+    """
+    Проверить, что у пользователя хватает квоты на ещё size байт и objects копий.
+
+    Это предварительная проверка до приёма данных (например, по Content-Length);
+    окончательно квота списывается в charge_usage.
+    """
+    quota = get_user_quota(db, user.id)
+    if quota.bytes is None and quota.objects is None:
+        return
+    usage = db.get(UserUsage, user.id)
+    used_bytes, used_objects = (usage.bytes, usage.objects) if usage else (0, 0)
+    db.rollback()  # Не держать транзакцию чтения, пока принимается тело запроса
+    if quota.bytes is not None and size is not None and used_bytes + size > quota.bytes:
+        raise quota_exceeded()
+    if quota.objects is not None and used_objects + objects > quota.objects:
+        raise quota_exceeded()
+
+
+def upload_quota_remaining(db: Session, user: TokenUser) -> Optional[int]:
+    """
+    Сколько байт пользователь ещё может передать в сессии загрузки; None - без ограничения.
+
+    Кроме сохранённых копий учитываются байты, уже принятые во всех его незавершённых сессиях,
+    и блоки delta sync, ещё не вошедшие в манифест (PendingChunk).
+    """
+    quota = get_user_quota(db, user.id)
+    if quota.bytes is None:
+        return None
+    usage = db.get(UserUsage, user.id)
+    sessions = db.query(func.coalesce(func.sum(UploadSession.offset), 0)).filter(
+        UploadSession.user_id == user.id).scalar()
+    chunks = db.query(func.coalesce(func.sum(PendingChunk.size), 0)).filter(
+        PendingChunk.user_id == user.id).scalar()
+    return quota.bytes - (usage.bytes if usage else 0) - sessions - chunks
+
+
+def add_pending_chunk(db: Session, user_id: int, chunk_hash: str, size: int):
+    """Учесть загруженный блок, на который ещё не ссылается манифест пользователя."""
+    dialect = db.get_bind().dialect.name
+    if dialect in UPSERT_INSERTS:
+        db.execute(UPSERT_INSERTS[dialect](PendingChunk).values(
+            user_id=user_id, hash=chunk_hash, size=size, created_at=datetime.utcnow()).on_conflict_do_nothing())
+    elif db.get(PendingChunk, (user_id, chunk_hash)) is None:
+        db.add(PendingChunk(user_id=user_id, hash=chunk_hash, size=size))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # Тот же блок параллельно учёл другой запрос
+
+
+def release_pending_chunks(db: Session, user_id: int, chunk_hashes):
+    """Перестать учитывать блоки, на которые сослался манифест: их размер уже в user_usage."""
+    for batch in iter_query_batches(dict.fromkeys(chunk_hashes)):
+        db.query(PendingChunk).filter(PendingChunk.user_id == user_id, PendingChunk.hash.in_(batch)).delete(
+            synchronize_session=False)
+    db.commit()
+
+
+def charge_usage(db: Session, user_id: int, size: int, objects: int = 1):
+    """
+    Учесть новые резервные копии в счётчиках (в текущей транзакции).
+
+    Проверка квоты и увеличение счётчиков - один UPDATE с условием, поэтому параллельные
+    загрузки не превысят квоту вместе. Если квоты не хватает - HTTPException 413.
+    """
+    quota = get_user_quota(db, user_id)
+    get_usage(db, user_id)
+    statement = update(UserUsage).where(UserUsage.user_id == user_id).values(
+        bytes=UserUsage.bytes + size, objects=UserUsage.objects + objects)
+    if quota.bytes is not None:
+        statement = statement.where(UserUsage.bytes + size <= quota.bytes)
+    if quota.objects is not None:
+        statement = statement.where(UserUsage.objects + objects <= quota.objects)
+    if db.execute(statement.execution_options(synchronize_session=False)).rowcount == 0:
+        raise quota_exceeded()
+
+
+def release_usage(db: Session, user_id: int, size: int, objects: int = 1):
+    """Уменьшить счётчики после удаления резервных копий (в текущей транзакции)."""
+    db.execute(update(UserUsage).where(UserUsage.user_id == user_id).values(
+        bytes=UserUsage.bytes - size, objects=UserUsage.objects - objects).execution_options(
+        synchronize_session=False))
+
+
+def check_codec(codec: Optional[str]):
+    """Проверить имя кодека сжатия, указанное клиентом."""
+    if codec is not None and codec not in KNOWN_CODECS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный кодек: {codec}")
+
+
+def add_backup(db: Session, user: TokenUser, filename: str, manifest: list, file_size: int, checksum: str,
+               codec: Optional[str] = None) -> Optional[Backup]:
+    """
+    Добавить резервную копию в текущую транзакцию, не фиксируя её.
+
+    Если этот файл (или одна из его версий) уже сохранён с той же контрольной суммой,
+    возвращает None. Если содержимое отличается, новая версия сохраняется под именем
+    с меткой времени. Запись сразу отправляется в базу (flush), чтобы следующие файлы
+    той же транзакции видели её и новые блоки при проверке дубликатов.
+    """
+    if find_duplicate_backup(db, user, filename, checksum) is not None:
+        logger.info(f"Файл {filename} уже существует и идентичен новому. Пропускаем загрузку.", extra=SAMPLED)
+        return None
+
+    original_filename = filename
+    # Проверяем существование файла с таким же именем
+    if find_backup(db, user, filename) is not None:
+        # Файлы разные, генерируем новое имя
+        base, ext = os.path.splitext(filename)
+        new_filename = f"{base}_{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}"
+        logger.warning(
+            f"Файл {filename} уже существует, но содержимое отличается. Используется имя {new_filename}")
+        filename = new_filename
+
+    # Сохранение метаинформации, ссылок на блоки и занятого места в одной транзакции
+    charge_usage(db, user.id, file_size)
+    add_chunk_refs(db, manifest)
+    new_backup = Backup(
+        filename=filename,
+        original_filename=original_filename,
+        size=file_size,
+        user_id=user.id,
+        checksum=checksum,
+        manifest=json.dumps(manifest),
+        codec=codec,
     )
+    db.add(new_backup)
+    db.flush()
+    return new_backup
+
+
+def store_backup(db: Session, user: TokenUser, filename: str, manifest: list, file_size: int, checksum: str,
+                 codec: Optional[str] = None) -> Optional[Backup]:
+    """Записать принятую резервную копию в базу отдельной транзакцией (см. add_backup)."""
+    try:
+        new_backup = add_backup(db, user, filename, manifest, file_size, checksum, codec)
+        if new_backup is None:
+            return None
+        db.commit()
+    except IntegrityError:
+        # Такой же файл параллельно сохранил другой запрос
+        db.rollback()
+        logger.info(f"Файл {filename} уже сохранён параллельным запросом. Пропускаем загрузку.", extra=SAMPLED)
+        return None
+    db.refresh(new_backup)
+    logger.info(f"Файл {new_backup.filename} успешно сохранён ({len(manifest)} блоков)", extra=SAMPLED)
+    return new_backup
+
+
+def get_upload_session(db: Session, user: TokenUser, upload_id: str) -> UploadSession:
+    """Найти сессию загрузки текущего пользователя."""
+    upload_session = db.query(UploadSession).filter(
+        UploadSession.id == upload_id,
+        UploadSession.user_id == user.id,
+    ).first()
+    if not upload_session:
+        raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+    return upload_session
+
+
+def get_session_part_path(user_dir: str, upload_id: str) -> str:
+    """Путь к временному файлу сессии возобновляемой загрузки."""
+    return os.path.join(user_dir, f".session_{upload_id}.part")
 
-    return base64.b64encode(signature).decode()
+
+def sign_license(data: str):
+    """Подписать данные лицензии текущим ключом. Возвращает (данные с идентификатором ключа, подпись)."""
+    data = f"{data};KID:{license_keys.current_kid}"
+    return data, license_keys.sign(data)
+
+
+def check_license_signature(data: str, signature: str) -> bool:
+    """Проверить подпись лицензии ключом, которым она была выпущена."""
+    return license_keys.verify(data, signature, license_key_id(data))
+
+
+# Фоновые задачи: политики хранения и сборка мусора (расписание - jobs.py)
+RETENTION_PERIODS = (
+    ("keep_daily", lambda date: date.date()),
+    ("keep_weekly", lambda date: date.isocalendar()[:2]),
+    ("keep_monthly", lambda date: (date.year, date.month)),
+)
+
+
+def version_series(filename: str) -> str:
+    """Имя filename без метки времени, которую add_backup добавляет новым версиям файла."""
+    base, ext = os.path.splitext(filename)
+    match = re.fullmatch(r"(.*)_\d{14}", base)
+    return (match.group(1) if match else base) + ext
+
+
+def retention_series(row, filenames: set) -> str:
+    """
+    Имя, по которому версии файла группируются для политик хранения.
+
+    Используется сохранённое исходное имя. У старых записей его нет: копия с меткой
+    времени считается версией файла, только если у пользователя есть запись с исходным
+    именем. Иначе это отдельный файл - клиент мог сам назвать его report_20240101120000.txt.
+    """
+    if row.original_filename:
+        return row.original_filename
+    series = version_series(row.filename)
+    return series if series in filenames else row.filename
+
+
+def get_retention_policy(user) -> dict:
+    """Политика хранения пользователя или политика по умолчанию."""
+    policy = {name: getattr(user, f"retention_{name}") for name in DEFAULT_RETENTION}
+    return policy if any(policy.values()) else DEFAULT_RETENTION
+
+
+def select_expired_backups(versions: list, policy: dict) -> list:
+    """
+    Выбрать версии одного файла, не попадающие под политику хранения.
+
+    versions - строки (id, upload_date), от новых к старым. Сохраняются последние keep_last
+    версий и самая новая версия в каждом из keep_daily последних дней (недель, месяцев),
+    в которые были копии. Самая новая версия сохраняется всегда.
+    """
+    if not any(policy.values()) or not versions:
+        return []
+    keep = {versions[0].id}
+    keep.update(version.id for version in versions[:policy["keep_last"] or 0])
+    for name, period_of in RETENTION_PERIODS:
+        if not policy[name]:
+            continue
+        periods = set()
+        for version in versions:
+            period = period_of(version.upload_date)
+            if period in periods:
+                continue
+            periods.add(period)
+            keep.add(version.id)
+            if len(periods) == policy[name]:
+                break
+    return [version.id for version in versions if version.id not in keep]
+
+
+def delete_backups(db: Session, backup_ids: list) -> int:
+    """
+    Удалить резервные копии пачкой.
+
+    Записи и ссылки на блоки удаляются одной транзакцией, затем из хранилища удаляются
+    файлы старого формата; блоки без ссылок удалит сборка мусора. Возвращает число
+    удалённых копий.
+    """
+    rows = db.query(Backup.id, Backup.user_id, Backup.filename, Backup.manifest, Backup.size).filter(
+        Backup.id.in_(backup_ids)).all()
+    manifest = []
+    legacy_keys = []
+    released = defaultdict(lambda: [0, 0])  # id пользователя -> [байт, копий]
+    for row in rows:
+        released[row.user_id][0] += int(row.size or 0)
+        released[row.user_id][1] += 1
+        if row.manifest:
+            manifest.extend(json.loads(row.manifest))
+        else:
+            legacy_keys.append(get_legacy_key(row.user_id, row.filename))
+    release_chunk_refs(db, manifest)
+    db.query(Backup).filter(Backup.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+    for user_id, (size, objects) in released.items():
+        release_usage(db, user_id, size, objects)
+    db.commit()
+    for key in legacy_keys:
+        storage.delete(key)
+    return len(rows)
+
+
+def apply_retention() -> dict:
+    """Удалить версии файлов, не попадающие под политики хранения пользователей."""
+    stats = Counter()
+    with SessionLocal() as db:
+        users = db.query(User).all()
+        for user in users:
+            policy = get_retention_policy(user)
+            if not any(policy.values()):
+                continue
+            rows = db.query(Backup.id, Backup.filename, Backup.original_filename, Backup.upload_date).filter(
+                Backup.user_id == user.id).order_by(Backup.upload_date.desc(), Backup.id.desc()).all()
+            filenames = {row.filename for row in rows}
+            series = {}
+            for row in rows:
+                series.setdefault(retention_series(row, filenames), []).append(row)
+            expired = [backup_id for versions in series.values()
+                       for backup_id in select_expired_backups(versions, policy)]
+            for batch in iter_query_batches(expired):
+                deleted = delete_backups(db, batch)
+                stats["expired_backups"] += deleted
+                JOB_REMOVED.labels("expired_backups").inc(deleted)
+                time.sleep(JOB_BATCH_PAUSE)
+            if expired:
+                logger.info(f"Политика хранения: у пользователя {user.username} удалено версий: {len(expired)}")
+    return dict(stats)
+
+
+def remove_unreferenced_chunks(db: Session) -> int:
+    """
+    Удалить записи блоков с нулевым счётчиком ссылок и их объекты.
+
+    Объекты удаляются до фиксации удаления записей, пока удалённые строки заблокированы:
+    загрузка, ссылающаяся на тот же блок, дождётся фиксации, создаст запись заново и
+    увидит, что объекта нет (add_chunk_refs).
+    """
+    removed = 0
+    while True:
+        hashes = [chunk_hash for (chunk_hash,) in
+                  db.query(Chunk.hash).filter(Chunk.refcount <= 0).limit(JOB_BATCH_SIZE)]
+        if not hashes:
+            return removed
+        db.query(Chunk).filter(Chunk.hash.in_(hashes), Chunk.refcount <= 0).delete(synchronize_session=False)
+        # Блок, на который успели сослаться между выборкой и удалением, остаётся в базе - его объект не трогаем
+        kept = {chunk_hash for (chunk_hash,) in db.query(Chunk.hash).filter(Chunk.hash.in_(hashes))}
+        deleted = [chunk_hash for chunk_hash in hashes if chunk_hash not in kept]
+        remove_chunk_files(deleted)
+        db.commit()
+        removed += len(deleted)
+        time.sleep(JOB_BATCH_PAUSE)
+
+
+def iter_key_batches(prefix: str):
+    """Ключи объектов хранилища с префиксом prefix порциями по JOB_BATCH_SIZE."""
+    batch = []
+    for key in storage.list(prefix):
+        batch.append(key)
+        if len(batch) == JOB_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def remove_stale_objects(keys: list, cutoff: float) -> int:
+    """Удалить объекты, изменённые раньше cutoff (секунды с начала эпохи)."""
+    removed = 0
+    for key in keys:
+        object_stat = storage.stat(key)
+        if object_stat is not None and object_stat.modified < cutoff:
+            storage.delete(key)
+            removed += 1
+    return removed
+
+
+def remove_orphan_objects(db: Session, cutoff: float) -> int:
+    """
+    Удалить объекты хранилища, на которые нет записей в базе: блоки без записи в chunks
+    (например, загруженные через delta sync без манифеста) и, при GC_LEGACY_FILES=1, файлы
+    старого формата без записи в backups. Объекты моложе cutoff не трогаются.
+    """
+    removed = 0
+    for keys in iter_key_batches(f"{CHUNK_PREFIX}/"):
+        hashes = {key.rsplit("/", 1)[-1]: key for key in keys}
+        known = {chunk_hash for (chunk_hash,) in db.query(Chunk.hash).filter(Chunk.hash.in_(list(hashes)))}
+        db.rollback()  # Не держать транзакцию чтения между порциями
+        removed += remove_stale_objects([key for chunk_hash, key in hashes.items()
+                                         if is_chunk_hash(chunk_hash) and chunk_hash not in known], cutoff)
+        time.sleep(JOB_BATCH_PAUSE)
+    if not GC_LEGACY_FILES:
+        return removed
+
+    user_ids = [user_id for (user_id,) in db.query(User.id)]
+    for user_id in user_ids:
+        for keys in iter_key_batches(f"{user_id}/"):
+            filenames = {key.split("/", 1)[1]: key for key in keys}
+            # Версия с меткой времени могла быть записана под исходным именем файла
+            candidates = set(filenames) | {version_series(filename) for filename in filenames}
+            known = {filename for (filename,) in db.query(Backup.filename).filter(
+                Backup.user_id == user_id, Backup.manifest.is_(None), Backup.filename.in_(list(candidates)))}
+            db.rollback()
+            removed += remove_stale_objects([key for filename, key in filenames.items()
+                                             if filename not in known and version_series(filename) not in known],
+                                            cutoff)
+            time.sleep(JOB_BATCH_PAUSE)
+    return removed
+
+
+def remove_expired_upload_sessions(db: Session, cutoff: datetime) -> int:
+    """
+    Удалить незавершённые загрузки без активности с cutoff вместе с их временными файлами.
+
+    Срок отсчитывается от последнего принятого блока, поэтому долгая загрузка, которая
+    продолжается, не удаляется.
+    """
+    removed = 0
+    last_activity = func.coalesce(UploadSession.updated_at, UploadSession.created_at)
+    while True:
+        sessions = db.query(UploadSession.id, UploadSession.user_id).filter(
+            last_activity < cutoff).limit(JOB_BATCH_SIZE).all()
+        if not sessions:
+            return removed
+        db.query(UploadSession).filter(UploadSession.id.in_([upload_session.id for upload_session in sessions])
+                                       ).delete(synchronize_session=False)
+        db.commit()
+        for upload_session in sessions:
+            part_path = get_session_part_path(os.path.join(BACKUP_DIR, str(upload_session.user_id)), upload_session.id)
+            try:
+                os.remove(part_path)
+            except FileNotFoundError:
+                pass
+        removed += len(sessions)
+        time.sleep(JOB_BATCH_PAUSE)
+
+
+def remove_expired_pending_chunks(db: Session, cutoff: datetime) -> int:
+    """Перестать учитывать в квоте блоки, загруженные раньше cutoff и так и не вошедшие в манифест."""
+    removed = db.query(PendingChunk).filter(PendingChunk.created_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+
+def collect_garbage() -> dict:
+    """Освободить место: блоки без ссылок, объекты без записей в базе, брошенные загрузки."""
+    stats = {}
+    with SessionLocal() as db:
+        stats["chunks"] = remove_unreferenced_chunks(db)
+        stats["orphan_objects"] = remove_orphan_objects(db, time.time() - GC_GRACE_PERIOD)
+        stats["upload_sessions"] = remove_expired_upload_sessions(
+            db, datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL))
+        stats["pending_chunks"] = remove_expired_pending_chunks(
+            db, datetime.utcnow() - timedelta(seconds=GC_GRACE_PERIOD))
+    for kind, count in stats.items():
+        JOB_REMOVED.labels(kind).inc(count)
+    return stats
+
+
+def create_scheduler() -> JobScheduler:
+    scheduler = JobScheduler(JOBS_LOCK_FILE)
+    scheduler.add("retention", RETENTION_INTERVAL, apply_retention)
+    scheduler.add("gc", GC_INTERVAL, collect_garbage)
+    return scheduler
 
 
 # Маршруты
 templates = Jinja2Templates(directory="templates")
 
 
+@app.get("/retention", response_model=RetentionPolicy)
+def get_retention(current_user: TokenUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Действующая политика хранения версий пользователя."""
+    return RetentionPolicy(**get_retention_policy(db.get(User, current_user.id)))
+
+
+@app.put("/retention", response_model=RetentionPolicy)
+def set_retention(policy: RetentionPolicy, current_user: TokenUser = Depends(get_current_user),
+                  db: Session = Depends(get_db)):
+    """Задать политику хранения версий; все поля null - вернуться к политике по умолчанию."""
+    values = policy.model_dump()
+    if any(value is not None and value < 1 for value in values.values()):
+        raise HTTPException(status_code=400, detail="Значения политики хранения должны быть не меньше 1")
+    user = db.get(User, current_user.id)
+    for name, value in values.items():
+        setattr(user, f"retention_{name}", value)
+    db.commit()
+    logger.info(f"Пользователь {current_user.username} изменил политику хранения: {values}")
+    return RetentionPolicy(**get_retention_policy(user))
+
+
+@app.get("/usage", response_model=UsageResponse)
+def get_user_usage(current_user: TokenUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Занятое место и квота пользователя."""
+    usage = get_usage(db, current_user.id)
+    quota = get_user_quota(db, current_user.id)
+    response = UsageResponse(bytes=usage.bytes, objects=usage.objects,
+                             quota_bytes=quota.bytes, quota_objects=quota.objects)
+    db.commit()
+    return response
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/", response_class=HTMLResponse)
 def admin_panel(request: Request, db: Session = Depends(get_db)):
     users = db.query(User).all()
@@ -264,7 +1607,7 @@ def admin_panel(request: Request, db: Session = Depends(get_db)):
 
 @app.post("/licenses/activation-key", response_model=LicenseResponse)
 def activate_license(request: LicenseActivationRequest, db: Session = Depends(get_db),
-                     current_user: User = Depends(get_current_user)):
+                     current_user: TokenUser = Depends(get_current_user)):
     """Активировать ключ активации."""
     license_entry = db.query(License).filter(License.key == request.key).first()
     if not license_entry:
@@ -278,12 +1621,16 @@ def activate_license(request: LicenseActivationRequest, db: Session = Depends(ge
     license_entry.user_id = current_user.id
     db.commit()
     db.refresh(license_entry)
+    license_cache.pop(current_user.id)
+    quota_cache.pop(current_user.id)
 
     return LicenseResponse(
         id=license_entry.id,
         key=license_entry.key,
         is_active=license_entry.is_active,
         user_id=license_entry.user_id,
+        quota_bytes=license_entry.quota_bytes,
+        quota_objects=license_entry.quota_objects,
     )
 
 
@@ -308,6 +1655,43 @@ def generate_license(username: str = Body(...), db: Session = Depends(get_db)):
         user_id=new_license.user_id,
     )
 
+@app.post("/licenses/generate/batch", response_model=List[LicenseResponse])
+def generate_licenses_batch(request: LicenseBatchCreate, db: Session = Depends(get_db),
+                            x_admin_token: Optional[str] = Header(None)):
+    """
+    Сгенерировать count ключей активации для пользователя одной транзакцией.
+
+    Квоты (quota_bytes, quota_objects) назначает только администратор: нужен заголовок
+    X-Admin-Token со значением ADMIN_TOKEN.
+    """
+    if request.quota_bytes is not None or request.quota_objects is not None:
+        if not (ADMIN_TOKEN and x_admin_token
+                and hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode())):
+            logger.warning(f"Попытка назначить квоту лицензиям пользователя {request.username} без прав администратора")
+            raise HTTPException(status_code=403, detail="Назначать квоты может только администратор")
+    if not 1 <= request.count <= LICENSE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Количество лицензий должно быть от 1 до {LICENSE_BATCH_MAX}")
+    user = db.query(User).filter(User.username == request.username).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь с таким именем не найден")
+
+    new_licenses = [
+        License(key=str(uuid.uuid4()), is_active=False, user_id=user.id,
+                quota_bytes=request.quota_bytes, quota_objects=request.quota_objects)
+        for _ in range(request.count)
+    ]
+    db.add_all(new_licenses)
+    db.flush()  # Получить id до commit: после него объекты просрочены и читались бы по одному
+    response = [
+        LicenseResponse(id=new_license.id, key=new_license.key, is_active=False, user_id=user.id,
+                        quota_bytes=request.quota_bytes, quota_objects=request.quota_objects)
+        for new_license in new_licenses
+    ]
+    db.commit()
+    logger.info(f"Для пользователя {user.username} сгенерировано лицензий: {len(response)}")
+    return response
+
+
 @app.get("/licenses/download")
 def download_license(username: str, db: Session = Depends(get_db)):
     """
@@ -331,18 +1715,17 @@ def download_license(username: str, db: Session = Depends(get_db)):
 
         # Формирование данных лицензии
         license_data = f"USER:{user.id};LICENSE:{license_entry.key}"
-        logger.info(f"Данные лицензии для пользователя {username}: {license_data}")
 
         # Подпись лицензии
         try:
-            signature = sign_license(license_data, "/Users/cawa/PycharmProjects/FastAPI_backUp/keys/private_key.pem")
+            license_data, signature = sign_license(license_data)
         except Exception as e:
             logger.error(f"Ошибка при подписании лицензии: {e}")
             raise HTTPException(status_code=500, detail="Ошибка при подписании лицензии")
 
         # Формирование содержимого файла
         license_file_content = f"{license_data}\n{signature}"
-        logger.info(f"Содержимое файла лицензии для {username}: {license_file_content}")
+        logger.info(f"Выдан файл лицензии {license_entry.id} пользователю {username}")
 
         # Возврат файла в ответе
         return Response(
@@ -355,28 +1738,31 @@ def download_license(username: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Ошибка на сервере")
 
 @app.post("/licenses/verify")
-def verify_license(request: LicenseVerifyRequest):
+def verify_license_signature(request: LicenseVerifyRequest):
     """Проверить цифровую подпись лицензии."""
-    try:
-        # Логируем входные данные
-        logger.info(f"Данные лицензии: {request.license_data}")
-        logger.info(f"Подпись: {request.signature}")
-
-        # Загрузка публичного ключа
-        with open("keys/public_key.pem", "rb") as f:
-            public_key_obj = load_pem_public_key(f.read())
-
-        # Проверка подписи
-        public_key_obj.verify(
-            base64.b64decode(request.signature),
-            request.license_data.encode(),
-            padding.PKCS1v15(),
-            hashes.SHA256()
-        )
-        return {"valid": True}
-    except Exception as e:
-        logger.error(f"Ошибка проверки подписи: {e}")
+    if not check_license_signature(request.license_data, request.signature):
+        logger.error("Ошибка проверки подписи лицензии")
         raise HTTPException(status_code=400, detail="Недействительная цифровая подпись")
+    return {"valid": True}
+
+
+@app.post("/licenses/verify/batch")
+def verify_license_signatures_batch(request: LicenseBatchVerifyRequest):
+    """
+    Проверить подписи списка лицензий.
+
+    Большие пакеты проверяются параллельно в пуле процессов порциями по
+    LICENSE_VERIFY_CHUNK. Результаты возвращаются в порядке запроса.
+    """
+    if len(request.items) > LICENSE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Не более {LICENSE_BATCH_MAX} лицензий в одном запросе")
+    items = [(item.license_data, item.signature) for item in request.items]
+    if len(items) < LICENSE_VERIFY_INLINE:
+        results = [check_license_signature(data, signature) for data, signature in items]
+    else:
+        portions = [items[i:i + LICENSE_VERIFY_CHUNK] for i in range(0, len(items), LICENSE_VERIFY_CHUNK)]
+        results = [valid for portion in license_verify_pool.map(verify_licenses, portions) for valid in portion]
+    return {"results": [{"valid": valid} for valid in results], "valid_count": sum(results)}
 
 
 @app.get("/user/{user_id}", response_class=HTMLResponse)
@@ -385,162 +1771,488 @@ def user_backups(user_id: int, request: Request, db: Session = Depends(get_db)):
     if not user:
         return templates.TemplateResponse("404.html", {"request": request}, status_code=404)
 
-    user_dir = os.path.join(BACKUP_DIR, str(user_id))
-    backups = os.listdir(user_dir) if os.path.exists(user_dir) else []
+    backups = [backup.filename for backup in user.backups]
     return templates.TemplateResponse("user_backups.html", {"request": request, "user": user, "backups": backups})
 
 
+def create_user(db: Session, username: str, hashed_password: str, encryption_key: str):
+    new_user = User(username=username, hashed_password=hashed_password, encryption_key=encryption_key)
+    db.add(new_user)
+    try:
+        db.flush()
+        db.add(UserUsage(user_id=new_user.id, bytes=0, objects=0))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        logger.warning(f"Попытка регистрации с уже существующим именем пользователя: {username}")
+        raise HTTPException(status_code=400, detail="Username already registered")
+
+
 @app.post("/register", status_code=201)
-def register_user(user: UserCreate, db: SessionLocal = Depends(get_db)):
-    if db.query(User).filter(User.username == user.username).first():
+async def register_user(user: UserCreate, db: SessionLocal = Depends(get_db)):
+    # Обработчик асинхронный: пока bcrypt считается в пуле процессов, поток не занят.
+    # Запросы к базе выполняются в пуле потоков.
+    if await run_in_threadpool(find_user, db, user.username):
         logger.warning(f"Попытка регистрации с уже существующим именем пользователя: {user.username}")
         raise HTTPException(status_code=400, detail="Username already registered")
 
     encryption_key = generate_encryption_key()
-    new_user = User(
-        username=user.username,
-        hashed_password=get_password_hash(user.password),
-        encryption_key=encryption_key,
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    hashed_password = await get_password_hash(user.password)
+    await run_in_threadpool(create_user, db, user.username, hashed_password, encryption_key)
     logger.info(f"Пользователь {user.username} успешно зарегистрирован")
     return {"msg": "User created successfully", "encryption_key": encryption_key}
 
 
 @app.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: SessionLocal = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db: SessionLocal = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return {"access_token": str(user.id), "token_type": "bearer", "encryption_key": user.encryption_key}
+    return {**await run_in_threadpool(issue_access_token, db, user), "encryption_key": user.encryption_key}
+
 
+@app.post("/token/refresh")
+def refresh_access_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """
+    Обменять действующий или недавно истёкший (не более TOKEN_REFRESH_WINDOW) токен на новый.
 
-@app.post("/backups/upload")
-async def upload_backup(files: List[UploadFile], current_user: User = Depends(get_current_user),
+    Пользователь и его лицензия проверяются по базе заново, поэтому удаление пользователя
+    или отзыв лицензии вступают в силу не позже чем через ACCESS_TOKEN_TTL.
+    """
+    try:
+        claims = token_signer.verify(token, leeway=TOKEN_REFRESH_WINDOW)
+        user = db.query(User).filter(User.id == int(claims["sub"])).first()
+    except (TokenError, KeyError, TypeError, ValueError):
+        user = None
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return issue_access_token(db, user)
+
+
+def check_upload_allowed(db: Session, user: TokenUser, content_length: Optional[str]):
+    """Проверить лицензию и квоту до приёма тела запроса."""
+    check_active_license(db, user)
+    size = int(content_length) if content_length and content_length.isdigit() else None
+    check_quota(db, user, size)
+
+
+@app.post("/backups/upload", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["files"],
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+        }}},
+    },
+})
+async def upload_backup(request: Request, current_user: TokenUser = Depends(get_current_user),
                         db: Session = Depends(get_db)):
-    """Загрузка файлов с проверкой лицензии."""
-    active_license = db.query(License).filter(License.user_id == current_user.id, License.is_active == True).first()
-    if not active_license:
-        raise HTTPException(status_code=403, detail="Нет активной лицензии")
+    """
+    Загрузка файлов с проверкой лицензии и квоты.
 
-    # Проверка цифровой лицензии
-    if active_license.license_data and active_license.signature:
-        public_key = ...  # Загрузить открытый ключ сервера
-        verify_license(active_license.license_data, active_license.signature, public_key)
+    Лицензия и квота проверяются до приёма тела: если занятое место вместе с Content-Length
+    превышает квоту, клиент сразу получает 413 и не передаёт данные впустую. Content-Length
+    включает служебные части multipart, поэтому эта проверка предварительная; точная
+    выполняется при сохранении записей (charge_usage).
+    """
+    await run_in_threadpool(check_upload_allowed, db, current_user, request.headers.get("content-length"))
 
-    user_dir = get_user_backup_dir(current_user.id)
+    form = await request.form()
+    try:
+        files = [file for file in form.getlist("files") if isinstance(file, StarletteUploadFile)]
+        if not files:
+            raise HTTPException(status_code=422, detail="Не переданы файлы")
+        return await run_in_threadpool(save_uploaded_files, db, current_user, files)
+    finally:
+        await form.close()
+
+
+def save_uploaded_files(db: Session, current_user: TokenUser, files: list):
+    """
+    Сохранить принятые файлы multipart.
+
+    Выполняется в пуле потоков, поэтому чтение файлов, хеширование, запись блоков и работа
+    с базой не блокируют цикл событий. Тело multipart к этому моменту уже принято и лежит
+    во временных файлах. Записи обо всех файлах фиксируются одной транзакцией: либо
+    сохраняются все файлы, либо (при ошибке в любом из них) ни один.
+    """
     saved_files = []
+    skipped_files = []
 
-    for file in files:
-        # Чтение содержимого файла
-        contents = await file.read()
-        file_size = len(contents)
-        logger.info(f"Получен файл {file.filename}, размер: {file_size} байт")
-
-        if file_size == 0:
-            logger.error(f"Файл {file.filename} пустой")
-            raise HTTPException(status_code=400, detail="Файл пустой")
-
-        # Вычисляем контрольную сумму
-        new_checksum = sha256(contents).hexdigest()
-        logger.info(f"Контрольная сумма файла {file.filename}: {new_checksum}")
-
-        # Проверяем существование файла с таким же именем
-        file_path = os.path.join(user_dir, file.filename)
-        if os.path.exists(file_path):
-            # Вычисляем контрольную сумму существующего файла
-            with open(file_path, "rb") as existing_file:
-                existing_checksum = sha256(existing_file.read()).hexdigest()
-
-            if existing_checksum != new_checksum:
-                # Файлы разные, генерируем новое имя
-                base, ext = os.path.splitext(file.filename)
-                new_filename = f"{base}_{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}"
-                file_path = os.path.join(user_dir, new_filename)
-                logger.warning(
-                    f"Файл {file.filename} уже существует, но содержимое отличается. Используется имя {new_filename}")
-            else:
-                logger.info(f"Файл {file.filename} уже существует и идентичен новому. Пропускаем загрузку.")
-                return {"msg": f"Файл {file.filename} уже существует и идентичен новому"}
-
-        # Сохраняем файл
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
-        logger.info(f"Файл {file.filename} успешно сохранён")
-
-        # Сохранение метаинформации в базу данных
-        new_backup = Backup(
-            filename=file.filename,
-            size=file_size,
-            user_id=current_user.id,
-            checksum=new_checksum,
-        )
-        db.add(new_backup)
-        db.commit()
-        db.refresh(new_backup)
+    try:
+        for file in files:
+            # Потоковый приём в хранилище блоков с подсчётом контрольной суммы
+            manifest, file_size, new_checksum = save_upload_stream(file)
+            logger.info(f"Получен файл {file.filename}, размер: {file_size} байт", extra=SAMPLED)
+
+            if file_size == 0:
+                logger.error(f"Файл {file.filename} пустой")
+                raise HTTPException(status_code=400, detail="Файл пустой")
+
+            logger.info(f"Контрольная сумма файла {file.filename}: {new_checksum}", extra=SAMPLED)
+
+            with UPLOAD_STAGE_SECONDS.labels("db").time():
+                new_backup = add_backup(db, current_user, file.filename, manifest, file_size, new_checksum)
+            if new_backup is None:
+                skipped_files.append(file.filename)
+                continue
+
+            # Информация о файле для ответа (до фиксации: после неё атрибуты перечитываются из базы)
+            saved_files.append({"filename": new_backup.filename, "size": file_size,
+                                "upload_date": new_backup.upload_date})
+
+        with UPLOAD_STAGE_SECONDS.labels("commit").time():
+            db.commit()
+    except IntegrityError:
+        db.rollback()
+        logger.warning(f"Файлы пользователя {current_user.username} параллельно сохранены другим запросом")
+        raise HTTPException(status_code=409, detail="Файлы одновременно загружаются другим запросом, повторите")
+    logger.info(f"Сохранено файлов: {len(saved_files)}, пропущено дубликатов: {len(skipped_files)}")
+
+    if not saved_files:
+        return {"msg": "Файлы уже существуют и идентичны новым", "skipped": skipped_files}
+    return {"msg": "Files uploaded successfully", "files": saved_files, "skipped": skipped_files}
+
+
+@app.post("/backups/sessions", status_code=201)
+def create_upload_session(request: UploadSessionCreate, current_user: TokenUser = Depends(get_current_user),
+                          db: Session = Depends(get_db)):
+    """Создать сессию возобновляемой загрузки."""
+    check_active_license(db, current_user)
+    check_codec(request.codec)
+    # Объявленный размер проверяется сразу; без него квоту ограничивает каждый принятый блок
+    remaining = upload_quota_remaining(db, current_user)
+    if remaining is not None and request.size is not None and request.size > remaining:
+        raise quota_exceeded()
+    check_quota(db, current_user, None)  # Число копий
+
+    upload_session = UploadSession(
+        id=uuid.uuid4().hex,
+        filename=request.filename,
+        size=request.size,
+        offset=0,
+        codec=request.codec,
+        user_id=current_user.id,
+    )
+    db.add(upload_session)
+    db.commit()
 
-        # Добавление информации о файле в ответ
-        saved_files.append({"filename": file.filename, "size": file_size, "upload_date": new_backup.upload_date})
+    user_dir = get_user_backup_dir(current_user.id)
+    open(get_session_part_path(user_dir, upload_session.id), "wb").close()
+    logger.info(f"Создана сессия загрузки {upload_session.id} для файла {request.filename}")
+    return {"upload_id": upload_session.id, "offset": 0}
 
-    return {"msg": "Files uploaded successfully", "files": saved_files}
+
+@app.get("/backups/sessions/{upload_id}")
+def get_upload_session_status(upload_id: str, current_user: TokenUser = Depends(get_current_user),
+                              db: Session = Depends(get_db)):
+    """Текущее подтверждённое смещение сессии загрузки."""
+    upload_session = get_upload_session(db, current_user, upload_id)
+    return {"upload_id": upload_session.id, "offset": upload_session.offset, "size": upload_session.size}
+
+
+@app.put("/backups/sessions/{upload_id}")
+async def upload_session_chunk(upload_id: str, offset: int, request: Request,
+                               current_user: TokenUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Дописать блок данных в сессию загрузки начиная с указанного смещения.
+
+    Смещение должно совпадать с подтверждённым сервером, иначе возвращается 409
+    с актуальным смещением. При обрыве соединения принятые байты сохраняются.
+    Тело читается асинхронно, а запись на диск и запросы к базе выполняются в пуле
+    потоков порциями по UPLOAD_CHUNK_SIZE, чтобы не блокировать цикл событий.
+    """
+    upload_session = await run_in_threadpool(get_upload_session, db, current_user, upload_id)
+    if offset != upload_session.offset:
+        raise HTTPException(status_code=409, detail={"msg": "Неверное смещение", "offset": upload_session.offset})
+
+    # Сколько байт ещё можно принять по объявленному размеру и по квоте; лишние байты не записываются
+    limits = []  # (сколько ещё байт можно принять, ошибка при превышении)
+    if upload_session.size is not None:
+        limits.append((upload_session.size - upload_session.offset,
+                       HTTPException(status_code=400, detail={"msg": "Превышен объявленный размер файла",
+                                                              "offset": upload_session.offset})))
+    quota_remaining = await run_in_threadpool(upload_quota_remaining, db, current_user)
+    if quota_remaining is not None:
+        limits.append((quota_remaining, quota_exceeded()))
+    content_length = request.headers.get("content-length")
+    for remaining, error in limits:
+        if content_length and content_length.isdigit() and int(content_length) > remaining:
+            raise error
+
+    part_path = get_session_part_path(get_user_backup_dir(current_user.id), upload_id)
+    buffer = await run_in_threadpool(open_session_part, part_path, upload_session.offset)
+    pending = bytearray()
+    written = 0
+    rejected = None
+    try:
+        async for chunk in request.stream():
+            pending += chunk
+            rejected = next((error for remaining, error in limits if written + len(pending) > remaining), None)
+            if rejected is not None:
+                break
+            if len(pending) >= UPLOAD_CHUNK_SIZE:
+                data, pending = pending, bytearray()
+                await run_in_threadpool(buffer.write, data)
+                written += len(data)
+    except ClientDisconnect:
+        logger.warning(f"Соединение прервано в сессии {upload_id}, принято {written + len(pending)} байт")
+    finally:
+        if rejected is not None:
+            # Отбросить всё, что записано этим запросом: смещение сессии не меняется
+            await run_in_threadpool(buffer.truncate, upload_session.offset)
+            written = 0
+        elif pending:
+            await run_in_threadpool(buffer.write, pending)
+            written += len(pending)
+        await run_in_threadpool(buffer.close)
+        upload_session.offset += written
+        upload_session.updated_at = datetime.utcnow()
+        await run_in_threadpool(db.commit)
+
+    if rejected is not None:
+        raise rejected
+    return {"upload_id": upload_id, "offset": upload_session.offset}
+
+
+@app.post("/backups/sessions/{upload_id}/complete")
+def complete_upload_session(upload_id: str, request: UploadSessionComplete,
+                            current_user: TokenUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Завершить сессию загрузки: проверить контрольную сумму и сохранить резервную копию."""
+    upload_session = get_upload_session(db, current_user, upload_id)
+    if upload_session.size is not None and upload_session.offset != upload_session.size:
+        raise HTTPException(status_code=409, detail={"msg": "Файл загружен не полностью",
+                                                     "offset": upload_session.offset})
+    if upload_session.offset == 0:
+        raise HTTPException(status_code=400, detail="Файл пустой")
+
+    part_path = get_session_part_path(get_user_backup_dir(current_user.id), upload_id)
+    # Один проход по файлу: разбиение на блоки и подсчёт контрольной суммы
+    ingest = ChunkIngest()
+    with open(part_path, "rb") as f:
+        for data in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            ingest.update(data)
+    manifest, file_size, checksum = ingest.finish()
+    if checksum != request.checksum:
+        logger.error(f"Контрольная сумма сессии {upload_id} не совпадает: {checksum} != {request.checksum}")
+        raise HTTPException(status_code=400, detail="Контрольная сумма не совпадает")
+
+    filename, codec = upload_session.filename, upload_session.codec
+    db.delete(upload_session)
+    new_backup = store_backup(db, current_user, filename, manifest, file_size, checksum, codec)
+    os.remove(part_path)
+    if new_backup is None:
+        db.delete(upload_session)  # Повторно - на случай отката транзакции в store_backup
+        db.commit()  # Фиксируем удаление сессии
+        return {"msg": f"Файл {filename} уже существует и идентичен новому"}
+
+    return {"msg": "File uploaded successfully",
+            "files": [{"filename": new_backup.filename, "size": file_size, "upload_date": new_backup.upload_date}]}
+
+
+@app.post("/backups/chunks/query")
+def query_chunks(request: ChunkQuery, current_user: TokenUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Вернуть хеши блоков, которых ещё нет в хранилище (клиенту нужно загрузить только их)."""
+    check_active_license(db, current_user)
+    if request.size is not None:
+        remaining = upload_quota_remaining(db, current_user)
+        if remaining is not None and request.size > remaining:
+            raise quota_exceeded()
+        check_quota(db, current_user, None)  # Число копий
+    stored = find_stored_chunks(db, request.hashes)
+    missing = [chunk_hash for chunk_hash in dict.fromkeys(request.hashes) if chunk_hash not in stored]
+    return {"missing": missing}
+
+
+@app.put("/backups/chunks/{chunk_hash}")
+async def upload_chunk(chunk_hash: str, request: Request, current_user: TokenUser = Depends(get_current_user),
+                       db: Session = Depends(get_db)):
+    """Загрузить один блок; его хеш должен совпадать с содержимым."""
+    await run_in_threadpool(check_active_license, db, current_user)
+    if not is_chunk_hash(chunk_hash):
+        raise HTTPException(status_code=400, detail="Неверный хеш блока")
+    quota_remaining = await run_in_threadpool(upload_quota_remaining, db, current_user)
+    content_length = request.headers.get("content-length")
+    if quota_remaining is not None and content_length and content_length.isdigit() \
+            and int(content_length) > quota_remaining:
+        raise quota_exceeded()
+
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > MAX_FRAME_SIZE:
+            raise HTTPException(status_code=413, detail="Слишком большой блок")
+    if not data:
+        raise HTTPException(status_code=400, detail="Блок пустой")
+    if quota_remaining is not None and len(data) > quota_remaining:
+        raise quota_exceeded()
+
+    await run_in_threadpool(store_chunk_data, chunk_hash, bytes(data))
+    await run_in_threadpool(add_pending_chunk, db, current_user.id, chunk_hash, len(data))
+    return {"hash": chunk_hash, "size": len(data)}
+
+
+@app.post("/backups/manifest")
+def create_backup_from_manifest(request: ManifestCreate, current_user: TokenUser = Depends(get_current_user),
+                                db: Session = Depends(get_db)):
+    """Создать резервную копию из уже загруженных блоков."""
+    check_active_license(db, current_user)
+    check_codec(request.codec)
+    if not request.chunks:
+        raise HTTPException(status_code=400, detail="Файл пустой")
+
+    stored = find_stored_chunks(db, request.chunks)
+    missing = [chunk_hash for chunk_hash in dict.fromkeys(request.chunks) if chunk_hash not in stored]
+    if missing:
+        raise HTTPException(status_code=409, detail={"msg": "Не все блоки загружены", "missing": missing})
+    manifest = [[chunk_hash, stored[chunk_hash]] for chunk_hash in request.chunks]
+
+    file_size = sum(size for _, size in manifest)
+    new_backup = store_backup(db, current_user, request.filename, manifest, file_size, request.checksum,
+                              request.codec)
+    release_pending_chunks(db, current_user.id, request.chunks)
+    if new_backup is None:
+        return {"msg": f"Файл {request.filename} уже существует и идентичен новому"}
+
+    return {"msg": "File uploaded successfully",
+            "files": [{"filename": new_backup.filename, "size": file_size, "upload_date": new_backup.upload_date}]}
+
+
+def encode_cursor(backup) -> str:
+    """Курсор страницы: позиция последней записи (upload_date, id)."""
+    position = json.dumps([backup.upload_date.isoformat(), backup.id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        upload_date, backup_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(upload_date), int(backup_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Неверный курсор")
 
 
 @app.get("/backups/")
-def list_backups(current_user: User = Depends(get_current_user), db: SessionLocal = Depends(get_db)):
-    backups = db.query(Backup).filter(Backup.user_id == current_user.id).all()
-    return [
-        {
-            "id": backup.id,
-            "filename": backup.filename,
-            "size": backup.size,
-            "upload_date": backup.upload_date.isoformat(),
-        }
-        for backup in backups
-    ]
+def list_backups(cursor: Optional[str] = None, limit: int = Query(BACKUP_PAGE_SIZE, ge=1, le=BACKUP_PAGE_MAX),
+                 order: str = Query("desc", pattern="^(asc|desc)$"), prefix: Optional[str] = None,
+                 date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                 min_size: Optional[int] = None, max_size: Optional[int] = None,
+                 current_user: TokenUser = Depends(get_current_user), db: SessionLocal = Depends(get_db)):
+    """
+    Постраничный список резервных копий.
 
+    Страницы выбираются по курсору (upload_date, id) последней записи предыдущей страницы,
+    поэтому запрос идёт по индексу и не зависит от номера страницы, а вставка новых копий
+    не сдвигает страницы. Фильтры: префикс имени, интервал дат загрузки и размера.
+    """
+    query = db.query(Backup.id, Backup.filename, Backup.size, Backup.upload_date, Backup.codec).filter(
+        Backup.user_id == current_user.id)
+    if prefix:
+        query = query.filter(Backup.filename.startswith(prefix, autoescape=True))
+    if date_from is not None:
+        query = query.filter(Backup.upload_date >= date_from)
+    if date_to is not None:
+        query = query.filter(Backup.upload_date < date_to)
+    if min_size is not None:
+        query = query.filter(Backup.size >= min_size)
+    if max_size is not None:
+        query = query.filter(Backup.size <= max_size)
+
+    position = tuple_(Backup.upload_date, Backup.id)
+    if cursor:
+        last = decode_cursor(cursor)
+        query = query.filter(position < last if order == "desc" else position > last)
+    if order == "desc":
+        query = query.order_by(Backup.upload_date.desc(), Backup.id.desc())
+    else:
+        query = query.order_by(Backup.upload_date, Backup.id)
+
+    # Лишняя запись показывает, есть ли следующая страница
+    backups = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(backups[limit - 1]) if len(backups) > limit else None
+    return {
+        "items": [
+            {
+                "id": backup.id,
+                "filename": backup.filename,
+                "size": backup.size,
+                "upload_date": backup.upload_date.isoformat(),
+                "codec": backup.codec,
+            }
+            for backup in backups[:limit]
+        ],
+        "next_cursor": next_cursor,
+    }
 
-@app.get("/backups/download/{filename}")
-def download_backup(filename: str, current_user: User = Depends(get_current_user)):
-    user_dir = get_user_backup_dir(current_user.id)
-    file_path = os.path.join(user_dir, filename)
 
-    if not os.path.exists(file_path):
+@app.get("/backups/download/{filename}")
+def download_backup(filename: str, request: Request, current_user: TokenUser = Depends(get_current_user),
+                    db: Session = Depends(get_db)):
+    """Скачать резервную копию; поддерживаются докачка (Range) и проверка версии (ETag)."""
+    backup_entry = find_backup(db, current_user, filename)
+    if backup_entry is not None and backup_entry.manifest:
+        # Резервная копия собирается из блоков хранилища по манифесту
+        segments = [(get_chunk_key(chunk_hash), size) for chunk_hash, size in json.loads(backup_entry.manifest)]
+        logger.info(f"Файл {filename} отправлен пользователю {current_user.username}", extra=SAMPLED)
+        return ranged_response(request, segments, int(backup_entry.size), f'"{backup_entry.checksum}"', filename)
+
+    # Файлы старого формата хранятся целиком под ключом пользователя
+    key = get_legacy_key(current_user.id, filename)
+    object_stat = storage.stat(key)
+
+    if object_stat is None:
         logger.error(f"Файл {filename} не найден для пользователя {current_user.username}")
         raise HTTPException(status_code=404, detail="File not found")
 
-    logger.info(f"Файл {filename} отправлен пользователю {current_user.username}")
-    print(filename)
-    return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
+    if backup_entry is not None:
+        etag = f'"{backup_entry.checksum}"'
+    else:
+        etag = f'"{int(object_stat.modified)}-{object_stat.size}"'
+    logger.info(f"Файл {filename} отправлен пользователю {current_user.username}", extra=SAMPLED)
+    return ranged_response(request, [(key, object_stat.size)], object_stat.size, etag, filename)
 
 
 @app.delete("/backups/{filename}")
-def delete_backup(filename: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_backup(filename: str, current_user: TokenUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Удаление файла и его записи из базы данных."""
-    user_dir = get_user_backup_dir(current_user.id)
-    file_path = os.path.join(user_dir, filename)
+    backup_entry = find_backup(db, current_user, filename)
+    if backup_entry is not None and backup_entry.manifest:
+        # Удаляем запись и ссылки на блоки; блоки без ссылок удалит сборка мусора
+        unreferenced = release_chunk_refs(db, json.loads(backup_entry.manifest))
+        release_usage(db, current_user.id, int(backup_entry.size or 0))
+        db.delete(backup_entry)
+        db.commit()
+        logger.info(f"Файл {filename} успешно удалён, блоков без ссылок: {unreferenced}")
+        return {"msg": "Файл успешно удален"}
+
+    key = get_legacy_key(current_user.id, filename)
 
-    # Проверка существования файла на диске
-    if not os.path.exists(file_path):
+    # Проверка существования файла в хранилище
+    if not storage.exists(key):
         logger.warning(f"Попытка удалить несуществующий файл: {filename}")
         raise HTTPException(status_code=404, detail="Файл не найден")
 
-    # Удаление файла с диска
+    # Удаление файла из хранилища
     try:
-        os.remove(file_path)
-        logger.info(f"Файл {filename} успешно удалён с диска.")
+        storage.delete(key)
+        logger.info(f"Файл {filename} успешно удалён из хранилища.")
     except Exception as e:
         logger.error(f"Ошибка при удалении файла {filename}: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при удалении файла")
 
     # Удаление записи из базы данных
-    backup_entry = db.query(Backup).filter_by(filename=filename, user_id=current_user.id).first()
     if backup_entry:
+        release_usage(db, current_user.id, int(backup_entry.size or 0))
         db.delete(backup_entry)
         db.commit()
         logger.info(f"Запись о файле {filename} успешно удалена из базы данных.")
@@ -0,0 +1,116 @@
+"""
+Сравнение кодеков сжатия (compressors.py) по скорости и степени сжатия.
+
+Данные разбиваются на блоки так же, как при загрузке (chunking.py), и каждый блок
+сжимается отдельно - это соответствует реальному пути данных в клиенте.
+
+Запуск:
+    python bench_compression.py                   # синтетические журналы, дамп БД и случайные данные
+    python bench_compression.py dump.sql app.log  # свои файлы
+    python bench_compression.py --codecs zlib:1 zstd:3 zstd:9
+"""
+import argparse
+import os
+import random
+import time
+
+import compressors
+from chunking import Chunker
+
+SAMPLE_SIZE = 32 * 1024 * 1024  # Размер синтетических образцов
+
+
+def make_log_sample(size: int) -> bytes:
+    """Журнал приложения: повторяющиеся шаблоны с меняющимися полями."""
+    rng = random.Random(1)
+    levels = ["INFO", "INFO", "INFO", "WARNING", "ERROR", "DEBUG"]
+    messages = [
+        "Файл {0}.bin успешно сохранён ({1} блоков)",
+        "Пользователь user{0} вошёл в систему",
+        "GET /backups/download/file{0}.enc HTTP/1.1 200 OK, {1} байт",
+        "Обрыв соединения в сессии {0:x}, принято {1} байт",
+    ]
+    lines = []
+    total = 0
+    while total < size:
+        line = (f"2024-11-{rng.randint(1, 30):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                f"{rng.randint(0, 59):02d},{rng.randint(0, 999):03d} - {rng.choice(levels)} - "
+                + rng.choice(messages).format(rng.randint(0, 10 ** 6), rng.randint(0, 10 ** 9)) + "\n")
+        lines.append(line)
+        total += len(line.encode())
+    return "".join(lines).encode()[:size]
+
+
+def make_sql_sample(size: int) -> bytes:
+    """Дамп базы данных: INSERT с числами, датами и хешами."""
+    rng = random.Random(2)
+    rows = []
+    total = 0
+    while total < size:
+        row = (f"INSERT INTO backups (id, filename, size, upload_date, user_id, checksum) VALUES "
+               f"({len(rows)}, 'file_{rng.randint(0, 10 ** 5)}.enc', {rng.randint(0, 10 ** 10)}, "
+               f"'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00', {rng.randint(1, 500)}, "
+               f"'{rng.getrandbits(256):064x}');\n")
+        rows.append(row)
+        total += len(row)
+    return "".join(rows).encode()[:size]
+
+
+def split_chunks(data: bytes) -> list:
+    chunker = Chunker()
+    return chunker.update(data) + chunker.finish()
+
+
+def bench(chunks: list, spec: str):
+    """Вернуть (степень сжатия, МБ/с сжатия, МБ/с распаковки) для набора блоков."""
+    compressor = compressors.Compressor(spec)
+    size = sum(len(chunk) for chunk in chunks)
+
+    start = time.perf_counter()
+    encoded = [compressor.encode(chunk) for chunk in chunks]
+    compress_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for payload in encoded:
+        compressors.decode(payload)
+    decompress_time = time.perf_counter() - start
+
+    ratio = size / sum(len(payload) for payload in encoded)
+    mb = size / (1024 * 1024)
+    return ratio, mb / compress_time, mb / decompress_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Файлы для проверки вместо синтетических образцов")
+    parser.add_argument("--codecs", nargs="+", help="Кодеки с уровнями (по умолчанию все доступные)")
+    args = parser.parse_args()
+
+    if args.files:
+        samples = []
+        for path in args.files:
+            with open(path, "rb") as f:
+                samples.append((os.path.basename(path), f.read()))
+    else:
+        samples = [
+            ("журнал", make_log_sample(SAMPLE_SIZE)),
+            ("дамп SQL", make_sql_sample(SAMPLE_SIZE)),
+            ("случайные", os.urandom(SAMPLE_SIZE)),
+        ]
+
+    specs = args.codecs or [
+        "none", "zlib:1", "zlib:6", "lzma:0", "lzma:1",
+        *(["zstd:1", "zstd:3", "zstd:9"] if "zstd" in compressors.AVAILABLE_CODECS else []),
+        *(["lz4:0", "lz4:9"] if "lz4" in compressors.AVAILABLE_CODECS else []),
+    ]
+
+    print(f"{'данные':<12} {'кодек':<8} {'степень':>8} {'сжатие МБ/с':>12} {'распаковка МБ/с':>16}")
+    for name, data in samples:
+        chunks = split_chunks(data)
+        for spec in specs:
+            ratio, compress_speed, decompress_speed = bench(chunks, spec)
+            print(f"{name:<12} {spec:<8} {ratio:>8.2f} {compress_speed:>12.1f} {decompress_speed:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
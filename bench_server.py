@@ -0,0 +1,338 @@
+"""
+Нагрузочные замеры сервера (app.py): пропускная способность и задержки p50/p99.
+
+Сервер запускается в этом же процессе (uvicorn в отдельном потоке) на свободном порту,
+с временными каталогом хранилища (BACKUP_DIR), базой SQLite и журналом, поэтому замеры не
+трогают рабочие данные и повторяются с одинаковых начальных условий. Запросы идут
+по HTTP через requests из пула потоков (--concurrency), как от реальных клиентов.
+
+Сценарии:
+    token     - вход (POST /token, bcrypt)
+    upload    - загрузка мелких файлов по одному, множества файлов в одном запросе и больших файлов
+    download  - скачивание мелких и больших файлов
+    list      - список резервных копий пользователей с 10 000 и 100 000 записей:
+                первая страница, обход страниц по курсору, фильтр по префиксу
+    license   - пакетная генерация, выдача файла лицензии, проверка подписи по одной и пакетом
+
+Результаты печатаются таблицей и записываются в JSON (--output) вместе с версией кода,
+чтобы сравнивать прогоны между изменениями.
+
+Запуск (из каталога проекта: серверу нужны templates/, static/ и keys/):
+    python bench_server.py
+    python bench_server.py --quick
+    python bench_server.py --scenarios upload download --concurrency 16 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import requests
+
+SCENARIOS = ("token", "upload", "download", "list", "license")
+PASSWORD = "bench-password"
+SMALL_FILE_SIZE = 4 * 1024
+LIST_BATCH = 10000  # Записей в одном INSERT при заполнении базы для сценария list
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Процентиль по ближайшему рангу."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Bench:
+    """Запущенный сервер, пользователь для замеров и накопленные результаты."""
+
+    def __init__(self, server, base_url: str, concurrency: int):
+        self.server = server  # Модуль app
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.results = []
+        self._local = threading.local()
+        self.headers = {}
+
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def run(self, name: str, make_request, count: int, concurrency: int = None) -> dict:
+        """
+        Выполнить count запросов make_request(session, номер) и записать результат.
+
+        make_request возвращает (ответ, число отправленных байт тела).
+        """
+        concurrency = concurrency or self.concurrency
+
+        def one(index):
+            start = time.perf_counter()
+            response, sent = make_request(self.session(), index)
+            elapsed = time.perf_counter() - start
+            return elapsed, response.ok, sent, len(response.content)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            measurements = list(executor.map(one, range(count)))
+        total = time.perf_counter() - start
+
+        latencies = sorted(elapsed for elapsed, _, _, _ in measurements)
+        sent = sum(item[2] for item in measurements)
+        received = sum(item[3] for item in measurements)
+        result = {
+            "scenario": name,
+            "requests": count,
+            "concurrency": concurrency,
+            "errors": sum(1 for _, ok, _, _ in measurements if not ok),
+            "seconds": round(total, 4),
+            "requests_per_second": round(count / total, 2),
+            "upload_mb_per_second": round(sent / total / (1024 * 1024), 2),
+            "download_mb_per_second": round(received / total / (1024 * 1024), 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+        self.results.append(result)
+        print(f"{name:<28} {count:>6} {result['errors']:>6} {result['requests_per_second']:>9.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+              f"{max(result['upload_mb_per_second'], result['download_mb_per_second']):>9.1f}")
+        return result
+
+    def login(self, username: str) -> dict:
+        response = requests.post(self.url("/token"), data={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def setup_user(self, username: str):
+        """Зарегистрировать пользователя замеров и активировать ему лицензию."""
+        requests.post(self.url("/register"), json={"username": username, "password": PASSWORD}).raise_for_status()
+        response = requests.post(self.url("/licenses/generate"), json=username)
+        response.raise_for_status()
+        headers = self.login(username)
+        requests.post(self.url("/licenses/activation-key"), json={"key": response.json()["key"]},
+                      headers=headers).raise_for_status()
+        self.headers = self.login(username)  # В новом токене лицензия уже отмечена активной
+
+
+def start_server(server):
+    """Запустить uvicorn с приложением в фоновом потоке. Возвращает (сервер uvicorn, поток, адрес)."""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Сервер не запустился")
+        time.sleep(0.05)
+    return uvicorn_server, thread, f"http://127.0.0.1:{port}"
+
+
+def bench_token(bench: Bench, scale: dict):
+    bench.run("token", lambda session, i: (
+        session.post(bench.url("/token"), data={"username": "bench", "password": PASSWORD}), 0),
+        scale["token_requests"])
+
+
+def upload(bench: Bench, session, files: list):
+    """Загрузить список (имя, данные) одним запросом."""
+    response = session.post(bench.url("/backups/upload"), headers=bench.headers,
+                            files=[("files", (name, data)) for name, data in files])
+    return response, sum(len(data) for _, data in files)
+
+
+def bench_upload(bench: Bench, scale: dict):
+    bench.run("upload_small", lambda session, i: upload(
+        bench, session, [(f"small_{i}.bin", os.urandom(SMALL_FILE_SIZE))]), scale["small_files"])
+
+    many = scale["many_files"]
+    bench.run(f"upload_many_{many}_files", lambda session, i: upload(
+        bench, session, [(f"many_{i}_{j}.bin", os.urandom(SMALL_FILE_SIZE)) for j in range(many)]),
+        scale["many_requests"])
+
+    large = os.urandom(scale["large_mb"] * 1024 * 1024)
+    # Первые байты разные, чтобы файлы не совпадали целиком; блоки по содержимому частично общие
+    bench.run(f"upload_large_{scale['large_mb']}mb", lambda session, i: upload(
+        bench, session, [(f"large_{i}.bin", i.to_bytes(8, "big") + large)]),
+        scale["large_files"], concurrency=min(bench.concurrency, scale["large_files"]))
+
+
+def download(bench: Bench, session, filename: str):
+    return session.get(bench.url(f"/backups/download/{quote(filename)}"), headers=bench.headers), 0
+
+
+def bench_download(bench: Bench, scale: dict):
+    # Файлы, загруженные в сценарии upload; без него загружаем их здесь
+    if not any(result["scenario"] == "upload_small" for result in bench.results):
+        session = bench.session()
+        for i in range(scale["small_files"]):
+            upload(bench, session, [(f"small_{i}.bin", os.urandom(SMALL_FILE_SIZE))])[0].raise_for_status()
+        large = os.urandom(scale["large_mb"] * 1024 * 1024)
+        for i in range(scale["large_files"]):
+            upload(bench, session, [(f"large_{i}.bin", i.to_bytes(8, "big") + large)])[0].raise_for_status()
+
+    bench.run("download_small", lambda session, i: download(bench, session, f"small_{i}.bin"),
+              scale["small_files"])
+    bench.run(f"download_large_{scale['large_mb']}mb",
+              lambda session, i: download(bench, session, f"large_{i}.bin"),
+              scale["large_files"], concurrency=min(bench.concurrency, scale["large_files"]))
+
+
+def seed_backups(server, username: str, rows: int) -> dict:
+    """Создать пользователя с rows записями о резервных копиях напрямую в базе. Возвращает заголовки."""
+    db = server.SessionLocal()
+    try:
+        user = server.User(username=username, hashed_password="-", encryption_key=server.generate_encryption_key())
+        db.add(user)
+        db.commit()
+        user_id = user.id
+    finally:
+        db.close()
+
+    start_date = datetime(2024, 1, 1)
+    with server.engine.begin() as conn:
+        for batch_start in range(0, rows, LIST_BATCH):
+            conn.execute(server.Backup.__table__.insert(), [
+                {"filename": f"file_{i:06d}.bin", "size": 1024 + i, "upload_date": start_date + timedelta(seconds=i),
+                 "user_id": user_id, "checksum": f"{i:064x}", "manifest": "[]"}
+                for i in range(batch_start, min(rows, batch_start + LIST_BATCH))
+            ])
+    token = server.token_signer.issue({"sub": user_id, "name": username, "lic": True})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def bench_list(bench: Bench, scale: dict):
+    for rows in scale["list_rows"]:
+        headers = seed_backups(bench.server, f"list_{rows}", rows)
+        label = f"{rows // 1000}k"
+
+        bench.run(f"list_first_page_{label}", lambda session, i: (
+            session.get(bench.url("/backups/"), params={"limit": 100}, headers=headers), 0),
+            scale["list_requests"])
+
+        # Курсоры страниц собираются заранее, чтобы каждый замер был одним запросом
+        cursors = [None]
+        while len(cursors) < scale["list_pages"]:
+            page = requests.get(bench.url("/backups/"), params={"limit": 100, "cursor": cursors[-1]},
+                                headers=headers).json()
+            if not page["next_cursor"]:
+                break
+            cursors.append(page["next_cursor"])
+        bench.run(f"list_cursor_pages_{label}", lambda session, i: (
+            session.get(bench.url("/backups/"), params={"limit": 100, "cursor": cursors[i % len(cursors)]},
+                        headers=headers), 0),
+            scale["list_requests"])
+
+        bench.run(f"list_prefix_filter_{label}", lambda session, i: (
+            session.get(bench.url("/backups/"), params={"limit": 100, "prefix": f"file_{i % 10}"},
+                        headers=headers), 0),
+            scale["list_requests"])
+
+
+def bench_license(bench: Bench, scale: dict):
+    batch = scale["license_batch"]
+    bench.run(f"license_generate_batch_{batch}", lambda session, i: (
+        session.post(bench.url("/licenses/generate/batch"), json={"username": "bench", "count": batch}), 0),
+        scale["license_requests"] // 10 or 1)
+
+    bench.run("license_download", lambda session, i: (
+        session.get(bench.url("/licenses/download"), params={"username": "bench"}), 0),
+        scale["license_requests"])
+
+    license_data, signature = requests.get(bench.url("/licenses/download"),
+                                           params={"username": "bench"}).text.rsplit("\n", 1)
+    item = {"license_data": license_data, "signature": signature}
+    bench.run("license_verify", lambda session, i: (
+        session.post(bench.url("/licenses/verify"), json=item), 0),
+        scale["license_requests"])
+    bench.run(f"license_verify_batch_{batch}", lambda session, i: (
+        session.post(bench.url("/licenses/verify/batch"), json={"items": [item] * batch}), 0),
+        scale["license_requests"] // 10 or 1)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Одновременных запросов (по умолчанию 8)")
+    parser.add_argument("--quick", action="store_true", help="Уменьшенные объёмы для быстрой проверки")
+    parser.add_argument("--output", default="bench_results.json", help="Файл результатов JSON")
+    args = parser.parse_args()
+
+    scale = {
+        "token_requests": 40, "small_files": 500, "many_files": 100, "many_requests": 20,
+        "large_files": 4, "large_mb": 64, "list_rows": [10000, 100000], "list_requests": 300,
+        "list_pages": 200, "license_requests": 300, "license_batch": 1000,
+    }
+    if args.quick:
+        scale.update(token_requests=10, small_files=100, many_files=50, many_requests=5, large_files=2, large_mb=8,
+                     list_rows=[10000], list_requests=100, list_pages=50, license_requests=50, license_batch=200)
+
+    workdir = tempfile.mkdtemp(prefix="bench_server_")
+    # Настройки сервера читаются при импорте app, поэтому задаются до него
+    os.environ.update({
+        "BACKUP_DIR": os.path.join(workdir, "backups"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "STORAGE_BACKEND": "local",
+        "TOKEN_SECRET": os.urandom(32).hex(),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        "LOG_FILE": os.path.join(workdir, "server.log"),
+    })
+    import app as server
+
+    uvicorn_server, thread, base_url = start_server(server)
+    bench = Bench(server, base_url, args.concurrency)
+    try:
+        bench.setup_user("bench")
+        print(f"{'сценарий':<28} {'запр.':>6} {'ошибки':>6} {'запр./с':>9} {'p50 мс':>9} {'p99 мс':>9} {'МБ/с':>9}")
+        scenarios = {"token": bench_token, "upload": bench_upload, "download": bench_download,
+                     "list": bench_list, "license": bench_license}
+        for name in SCENARIOS:
+            if name in args.scenarios:
+                scenarios[name](bench, scale)
+    finally:
+        uvicorn_server.should_exit = True
+        thread.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "concurrency": args.concurrency,
+        "quick": args.quick,
+        "results": bench.results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Небольшой потокобезопасный кэш в памяти с ограниченным временем жизни записей."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Кэш с временем жизни записей ttl секунд и не более maxsize записями.
+
+    При переполнении вытесняются записи, к которым дольше всего не обращались.
+    Кэш локален для процесса: при нескольких рабочих процессах у каждого свой.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # ключ -> (срок истечения, значение)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,200 @@
+"""
+Проверка реализаций хранилища (storage.py) на соответствие контракту StorageBackend.
+
+Один и тот же набор проверок выполняется для LocalStorage (во временном каталоге) и
+для S3Storage: put из bytes и из файла, get_range по диапазонам, stat, exists, list
+с префиксами, delete, перезапись объекта и поведение для отсутствующих ключей.
+
+S3Storage проверяется:
+* на сервере, заданном переменными окружения S3_BUCKET и S3_ENDPOINT_URL (MinIO, Ceph,
+  moto_server), - объекты пишутся под отдельным префиксом и удаляются после проверки;
+* иначе, если установлен пакет moto, - на сервере moto, запущенном в этом же процессе;
+* иначе проверка S3 пропускается (с --require-s3 это ошибка).
+
+Запуск:
+    python check_storage.py
+    python check_storage.py --backends local
+    S3_BUCKET=backups S3_ENDPOINT_URL=http://127.0.0.1:9000 AWS_ACCESS_KEY_ID=test \\
+    AWS_SECRET_ACCESS_KEY=test python check_storage.py --require-s3
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+
+from storage import READ_SIZE, LocalStorage, S3Storage, StorageBackend
+
+# Больше порции чтения, чтобы get_range отдавал объект несколькими частями
+LARGE_OBJECT_SIZE = 2 * READ_SIZE + 12345
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise AssertionError(message)
+
+
+def read(storage: StorageBackend, key: str, start: int = 0, end: int = None) -> bytes:
+    return b"".join(storage.get_range(key, start, end))
+
+
+def check_put_and_read(storage: StorageBackend):
+    """put из bytes и из файла, чтение целиком и по диапазонам."""
+    storage.put("a/small", b"hello world")
+    check(read(storage, "a/small") == b"hello world", "get_range без границ вернул не весь объект")
+    check(read(storage, "a/small", 6) == b"world", "get_range(start) читает не с начала диапазона")
+    check(read(storage, "a/small", 0, 4) == b"hello", "get_range(start, end) - end не включительно")
+    check(read(storage, "a/small", 10, 10) == b"d", "get_range одного байта")
+
+    data = os.urandom(LARGE_OBJECT_SIZE)
+    storage.put("a/large", io.BytesIO(data))
+    check(read(storage, "a/large") == data, "объект, записанный из файла, прочитан с ошибкой")
+    start, end = READ_SIZE - 10, 2 * READ_SIZE + 10
+    check(read(storage, "a/large", start, end) == data[start:end + 1], "диапазон на границе порций чтения")
+    check(read(storage, "a/large", LARGE_OBJECT_SIZE - 5) == data[-5:], "хвост объекта")
+
+
+def check_stat_and_exists(storage: StorageBackend):
+    """stat возвращает размер и время изменения, для отсутствующего ключа - None."""
+    before = time.time()
+    storage.put("b/object", b"x" * 100)
+    object_stat = storage.stat("b/object")
+    check(object_stat is not None, "stat существующего объекта вернул None")
+    check(object_stat.size == 100, f"stat: размер {object_stat.size} вместо 100")
+    # Часы S3 и время изменения на диске округляются до секунды
+    check(abs(object_stat.modified - before) < 120, "stat: время изменения далеко от текущего")
+    check(storage.exists("b/object"), "exists существующего объекта вернул False")
+    check(storage.stat("b/missing") is None, "stat отсутствующего объекта не None")
+    check(not storage.exists("b/missing"), "exists отсутствующего объекта вернул True")
+
+
+def check_overwrite(storage: StorageBackend):
+    """Повторный put заменяет объект целиком."""
+    storage.put("c/object", b"first version, longer")
+    storage.put("c/object", b"second")
+    check(read(storage, "c/object") == b"second", "после перезаписи прочитано старое содержимое")
+    check(storage.stat("c/object").size == 6, "после перезаписи stat вернул старый размер")
+
+
+def check_list(storage: StorageBackend):
+    """list отдаёт ключи с префиксом, в том числе вложенные и с префиксом посреди имени."""
+    for key in ("d/1/x", "d/1/y", "d/2/x", "d/10/z", "dd/x"):
+        storage.put(key, b"1")
+    check(sorted(storage.list("d/")) == ["d/1/x", "d/1/y", "d/10/z", "d/2/x"], "list по каталогу")
+    check(sorted(storage.list("d/1")) == ["d/1/x", "d/1/y", "d/10/z"], "list по префиксу имени")
+    check(sorted(storage.list("d/1/")) == ["d/1/x", "d/1/y"], "list по вложенному каталогу")
+    check(list(storage.list("d/3/")) == [], "list по отсутствующему префиксу")
+    check({"d/1/x", "dd/x"} <= set(storage.list("")), "list без префикса")
+
+
+def check_delete(storage: StorageBackend):
+    """delete удаляет объект, отсутствие объекта не ошибка; чтение удалённого - FileNotFoundError."""
+    storage.put("e/object", b"data")
+    storage.delete("e/object")
+    check(not storage.exists("e/object"), "объект остался после delete")
+    check("e/object" not in set(storage.list("e/")), "удалённый объект есть в list")
+    storage.delete("e/object")
+    storage.delete("e/never-existed")
+    try:
+        read(storage, "e/object")
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("чтение отсутствующего объекта не вызвало FileNotFoundError")
+
+
+def check_local_specific(storage: LocalStorage):
+    """LocalStorage: служебные файлы с точкой не объекты, недопустимые ключи отклоняются."""
+    storage.put("f/object", b"1")
+    with open(os.path.join(storage.root, "f", ".session_1.part"), "wb") as f:
+        f.write(b"partial")
+    os.makedirs(os.path.join(storage.root, ".tmp"), exist_ok=True)
+    check(list(storage.list("f/")) == ["f/object"], "list вернул служебный файл")
+    for key in ("", "../outside", "f//object", "f/./object"):
+        try:
+            storage.put(key, b"1")
+        except ValueError:
+            continue
+        raise AssertionError(f"недопустимый ключ {key!r} принят")
+
+
+CONTRACT_CHECKS = (check_put_and_read, check_stat_and_exists, check_overwrite, check_list, check_delete)
+
+
+def run_checks(name: str, storage: StorageBackend, checks) -> int:
+    """Выполнить проверки и напечатать результат. Возвращает число неудачных проверок."""
+    failed = 0
+    for check_function in checks:
+        try:
+            check_function(storage)
+        except Exception:
+            failed += 1
+            print(f"{name:<6} {check_function.__name__:<24} ОШИБКА")
+            traceback.print_exc()
+        else:
+            print(f"{name:<6} {check_function.__name__:<24} ok")
+    return failed
+
+
+def clear_storage(storage: StorageBackend):
+    for key in list(storage.list("")):
+        storage.delete(key)
+
+
+def check_local() -> int:
+    with tempfile.TemporaryDirectory(prefix="storage-check-") as root:
+        storage = LocalStorage(root)
+        return run_checks("local", storage, CONTRACT_CHECKS + (check_local_specific,))
+
+
+def check_s3(require: bool) -> int:
+    bucket = os.environ.get("S3_BUCKET")
+    if bucket:
+        # Отдельный префикс на каждый запуск, чтобы не задеть объекты в бакете
+        prefix = "/".join(filter(None, [os.environ.get("S3_PREFIX", "").strip("/"),
+                                        f"storage-check-{uuid.uuid4().hex}"]))
+        storage = S3Storage(bucket, prefix, os.environ.get("S3_ENDPOINT_URL"), os.environ.get("S3_REGION"))
+        try:
+            return run_checks("s3", storage, CONTRACT_CHECKS)
+        finally:
+            clear_storage(storage)
+
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print("s3     пропущено: не задан S3_BUCKET и не установлен moto")
+        return 1 if require else 0
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            os.environ.setdefault(name, "test")
+        storage = S3Storage("storage-check", endpoint_url=f"http://{host}:{port}", region_name="us-east-1")
+        storage.client.create_bucket(Bucket=storage.bucket)
+        return run_checks("s3", storage, CONTRACT_CHECKS)
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=("local", "s3"), default=["local", "s3"],
+                        help="Какие реализации проверять")
+    parser.add_argument("--require-s3", action="store_true", help="Считать ошибкой пропуск проверки S3")
+    args = parser.parse_args()
+
+    failed = 0
+    if "local" in args.backends:
+        failed += check_local()
+    if "s3" in args.backends:
+        failed += check_s3(args.require_s3)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
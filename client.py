@@ -1,23 +1,58 @@
-import tkinter as tk
-from tkinter import messagebox, filedialog
 import requests
 import json
 import os
+import sys
+import time
+import getpass
+import argparse
+import sqlite3
+import itertools
+import threading
 import logging
-from cryptography.fernet import Fernet
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("client.log"),  # Логирование в файл
-        logging.StreamHandler(),  # Логирование в консоль
-    ],
-)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from hashlib import sha256
+from cryptography.fernet import Fernet, InvalidToken
+
+import compressors
+import container
+from logging_setup import SAMPLED, configure_logging
+
+# Настройка логирования: запись через очередь в фоновом потоке (logging_setup.py)
+configure_logging("client.log")
 logger = logging.getLogger("BackupClient")
 
 CONFIG_FILE = "config.json"
+MANIFEST_FILE = "backup_manifest.db"  # Локальный кэш состояния файлов для резервного копирования папок
+SERVER_URL = "http://127.0.0.1:8000"
+TRANSFER_WORKERS = 4  # Количество параллельных соединений/потоков передачи
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # Размер блока возобновляемой загрузки (4 МБ)
+UPLOAD_MAX_RETRIES = 5  # Количество повторных попыток при обрыве соединения
+DELTA_BATCH_CHUNKS = 64  # Сколько блоков проверять на сервере одним запросом
+DELTA_BATCH_BYTES = 16 * 1024 * 1024  # Сколько байт зашифрованных блоков одного файла держать в памяти до отправки
+TOKEN_REFRESH_MARGIN = 60  # За сколько секунд до истечения токена запрашивать новый
+LIST_PAGE_SIZE = 200  # Сколько резервных копий запрашивать за одну страницу списка
+
+# Коды завершения режима командной строки
+EXIT_OK = 0
+EXIT_ERROR = 1  # Ошибка сети, сервера или файловой системы
+EXIT_USAGE = 2  # Неверные аргументы (argparse)
+EXIT_AUTH = 3  # Неверные учётные данные
+EXIT_PARTIAL = 4  # Часть файлов не удалось обработать
+
+
+def send_with_retries(send):
+    """Выполнить запрос, повторяя его при обрыве соединения."""
+    for attempt in range(1, UPLOAD_MAX_RETRIES + 1):
+        try:
+            response = send()
+            response.raise_for_status()
+            return response
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == UPLOAD_MAX_RETRIES:
+                raise
+            logger.warning(f"Обрыв соединения ({e}), попытка {attempt}")
+            time.sleep(min(2 ** attempt, 30))
 
 
 def load_config():
@@ -34,421 +69,598 @@ def save_config(config):
         json.dump(config, f, indent=4)
 
 
-class Application(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("Клиент резервного копирования")
-        self.config = load_config()
-
-        # Хранилище токена и ключей
-        self.token = None
-        self.license_key = self.config.get("license_key", "")
-
-        # Контейнер для страниц
-        self.container = tk.Frame(self)
-        self.container.pack(fill="both", expand=True)
-
-        # Словарь страниц
-        self.frames = {}
-
-        # Инициализация страниц
-        for Page in (RegisterPage, LoginPage, MainPage, LicensePage):
-            page_name = Page.__name__
-            frame = Page(parent=self.container, controller=self)
-            self.frames[page_name] = frame
-            frame.grid(row=0, column=0, sticky="nsew")
-
-        # Переход на страницу входа
-        self.show_frame("LoginPage")
-
-        # Автоматическое подстраивание размеров окна
-        self.update_idletasks()
-        self.minsize(self.winfo_width(), self.winfo_height())  # Минимальный размер окна
-        self.geometry(f"{self.winfo_width()}x{self.winfo_height()}")  # Установка начального размера
+class LocalManifest:
+    """
+    Локальный кэш состояния файлов (путь, размер, mtime, контрольная сумма) в SQLite.
 
-    def show_frame(self, page_name):
-        """Отображение страницы по имени."""
-        frame = self.frames[page_name]
-        frame.tkraise()
-        logger.info(f"Переход на страницу: {page_name}")
-
-
-class RegisterPage(tk.Frame):
-    """Страница регистрации."""
-
-    def __init__(self, parent, controller):
-        super().__init__(parent)
-        self.controller = controller
-
-        tk.Label(self, text="Регистрация", font=("Arial", 16)).pack(pady=10)
-
-        tk.Label(self, text="Логин").pack(pady=5)
-        self.username_entry = tk.Entry(self, width=30)
-        self.username_entry.pack()
-
-        tk.Label(self, text="Пароль").pack(pady=5)
-        self.password_entry = tk.Entry(self, show="*", width=30)
-        self.password_entry.pack()
-
-        tk.Button(self, text="Зарегистрироваться", command=self.register).pack(pady=10)
-        tk.Button(self, text="Назад", command=lambda: controller.show_frame("LoginPage")).pack()
-
-    def register(self):
-        username = self.username_entry.get()
-        password = self.password_entry.get()
-        try:
-            response = requests.post(f"http://127.0.0.1:8000/register",
-                                     json={"username": username, "password": password})
-            response.raise_for_status()
-            messagebox.showinfo("Успех", "Регистрация выполнена!")
-            logger.info(f"Регистрация пользователя {username} выполнена успешно")
-            self.controller.show_frame("LoginPage")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка регистрации пользователя {username}: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка регистрации: {e}")
+    Позволяет при повторном резервном копировании папки пропускать файлы, размер и время
+    изменения которых не менялись, не читая их содержимое.
+    """
 
+    def __init__(self, path=MANIFEST_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, checksum TEXT, remote_name TEXT, uploaded_at REAL)"
+        )
 
-class LoginPage(tk.Frame):
-    """Страница входа."""
+    def is_unchanged(self, path, file_stat):
+        row = self.conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+        return row is not None and row == (file_stat.st_size, file_stat.st_mtime_ns)
 
-    def __init__(self, parent, controller):
-        super().__init__(parent)
+    def record(self, path, file_stat, checksum, remote_name):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, checksum, remote_name, uploaded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, file_stat.st_size, file_stat.st_mtime_ns, checksum, remote_name, time.time()),
+        )
+        self.conn.commit()
+
+    def forget_missing(self, folder, seen):
+        """Удалить из кэша записи о файлах папки, которых больше нет на диске."""
+        prefix = os.path.join(folder, "")
+        rows = self.conn.execute("SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+        stale = [(path,) for (path,) in rows if path not in seen]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", stale)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class TransferEngine:
+    """
+    Сетевые операции клиента без привязки к интерфейсу.
+
+    Все запросы идут через один requests.Session с пулом соединений (HTTP keep-alive).
+    Блоки одного файла передаются параллельно в пуле chunk_pool, а целые файлы
+    обрабатываются параллельно в пуле job_pool; пулы разные, чтобы задачи файлов
+    не блокировали потоки, нужные для передачи их блоков.
+    """
+
+    def __init__(self, server_url=SERVER_URL, workers=TRANSFER_WORKERS, codec=compressors.DEFAULT_CODEC):
+        self.server_url = server_url.rstrip("/")
+        self.codec = codec  # Кодек сжатия перед шифрованием, например "zstd:3" (compressors.py)
+        compressors.parse_codec(codec)  # Ошибка в настройке видна сразу, а не при первой загрузке
+        self.token = None
+        self.token_expires = 0  # Время истечения токена (time.time())
+        self._token_lock = threading.Lock()
         self.encryption_key = None
-        self.controller = controller
-
-        tk.Label(self, text="Вход в систему", font=("Arial", 16)).pack(pady=10)
-
-        tk.Label(self, text="Логин").pack(pady=5)
-        self.username_entry = tk.Entry(self, width=30)
-        self.username_entry.pack()
-
-        tk.Label(self, text="Пароль").pack(pady=5)
-        self.password_entry = tk.Entry(self, show="*", width=30)
-        self.password_entry.pack()
-
-        tk.Button(self, text="Войти", command=self.login).pack(pady=10)
-        tk.Button(self, text="Регистрация", command=lambda: controller.show_frame("RegisterPage")).pack()
-
-    def login(self):
-        username = self.username_entry.get()
-        password = self.password_entry.get()
-        try:
-            response = requests.post(f"http://127.0.0.1:8000/token", data={"username": username, "password": password})
-            response.raise_for_status()
-            data = response.json()
-            self.controller.token = data["access_token"]
-            self.controller.encryption_key = data["encryption_key"]
-            messagebox.showinfo("Успех", "Вход выполнен успешно!")
-            logger.info(f"Пользователь {username} вошёл в систему")
-            self.controller.show_frame("MainPage")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка входа пользователя {username}: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка входа: {e}")
-
-
-"""
-class LicenseRequestPage(tk.Frame):
-    Страница получения лицензии или цифровой подписи.
-
-    def __init__(self, parent, controller):
-        super().__init__(parent)
-        self.controller = controller
-
-        tk.Label(self, text="Запрос лицензии", font=("Arial", 16)).pack(pady=10)
-
-        tk.Button(self, text="Получить ключ активации", command=self.get_license_key).pack(pady=5)
-        tk.Button(self, text="Скачать файл лицензии", command=self.download_license_file).pack(pady=5)
-        tk.Button(self, text="Назад", command=lambda: controller.show_frame("LicensePage")).pack(pady=10)
-
-    def get_license_key(self):
-        Запрос ключа активации с сервера.
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
-        try:
-            response = requests.post(f"http://127.0.0.1:8000/licenses/generate", headers=headers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.chunk_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk")
+        self.job_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transfer")
+
+    def url(self, path):
+        return f"{self.server_url}{path}"
+
+    @property
+    def headers(self):
+        """Заголовок авторизации; токен обновляется заранее, до истечения срока действия."""
+        if self.token and time.time() > self.token_expires - TOKEN_REFRESH_MARGIN:
+            self.refresh_token()
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def _set_token(self, data):
+        self.token = data["access_token"]
+        self.token_expires = time.time() + data.get("expires_in", 0)
+
+    def refresh_token(self):
+        """Обменять текущий токен на новый (вызывается из любого потока)."""
+        with self._token_lock:
+            # Токен мог уже обновить другой поток, пока этот ждал блокировку
+            if time.time() <= self.token_expires - TOKEN_REFRESH_MARGIN:
+                return
+            response = self.session.post(self.url("/token/refresh"),
+                                         headers={"Authorization": f"Bearer {self.token}"})
             response.raise_for_status()
-            license_data = response.json()
-            messagebox.showinfo("Успех", f"Ключ активации: {license_data['key']}")
-            logger.info(f"Получен ключ активации: {license_data['key']}")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка получения ключа активации: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка получения ключа активации: {e}")
-
-    def download_license_file(self):
-        Скачать файл лицензии с сервера.
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
+            self._set_token(response.json())
+
+    def submit(self, task, *args, **kwargs):
+        """Выполнить операцию в фоновом потоке. Возвращает Future."""
+        return self.job_pool.submit(task, *args, **kwargs)
+
+    def login(self, username, password):
+        """Получить токен и ключ шифрования."""
+        response = self.session.post(self.url("/token"), data={"username": username, "password": password})
+        response.raise_for_status()
+        data = response.json()
+        self._set_token(data)
+        self.encryption_key = data["encryption_key"]
+        return data
+
+    def register(self, username, password):
+        """Зарегистрировать нового пользователя."""
+        response = self.session.post(self.url("/register"), json={"username": username, "password": password})
+        response.raise_for_status()
+        return response.json()
+
+    def activate_license(self, license_key):
+        """Активировать лицензию по ключу."""
+        response = self.session.post(self.url("/licenses/activation-key"), headers=self.headers,
+                                     json={"key": license_key})
+        response.raise_for_status()
+        return response.json()
+
+    def verify_license(self, license_data, signature):
+        """Проверить файл лицензии на сервере. Возвращает True, если подпись действительна."""
+        response = self.session.post(self.url("/licenses/verify"), headers=self.headers,
+                                     json={"license_data": license_data, "signature": signature})
+        response.raise_for_status()
+        return bool(response.json().get("valid"))
+
+    def list_backups(self, cursor=None, limit=LIST_PAGE_SIZE, **filters):
+        """
+        Одна страница списка резервных копий: {"items": [...], "next_cursor": ...}.
+
+        filters - параметры отбора сервера: prefix, date_from, date_to, min_size, max_size, order.
+        """
+        params = {"limit": limit, **{name: value for name, value in filters.items() if value is not None}}
+        if cursor:
+            params["cursor"] = cursor
+        response = self.session.get(self.url("/backups/"), headers=self.headers, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_backups(self, **filters):
+        """Все резервные копии, удовлетворяющие фильтрам, с постраничной загрузкой."""
+        cursor = None
+        while True:
+            page = self.list_backups(cursor, **filters)
+            yield from page["items"]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+    def delete_backup(self, filename):
+        response = self.session.delete(self.url(f"/backups/{filename}"), headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def delta_upload(self, file_path, progress=None, remote_name=None, codec=None):
+        """
+        Загрузка только изменившихся блоков файла.
+
+        Файл разбивается на блоки по содержимому, каждый блок шифруется детерминированно
+        (container.py), поэтому неизменённые блоки совпадают с уже загруженными. Сервер
+        сообщает, каких блоков у него нет, и отправляются только они - параллельно.
+        progress(обработано байт, всего байт) вызывается из фонового потока.
+        remote_name - имя на сервере (по умолчанию имя файла с суффиксом .enc).
+        codec - кодек сжатия блоков перед шифрованием (по умолчанию self.codec).
+        """
+        codec = codec or self.codec
+        keys = container.ContainerKeys(self.encryption_key)
+        file_size = os.path.getsize(file_path)
+        checksum = sha256()
+        chunk_hashes = []
+        stats = {"total": 0, "sent": 0, "plain": 0, "queries": 0}
+
+        def put_chunk(chunk_hash, frame):
+            send_with_retries(lambda: self.session.put(
+                self.url(f"/backups/chunks/{chunk_hash}"), headers=self.headers, data=frame))
+            return len(frame)
+
+        def flush(batch):
+            query = {"hashes": [chunk_hash for chunk_hash, _ in batch]}
+            if not stats["queries"]:
+                query["size"] = file_size  # Сервер проверит квоту до отправки первого блока
+            stats["queries"] += 1
+            response = send_with_retries(lambda: self.session.post(
+                self.url("/backups/chunks/query"), headers=self.headers, json=query))
+            missing = set(response.json()["missing"])
+            futures = []
+            for chunk_hash, frame in batch:
+                if chunk_hash in missing:
+                    missing.discard(chunk_hash)
+                    futures.append(self.chunk_pool.submit(put_chunk, chunk_hash, frame))
+            for future in futures:
+                stats["sent"] += future.result()
+            if progress:
+                progress(stats["plain"], file_size)
+
+        batch = []
+        batch_bytes = 0
+        with open(file_path, "rb") as f:
+            for frame in container.iter_encrypted_frames(keys, f, codec=codec):
+                chunk_hash = sha256(frame).hexdigest()
+                checksum.update(frame)
+                chunk_hashes.append(chunk_hash)
+                stats["total"] += len(frame)
+                stats["plain"] = min(f.tell(), file_size)
+                batch.append((chunk_hash, frame))
+                batch_bytes += len(frame)
+                if len(batch) >= DELTA_BATCH_CHUNKS or batch_bytes >= DELTA_BATCH_BYTES:
+                    flush(batch)
+                    batch = []
+                    batch_bytes = 0
+        flush(batch)
+
+        response = send_with_retries(lambda: self.session.post(
+            self.url("/backups/manifest"), headers=self.headers,
+            json={"filename": remote_name or os.path.basename(file_path) + ".enc", "checksum": checksum.hexdigest(),
+                  "chunks": chunk_hashes, "codec": compressors.parse_codec(codec)[0]}))
+        logger.info(f"Файл {file_path}: отправлено {stats['sent']} из {stats['total']} байт "
+                    f"(исходный размер {file_size}, кодек {codec})", extra=SAMPLED)
+        result = response.json()
+        result["checksum"] = checksum.hexdigest()
+        return result
+
+    def backup_folder(self, folder, progress=None, manifest_path=MANIFEST_FILE):
+        """
+        Инкрементальное резервное копирование папки.
+
+        Обходит дерево каталогов и сверяет размер и mtime каждого файла с локальным
+        кэшем (LocalManifest). Хешируются и загружаются только новые и изменённые файлы,
+        несколько файлов - параллельно. Имя на сервере строится из пути относительно
+        родителя папки, разделители каталогов заменяются на "__".
+        progress(обработано файлов, всего файлов) вызывается из фонового потока.
+        """
+        folder = os.path.abspath(folder)
+        parent = os.path.dirname(folder)
+        manifest = LocalManifest(manifest_path)
+        summary = {"uploaded": 0, "skipped": 0, "failed": []}
         try:
-            response = requests.get(f"http://127.0.0.1:8000/licenses/download", headers=headers)
-            response.raise_for_status()
-            file_data = response.content
-
-            save_path = filedialog.asksaveasfilename(defaultextension=".lic", title="Сохранить файл лицензии")
-            if save_path:
-                with open(save_path, "wb") as f:
-                    f.write(file_data)
-                messagebox.showinfo("Успех", "Файл лицензии успешно сохранён!")
-                logger.info(f"Файл лицензии сохранён в {save_path}")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка скачивания файла лицензии: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка скачивания файла лицензии: {e}")
-"""
-
-
-class MainPage(tk.Frame):
-    """Главная страница."""
-
-    def __init__(self, parent, controller):
-        super().__init__(parent)
-        self.controller = controller
-
-        # Создаем главную рамку и выравниваем элементы по центру
-        main_frame = tk.Frame(self)
-        main_frame.pack(expand=True, fill="both")
-
-        # Заголовок страницы
-        tk.Label(main_frame, text="Главная страница", font=("Arial", 16)).grid(row=0, column=0, columnspan=2, pady=10)
-
-        # Кнопки операций
-        tk.Button(main_frame, text="Выбрать файл для загрузки", command=self.upload_file, width=30).grid(row=1,
-                                                                                                         column=0,
-                                                                                                         pady=5,
-                                                                                                         padx=10)
-        tk.Button(main_frame, text="Показать резервные копии", command=self.list_backups, width=30).grid(row=1,
-                                                                                                         column=1,
-                                                                                                         pady=5,
-                                                                                                         padx=10)
-
-        # Список резервных копий
-        self.backup_listbox = tk.Listbox(main_frame, width=80, height=10)
-        self.backup_listbox.grid(row=2, column=0, columnspan=2, pady=10)
-
-        # Кнопки для работы с резервными копиями
-        tk.Button(main_frame, text="Скачать выбранную резервную копию", command=self.download_backup, width=30).grid(
-            row=3, column=0, pady=5, padx=10)
-        tk.Button(main_frame, text="Удалить выбранную резервную копию", command=self.delete_backup, width=30).grid(
-            row=3, column=1, pady=5, padx=10)
-
-        # Кнопка активации лицензии
-        tk.Button(main_frame, text="Активировать лицензию", command=lambda: controller.show_frame("LicensePage"),
-                  width=30).grid(row=4, column=0, columnspan=2, pady=20)
-
-    def encrypt_file(self, file_path, key):
-        """Шифрование файла перед отправкой на сервер."""
-        cipher = Fernet(key)
-        with open(file_path, 'rb') as f:
-            encrypted_data = cipher.encrypt(f.read())
-        encrypted_file_path = file_path + ".enc"
-        with open(encrypted_file_path, 'wb') as f:
-            f.write(encrypted_data)
-        return encrypted_file_path
-
-    def decrypt_file(self, file_path, key):
-        """Расшифровка файла после скачивания."""
-        cipher = Fernet(key)
+            changed = []
+            seen = set()
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        file_stat = os.stat(path)
+                    except OSError as e:
+                        logger.warning(f"Не удалось прочитать {path}: {e}")
+                        continue
+                    seen.add(path)
+                    if manifest.is_unchanged(path, file_stat):
+                        summary["skipped"] += 1
+                    else:
+                        changed.append((path, file_stat))
+            manifest.forget_missing(folder, seen)
+
+            total = len(changed)
+            logger.info(f"Папка {folder}: изменено {total} файлов, без изменений {summary['skipped']}")
+            if progress:
+                progress(0, total)
+
+            with ThreadPoolExecutor(max_workers=self.job_pool._max_workers, thread_name_prefix="folder") as pool:
+                futures = {}
+                for path, file_stat in changed:
+                    remote_name = os.path.relpath(path, parent).replace(os.sep, "__") + ".enc"
+                    futures[pool.submit(self.delta_upload, path, None, remote_name)] = (path, file_stat, remote_name)
+                for done, future in enumerate(as_completed(futures), 1):
+                    path, file_stat, remote_name = futures[future]
+                    try:
+                        result = future.result()
+                    except (requests.RequestException, OSError) as e:
+                        logger.error(f"Ошибка загрузки файла {path}: {e}")
+                        summary["failed"].append(path)
+                    else:
+                        summary["uploaded"] += 1
+                        # Файл мог измениться или исчезнуть во время загрузки - тогда он
+                        # не попадает в кэш и будет проверен в следующий раз
+                        try:
+                            unchanged = os.stat(path).st_mtime_ns == file_stat.st_mtime_ns
+                        except OSError as e:
+                            logger.warning(f"Файл {path} недоступен после загрузки: {e}")
+                            unchanged = False
+                        if unchanged:
+                            manifest.record(path, file_stat, result["checksum"], remote_name)
+                    if progress:
+                        progress(done, total)
+        finally:
+            manifest.close()
+        return summary
+
+    def resumable_upload(self, file_path, progress=None, codec=None):
+        """
+        Возобновляемая загрузка файла блоками.
+
+        Файл шифруется в контейнер на лету (container.EncryptingReader), без временной копии.
+        Создаёт сессию на сервере, отправляет блоки с указанием смещения и при обрыве
+        соединения запрашивает у сервера последнее подтверждённое смещение, продолжая
+        с него. В конце сервер сверяет контрольную сумму.
+        """
+        codec = codec or self.codec
+        keys = container.ContainerKeys(self.encryption_key)
+        file_size = os.path.getsize(file_path)
+        response = self.session.post(self.url("/backups/sessions"), headers=self.headers,
+                                     json={"filename": os.path.basename(file_path) + ".enc",
+                                           "codec": compressors.parse_codec(codec)[0]})
+        response.raise_for_status()
+        upload_id = response.json()["upload_id"]
+        session_url = self.url(f"/backups/sessions/{upload_id}")
+
+        offset = 0
+        retries = 0
+        with open(file_path, "rb") as f:
+            reader = container.EncryptingReader(keys, f, codec=codec)
+            while True:
+                reader.seek(offset)
+                chunk = reader.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                try:
+                    response = self.session.put(session_url, headers=self.headers, params={"offset": offset},
+                                                data=chunk)
+                    if response.status_code == 409:
+                        # Сервер подтвердил другое смещение - продолжаем с него
+                        offset = response.json()["detail"]["offset"]
+                        continue
+                    response.raise_for_status()
+                    offset = response.json()["offset"]
+                    retries = 0
+                    if progress:
+                        progress(min(f.tell(), file_size), file_size)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    retries += 1
+                    if retries > UPLOAD_MAX_RETRIES:
+                        raise
+                    logger.warning(f"Обрыв соединения при загрузке {file_path} ({e}), попытка {retries}")
+                    time.sleep(min(2 ** retries, 30))
+                    offset = self.get_upload_offset(session_url)
+
+        response = self.session.post(f"{session_url}/complete", headers=self.headers,
+                                     json={"checksum": reader.checksum.hexdigest()})
+        response.raise_for_status()
+        return response.json()
+
+    def get_upload_offset(self, session_url):
+        """Запросить у сервера подтверждённое смещение сессии загрузки."""
+        for attempt in range(1, UPLOAD_MAX_RETRIES + 1):
+            try:
+                response = self.session.get(session_url, headers=self.headers)
+                response.raise_for_status()
+                return response.json()["offset"]
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.warning(f"Не удалось получить смещение загрузки ({e}), попытка {attempt}")
+                time.sleep(min(2 ** attempt, 30))
+        raise requests.ConnectionError("Сервер недоступен")
+
+    def decrypt_file(self, file_path):
+        """Расшифровка сохранённого на диск файла (контейнер или старый формат Fernet)."""
+        if container.is_container(file_path):
+            # Контейнер расшифровывается поблочно, без загрузки файла в память целиком
+            keys = container.ContainerKeys(self.encryption_key)
+            with open(file_path, 'rb') as src, open(file_path[:-4], 'wb') as dst:
+                for chunk in container.iter_decrypted_frames(keys, src):
+                    dst.write(chunk)
+            os.remove(file_path)
+            return
+
+        cipher = Fernet(self.encryption_key)
         with open(file_path, 'rb') as f:
             decrypted_data = cipher.decrypt(f.read())
         with open(file_path[:-4], 'wb') as f:
             f.write(decrypted_data)
         os.remove(file_path)
 
-    def upload_file(self):
-        """Загрузка файла на сервер."""
-        file_path = filedialog.askopenfilename()
-        if not file_path:
-            logger.warning("Попытка загрузки файла без выбора файла")
-            return
-
-        if not self.controller.encryption_key:
-            logger.error("Отсутствует ключ шифрования")
-            messagebox.showerror("Ошибка", "Не удалось загрузить файл: отсутствует ключ шифрования")
-            return
-
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
-        try:
-            file_path = self.encrypt_file(file_path, self.controller.encryption_key)
-            with open(file_path, "rb") as f:
-                file_data = f.read()
-            files = {"files": (os.path.basename(file_path), file_data)}
-            response = requests.post(f"http://127.0.0.1:8000/backups/upload", headers=headers, files=files)
+    def stream_download(self, filename, save_path, progress=None):
+        """
+        Скачать резервную копию и расшифровать её по мере получения.
+
+        Контейнер расшифровывается покадрово прямо из сетевого потока в save_path.
+        Прогресс (смещение последнего целого кадра) сохраняется в save_path.progress,
+        поэтому при обрыве соединения - в том числе после перезапуска клиента - загрузка
+        продолжается запросом Range с этого смещения. If-Range с ETag гарантирует, что
+        продолжение относится к той же версии файла.
+        Файлы старого формата (Fernet) докачиваются в .enc и расшифровываются целиком.
+        """
+        progress_path = save_path + ".progress"
+        state = {"filename": filename, "etag": None, "format": None, "magic": None, "offset": 0, "plain_offset": 0,
+                 "resume": None}
+        if os.path.exists(progress_path):
+            with open(progress_path, "r") as f:
+                saved_state = json.load(f)
+            if saved_state.get("filename") == filename:
+                state = saved_state
+                logger.info(f"Продолжение загрузки {filename} с байта {state['offset']}")
+
+        for attempt in range(1, UPLOAD_MAX_RETRIES + 1):
+            try:
+                self.download_attempt(filename, save_path, state, progress_path, progress)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == UPLOAD_MAX_RETRIES:
+                    raise
+                logger.warning(f"Обрыв соединения при скачивании {filename} ({e}), попытка {attempt}")
+                time.sleep(min(2 ** attempt, 30))
+
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        if state["format"] == "legacy":
+            # decrypt_file записывает результат в save_path и удаляет .enc
+            self.decrypt_file(save_path + ".enc")
+
+    def download_attempt(self, filename, save_path, state, progress_path, progress=None):
+        """Одна попытка скачивания с текущего смещения state["offset"]."""
+        request_headers = dict(self.headers)
+        if state["offset"]:
+            request_headers["Range"] = f"bytes={state['offset']}-"
+            request_headers["If-Range"] = state["etag"]
+
+        with self.session.get(self.url(f"/backups/download/{filename}"), headers=request_headers,
+                              stream=True) as response:
             response.raise_for_status()
-            messagebox.showinfo("Успех", "Файл успешно загружен!")
-            logger.info(f"Файл {os.path.basename(file_path)} успешно загружен")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка загрузки файла {os.path.basename(file_path)}: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка загрузки файла: {e}")
-
-    def list_backups(self):
-        """Получение списка резервных копий с сервера и обновление интерфейса."""
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
+            if response.status_code != 206:
+                # Сервер отдаёт файл целиком (первая попытка или файл изменился)
+                state.update(format=None, magic=None, offset=0, plain_offset=0, resume=None)
+            state["etag"] = response.headers.get("ETag")
+            total = state["offset"] + int(response.headers.get("Content-Length", 0))
+            stream = response.iter_content(chunk_size=UPLOAD_CHUNK_SIZE)
+
+            head = b""
+            if state["format"] is None:
+                for data in stream:
+                    head += data
+                    if len(head) >= len(container.CONTAINER_MAGIC):
+                        break
+                magic = head[:len(container.CONTAINER_MAGIC)]
+                if magic in container.CONTAINER_MAGICS:
+                    state.update(format="container", magic=magic.decode())
+                else:
+                    state["format"] = "legacy"
+
+            def save_progress():
+                with open(progress_path, "w") as f:
+                    json.dump(state, f)
+                if progress:
+                    progress(state["offset"], total)
+
+            if state["format"] == "legacy":
+                encrypted_path = save_path + ".enc"
+                with open(encrypted_path, "r+b" if state["offset"] else "wb") as f:
+                    f.truncate(state["offset"])
+                    f.seek(state["offset"])
+                    for data in itertools.chain([head], stream):
+                        f.write(data)
+                        state["offset"] += len(data)
+                        save_progress()
+                return
+
+            keys = container.ContainerKeys(self.encryption_key)
+            # Версия формата нужна при продолжении, когда заголовка в потоке уже нет
+            magic = (state.get("magic") or container.CONTAINER_MAGIC_V1.decode()).encode()
+            decoder = container.ContainerDecoder(keys, state["offset"], magic, state.get("resume"))
+            with open(save_path, "r+b" if state["offset"] else "wb") as f:
+                # Отбрасываем расшифрованные данные неполного кадра, если они были записаны
+                f.truncate(state["plain_offset"])
+                f.seek(state["plain_offset"])
+                for data in itertools.chain([head], stream):
+                    chunks = decoder.update(data)
+                    for chunk in chunks:
+                        f.write(chunk)
+                    if chunks:
+                        f.flush()
+                        state.update(offset=decoder.consumed, plain_offset=f.tell(), resume=decoder.resume_state)
+                        save_progress()
+                decoder.finish()
+
+
+def build_cli_parser():
+    """Аргументы режима командной строки."""
+    parser = argparse.ArgumentParser(
+        description="Клиент резервного копирования без графического интерфейса. "
+                    "Результат выводится в stdout в формате JSON, журнал - в stderr и client.log.")
+    parser.add_argument("--server", help="Адрес сервера (по умолчанию из config.json)")
+    parser.add_argument("--username", default=os.environ.get("BACKUP_USERNAME"),
+                        help="Имя пользователя (или переменная окружения BACKUP_USERNAME)")
+    parser.add_argument("--workers", type=int, help="Количество параллельных потоков передачи")
+    parser.add_argument("--codec", help="Сжатие перед шифрованием: none, zlib, lzma, zstd или lz4, "
+                                        "с уровнем через двоеточие, например zstd:9 (по умолчанию из config.json)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("login", help="Проверить учётные данные")
+
+    upload = commands.add_parser("upload", help="Загрузить файлы")
+    upload.add_argument("files", nargs="+")
+    upload.add_argument("--resumable", action="store_true",
+                        help="Возобновляемая загрузка целиком вместо передачи только недостающих блоков")
+
+    list_command = commands.add_parser("list", help="Список резервных копий (от новых к старым)")
+    list_command.add_argument("--prefix", help="Только файлы, имя которых начинается с префикса")
+    list_command.add_argument("--date-from", help="Загруженные не раньше даты (ISO 8601)")
+    list_command.add_argument("--date-to", help="Загруженные раньше даты (ISO 8601)")
+    list_command.add_argument("--limit", type=int, help="Не больше указанного числа записей")
+
+    download = commands.add_parser("download", help="Скачать и расшифровать резервную копию")
+    download.add_argument("filename")
+    download.add_argument("-o", "--output", help="Путь для сохранения (по умолчанию имя без .enc)")
+
+    delete = commands.add_parser("delete", help="Удалить резервные копии")
+    delete.add_argument("filenames", nargs="+")
+
+    sync = commands.add_parser("sync", help="Инкрементальное резервное копирование папки")
+    sync.add_argument("folder")
+    sync.add_argument("--manifest", default=MANIFEST_FILE, help="Файл локального кэша состояния файлов")
+    return parser
+
+
+def run_cli_command(transfer, args):
+    """Выполнить команду; вернуть (результат для вывода, код завершения)."""
+    if args.command == "login":
+        return {"username": args.username}, EXIT_OK
+
+    if args.command == "list":
+        backups = transfer.iter_backups(prefix=args.prefix, date_from=args.date_from, date_to=args.date_to)
+        return list(itertools.islice(backups, args.limit)), EXIT_OK
+
+    if args.command == "download":
+        plain_name = args.filename[:-4] if args.filename.endswith(".enc") else args.filename
+        save_path = args.output or plain_name
+        transfer.stream_download(args.filename, save_path)
+        return {"filename": args.filename, "path": os.path.abspath(save_path)}, EXIT_OK
+
+    if args.command == "sync":
+        summary = transfer.backup_folder(args.folder, manifest_path=args.manifest)
+        return summary, EXIT_PARTIAL if summary["failed"] else EXIT_OK
+
+    # upload и delete обрабатывают несколько файлов: ошибка одного не прерывает остальные
+    if args.command == "upload":
+        upload = transfer.resumable_upload if args.resumable else transfer.delta_upload
+        futures = {file_path: transfer.submit(upload, file_path) for file_path in args.files}
+    else:
+        futures = {filename: transfer.submit(transfer.delete_backup, filename) for filename in args.filenames}
+    results = []
+    for name, future in futures.items():
         try:
-            response = requests.get(f"http://127.0.0.1:8000/backups", headers=headers)
-            response.raise_for_status()
-
-            backups = response.json()  # Обновленный список резервных копий
-            logger.info("Список резервных копий успешно получен")
-
-            # Очистка списка
-            self.backup_listbox.delete(0, tk.END)
-
-            # Обновление списка
-            for backup in backups:
-                display_text = f"{backup['filename']} | {backup['size']} байт | {backup['upload_date']}"
-                self.backup_listbox.insert(tk.END, display_text)
-
-        except requests.RequestException as e:
-            logger.error(f"Ошибка получения списка резервных копий: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка получения списка: {e}")
-
-    def delete_backup(self):
-        """Удаление выбранной резервной копии."""
-        selection = self.backup_listbox.curselection()
-        if not selection:
-            messagebox.showerror("Ошибка", "Выберите резервную копию для удаления!")
-            return
-
-        selected_item = self.backup_listbox.get(selection[0])
-        filename = selected_item.split(" | ")[0]  # Извлекаем имя файла из строки
-
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
+            results.append({"name": name, "ok": True, "result": future.result()})
+        except (requests.RequestException, OSError, ValueError, InvalidToken) as e:
+            logger.error(f"Ошибка обработки {name}: {e}")
+            results.append({"name": name, "ok": False, "error": str(e)})
+    failed = sum(not result["ok"] for result in results)
+    if failed == 0:
+        return results, EXIT_OK
+    return results, EXIT_ERROR if failed == len(results) else EXIT_PARTIAL
+
+
+def cli_main(argv):
+    """
+    Режим командной строки для запуска из cron и скриптов.
+
+    Пароль берётся из переменной окружения BACKUP_PASSWORD, а если её нет - запрашивается
+    в терминале, чтобы он не попадал в список процессов и историю команд.
+    """
+    args = build_cli_parser().parse_args(argv)
+    config = load_config()
+    try:
+        transfer = TransferEngine(args.server or config.get("server_url", SERVER_URL),
+                                  args.workers or config.get("transfer_workers", TRANSFER_WORKERS),
+                                  args.codec or config.get("codec", compressors.DEFAULT_CODEC))
+    except compressors.CompressionError as e:
+        logger.error(str(e))
+        return EXIT_USAGE
+    if not args.username:
+        logger.error("Не указано имя пользователя (--username или BACKUP_USERNAME)")
+        return EXIT_USAGE
+    password = os.environ.get("BACKUP_PASSWORD")
+    if password is None:
+        password = getpass.getpass("Пароль: ")
+
+    try:
         try:
-            response = requests.delete(f"http://127.0.0.1:8000/backups/{filename}", headers=headers)
-            response.raise_for_status()
-            messagebox.showinfo("Успех", f"Резервная копия {filename} успешно удалена!")
-            logger.info(f"Резервная копия {filename} успешно удалена")
-
-            # Обновляем список резервных копий
-            self.list_backups()
-        except requests.RequestException as e:
-            logger.error(f"Ошибка удаления резервной копии {filename}: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка удаления резервной копии: {e}")
-
-    def download_backup(self):
-        """Скачивание выбранной резервной копии."""
-        selection = self.backup_listbox.curselection()
-        if not selection:
-            messagebox.showerror("Ошибка", "Выберите резервную копию для скачивания!")
-            return
-
-        selected_item = self.backup_listbox.get(selection[0])
-        filename = selected_item.split(" | ")[0]  # Извлекаем имя файла из строки
-
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
-        try:
-            response = requests.get(f"http://127.0.0.1:8000/backups/download/{filename}", headers=headers)
-            response.raise_for_status()
-
-            save_path = filedialog.asksaveasfilename(defaultextension=".enc", initialfile=filename)
-            if save_path:
-                with open(save_path, "wb") as f:
-                    f.write(response.content)
-                self.decrypt_file(save_path, self.controller.encryption_key)
-                messagebox.showinfo("Успех", f"Резервная копия {filename} успешно загружена!")
-                logger.info(f"Резервная копия {filename} успешно загружена и сохранена в {save_path}")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка скачивания резервной копии {filename}: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка скачивания резервной копии: {e}")
-
-
-class LicensePage(tk.Frame):
-    """Страница активации лицензии."""
-
-    def __init__(self, parent, controller):
-        super().__init__(parent)
-        self.controller = controller
-
-        tk.Label(self, text="Активация лицензии", font=("Arial", 16)).pack(pady=10)
-
-        tk.Label(self, text="Ключ лицензии").pack(pady=5)
-        self.license_entry = tk.Entry(self, width=30)
-        self.license_entry.pack()
-
-        tk.Button(self, text="Активировать ключ", command=self.activate_license).pack(pady=10)
-        tk.Label(self, text="Или загрузите файл лицензии:").pack(pady=10)
-
-        tk.Button(self, text="Выбрать файл лицензии", command=self.select_license_file).pack(pady=5)
-        self.file_label = tk.Label(self, text="Файл не выбран", font=("Arial", 10))
-        self.file_label.pack()
-
-        tk.Button(self, text="Активировать через файл", command=self.activate_license_from_file).pack(pady=10)
-        tk.Button(self, text="Перейти к главной", command=lambda: controller.show_frame("MainPage")).pack()
-
-        self.selected_file = None  # Выбранный файл лицензии
-
-    def activate_license(self):
-        """Активация лицензии по ключу."""
-        license_key = self.license_entry.get()
-        if not license_key:
-            messagebox.showerror("Ошибка", "Введите ключ лицензии!")
-            logger.warning("Попытка активации без ввода ключа лицензии")
-            return
-
-        headers = {"Authorization": f"Bearer {self.controller.token}"}
-        try:
-            response = requests.post(
-                f"http://127.0.0.1:8000/licenses/activation-key",
-                headers=headers,
-                json={"key": license_key}
-            )
-            response.raise_for_status()
-            self.controller.license_key = license_key
-            messagebox.showinfo("Успех", "Лицензия активирована!")
-            logger.info(f"Лицензия с ключом {license_key} активирована")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка активации лицензии: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка активации лицензии: {e}")
-
-    def select_license_file(self):
-        """Выбор файла лицензии."""
-        self.selected_file = filedialog.askopenfilename(
-            title="Выберите файл лицензии",
-            filetypes=[("License Files", "*.lic")]
-        )
-        if self.selected_file:
-            self.file_label.config(text=f"Выбран файл: {os.path.basename(self.selected_file)}")
-            logger.info(f"Выбран файл лицензии: {self.selected_file}")
-
-    def activate_license_from_file(self):
-        """Активация лицензии через файл."""
-        if not self.selected_file:
-            messagebox.showerror("Ошибка", "Файл лицензии не выбран!")
-            logger.warning("Попытка активации без выбора файла лицензии")
-            return
-
-        try:
-            # Читаем файл лицензии
-            with open(self.selected_file, "r") as f:
-                license_data = f.read()
-
-            # Разделяем данные и подпись
-            try:
-                data, signature = license_data.rsplit("\n", 1)
-            except ValueError:
-                raise ValueError("Формат файла лицензии неверный!")
-
-            headers = {"Authorization": f"Bearer {self.controller.token}"}
-            payload = {"license_data": data, "signature": signature}
-
-            # Отправляем данные для проверки
-            response = requests.post(f"http://127.0.0.1:8000/licenses/verify", headers=headers, json=payload)
-            response.raise_for_status()
-
-            # Проверяем ответ
-            if response.json().get("valid"):
-                messagebox.showinfo("Успех", "Лицензия успешно активирована!")
-                logger.info(f"Лицензия из файла {self.selected_file} успешно активирована")
-            else:
-                messagebox.showerror("Ошибка", "Лицензия недействительна!")
-                logger.error(f"Лицензия из файла {self.selected_file} недействительна")
-        except FileNotFoundError:
-            logger.error("Файл лицензии не найден")
-            messagebox.showerror("Ошибка", "Файл лицензии не найден!")
-        except ValueError as e:
-            logger.error(f"Ошибка формата файла лицензии: {e}")
-            messagebox.showerror("Ошибка", "Формат файла лицензии неверный!")
-        except requests.RequestException as e:
-            logger.error(f"Ошибка активации лицензии через файл: {e}")
-            messagebox.showerror("Ошибка", f"Ошибка активации лицензии: {e}")
+            transfer.login(args.username, password)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 401:
+                logger.error(f"Неверное имя пользователя или пароль: {args.username}")
+                return EXIT_AUTH
+            raise
+        output, exit_code = run_cli_command(transfer, args)
+    except (requests.RequestException, OSError, ValueError, InvalidToken) as e:
+        logger.error(f"Ошибка выполнения команды {args.command}: {e}")
+        print(json.dumps({"error": str(e)}, ensure_ascii=False))
+        return EXIT_ERROR
+
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    return exit_code
 
 
 if __name__ == "__main__":
-    app = Application()
-    app.mainloop()
+    if len(sys.argv) > 1:
+        sys.exit(cli_main(sys.argv[1:]))
+    # Графический интерфейс вынесен в client_gui.py, чтобы режим командной строки работал без Tk.
+    # client_gui импортирует этот модуль - не загружать его второй раз под именем client.
+    sys.modules.setdefault("client", sys.modules[__name__])
+    import client_gui
+    client_gui.main()
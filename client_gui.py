@@ -0,0 +1,524 @@
+"""
+Графический интерфейс клиента резервного копирования (Tk).
+
+Запускается командой python client.py без аргументов. Передача файлов, настройки и
+режим командной строки находятся в client.py; tkinter импортируется только здесь,
+поэтому на серверах без Tk режим командной строки работает.
+"""
+import logging
+import os
+import queue
+import tkinter as tk
+from tkinter import messagebox, filedialog
+
+import compressors
+from client import SERVER_URL, TRANSFER_WORKERS, TransferEngine, load_config
+from logging_setup import SAMPLED
+
+logger = logging.getLogger("BackupClient")
+
+UI_POLL_INTERVAL = 100  # Период обработки событий из фоновых потоков, мс
+LIST_PRELOAD_THRESHOLD = 0.9  # Догружать следующую страницу, когда список прокручен до этой доли
+
+
+class Application(tk.Tk):
+    def __init__(self):
+        super().__init__()
+        self.title("Клиент резервного копирования")
+        self.config = load_config()
+
+        # Хранилище токена и ключей
+        self.transfer = TransferEngine(self.config.get("server_url", SERVER_URL),
+                                       self.config.get("transfer_workers", TRANSFER_WORKERS),
+                                       self.config.get("codec", compressors.DEFAULT_CODEC))
+        self.license_key = self.config.get("license_key", "")
+
+        # События из фоновых потоков: Tk можно трогать только из главного потока
+        self.ui_queue = queue.Queue()
+        self.after(UI_POLL_INTERVAL, self.process_ui_queue)
+
+        # Контейнер для страниц
+        self.container = tk.Frame(self)
+        self.container.pack(fill="both", expand=True)
+
+        # Словарь страниц
+        self.frames = {}
+
+        # Инициализация страниц
+        for Page in (RegisterPage, LoginPage, MainPage, LicensePage):
+            page_name = Page.__name__
+            frame = Page(parent=self.container, controller=self)
+            self.frames[page_name] = frame
+            frame.grid(row=0, column=0, sticky="nsew")
+
+        # Переход на страницу входа
+        self.show_frame("LoginPage")
+
+        # Автоматическое подстраивание размеров окна
+        self.update_idletasks()
+        self.minsize(self.winfo_width(), self.winfo_height())  # Минимальный размер окна
+        self.geometry(f"{self.winfo_width()}x{self.winfo_height()}")  # Установка начального размера
+
+    def show_frame(self, page_name):
+        """Отображение страницы по имени."""
+        frame = self.frames[page_name]
+        frame.tkraise()
+        logger.info(f"Переход на страницу: {page_name}")
+
+    def call_in_ui(self, callback, *args):
+        """Запланировать вызов в главном потоке (можно вызывать из любого потока)."""
+        self.ui_queue.put((callback, args))
+
+    def run_in_background(self, task, on_success, error_text, *args, on_error=None):
+        """
+        Выполнить сетевую операцию в пуле потоков, не блокируя интерфейс.
+
+        Результат или ошибка передаются в главный поток через очередь, которую
+        обрабатывает process_ui_queue. on_error (если задан) вызывается в главном
+        потоке после сообщения об ошибке.
+        """
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"{error_text}: {e}")
+                self.call_in_ui(messagebox.showerror, "Ошибка", f"{error_text}: {e}")
+                if on_error:
+                    self.call_in_ui(on_error)
+            else:
+                self.call_in_ui(on_success, result)
+
+        self.transfer.submit(task, *args).add_done_callback(done)
+
+    def process_ui_queue(self):
+        """Выполнить накопившиеся вызовы из фоновых потоков."""
+        try:
+            while True:
+                callback, args = self.ui_queue.get_nowait()
+                callback(*args)
+        except queue.Empty:
+            pass
+        self.after(UI_POLL_INTERVAL, self.process_ui_queue)
+
+
+class RegisterPage(tk.Frame):
+    """Страница регистрации."""
+
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+
+        tk.Label(self, text="Регистрация", font=("Arial", 16)).pack(pady=10)
+
+        tk.Label(self, text="Логин").pack(pady=5)
+        self.username_entry = tk.Entry(self, width=30)
+        self.username_entry.pack()
+
+        tk.Label(self, text="Пароль").pack(pady=5)
+        self.password_entry = tk.Entry(self, show="*", width=30)
+        self.password_entry.pack()
+
+        tk.Button(self, text="Зарегистрироваться", command=self.register).pack(pady=10)
+        tk.Button(self, text="Назад", command=lambda: controller.show_frame("LoginPage")).pack()
+
+    def register(self):
+        username = self.username_entry.get()
+        password = self.password_entry.get()
+
+        def registered(_):
+            messagebox.showinfo("Успех", "Регистрация выполнена!")
+            logger.info(f"Регистрация пользователя {username} выполнена успешно")
+            self.controller.show_frame("LoginPage")
+
+        self.controller.run_in_background(self.controller.transfer.register, registered, "Ошибка регистрации",
+                                          username, password)
+
+
+class LoginPage(tk.Frame):
+    """Страница входа."""
+
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.encryption_key = None
+        self.controller = controller
+
+        tk.Label(self, text="Вход в систему", font=("Arial", 16)).pack(pady=10)
+
+        tk.Label(self, text="Логин").pack(pady=5)
+        self.username_entry = tk.Entry(self, width=30)
+        self.username_entry.pack()
+
+        tk.Label(self, text="Пароль").pack(pady=5)
+        self.password_entry = tk.Entry(self, show="*", width=30)
+        self.password_entry.pack()
+
+        tk.Button(self, text="Войти", command=self.login).pack(pady=10)
+        tk.Button(self, text="Регистрация", command=lambda: controller.show_frame("RegisterPage")).pack()
+
+    def login(self):
+        username = self.username_entry.get()
+        password = self.password_entry.get()
+
+        def logged_in(_):
+            messagebox.showinfo("Успех", "Вход выполнен успешно!")
+            logger.info(f"Пользователь {username} вошёл в систему")
+            self.controller.show_frame("MainPage")
+
+        self.controller.run_in_background(self.controller.transfer.login, logged_in, "Ошибка входа",
+                                          username, password)
+
+
+"""
+class LicenseRequestPage(tk.Frame):
+    Страница получения лицензии или цифровой подписи.
+
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+
+        tk.Label(self, text="Запрос лицензии", font=("Arial", 16)).pack(pady=10)
+
+        tk.Button(self, text="Получить ключ активации", command=self.get_license_key).pack(pady=5)
+        tk.Button(self, text="Скачать файл лицензии", command=self.download_license_file).pack(pady=5)
+        tk.Button(self, text="Назад", command=lambda: controller.show_frame("LicensePage")).pack(pady=10)
+
+    def get_license_key(self):
+        Запрос ключа активации с сервера.
+        headers = {"Authorization": f"Bearer {self.controller.token}"}
+        try:
+            response = requests.post(f"http://127.0.0.1:8000/licenses/generate", headers=headers)
+            response.raise_for_status()
+            license_data = response.json()
+            messagebox.showinfo("Успех", f"Ключ активации: {license_data['key']}")
+            logger.info(f"Получен ключ активации: {license_data['key']}")
+        except requests.RequestException as e:
+            logger.error(f"Ошибка получения ключа активации: {e}")
+            messagebox.showerror("Ошибка", f"Ошибка получения ключа активации: {e}")
+
+    def download_license_file(self):
+        Скачать файл лицензии с сервера.
+        headers = {"Authorization": f"Bearer {self.controller.token}"}
+        try:
+            response = requests.get(f"http://127.0.0.1:8000/licenses/download", headers=headers)
+            response.raise_for_status()
+            file_data = response.content
+
+            save_path = filedialog.asksaveasfilename(defaultextension=".lic", title="Сохранить файл лицензии")
+            if save_path:
+                with open(save_path, "wb") as f:
+                    f.write(file_data)
+                messagebox.showinfo("Успех", "Файл лицензии успешно сохранён!")
+                logger.info(f"Файл лицензии сохранён в {save_path}")
+        except requests.RequestException as e:
+            logger.error(f"Ошибка скачивания файла лицензии: {e}")
+            messagebox.showerror("Ошибка", f"Ошибка скачивания файла лицензии: {e}")
+"""
+
+
+class MainPage(tk.Frame):
+    """Главная страница."""
+
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+        self.transfer = controller.transfer
+        self.progress = {}  # Текущий прогресс передач: имя файла -> текст
+
+        # Создаем главную рамку и выравниваем элементы по центру
+        main_frame = tk.Frame(self)
+        main_frame.pack(expand=True, fill="both")
+
+        # Заголовок страницы
+        tk.Label(main_frame, text="Главная страница", font=("Arial", 16)).grid(row=0, column=0, columnspan=2, pady=10)
+
+        # Кнопки операций
+        tk.Button(main_frame, text="Выбрать файлы для загрузки", command=self.upload_file, width=30).grid(row=1,
+                                                                                                          column=0,
+                                                                                                          pady=5,
+                                                                                                          padx=10)
+        tk.Button(main_frame, text="Показать резервные копии", command=self.list_backups, width=30).grid(row=1,
+                                                                                                         column=1,
+                                                                                                         pady=5,
+                                                                                                         padx=10)
+
+        # Список резервных копий (можно выбрать несколько для скачивания).
+        # Страницы догружаются с сервера по мере прокрутки.
+        list_frame = tk.Frame(main_frame)
+        list_frame.grid(row=2, column=0, columnspan=2, pady=10)
+        self.backup_listbox = tk.Listbox(list_frame, width=80, height=10, selectmode=tk.EXTENDED)
+        self.backup_listbox.pack(side="left", fill="both", expand=True)
+        self.list_scrollbar = tk.Scrollbar(list_frame, orient="vertical", command=self.backup_listbox.yview)
+        self.list_scrollbar.pack(side="right", fill="y")
+        self.backup_listbox.config(yscrollcommand=self.on_list_scroll)
+        self.next_cursor = None  # Курсор следующей страницы списка; None - страниц больше нет
+        self.page_loading = False
+        self.list_generation = 0  # Номер обновления списка: ответы для старого списка отбрасываются
+
+        # Кнопки для работы с резервными копиями
+        tk.Button(main_frame, text="Скачать выбранные резервные копии", command=self.download_backup, width=30).grid(
+            row=3, column=0, pady=5, padx=10)
+        tk.Button(main_frame, text="Удалить выбранную резервную копию", command=self.delete_backup, width=30).grid(
+            row=3, column=1, pady=5, padx=10)
+
+        # Состояние передач
+        self.status_label = tk.Label(main_frame, text="", font=("Arial", 10), justify="left")
+        self.status_label.grid(row=4, column=0, columnspan=2)
+
+        # Резервное копирование папки
+        tk.Button(main_frame, text="Резервное копирование папки", command=self.backup_folder, width=30).grid(
+            row=5, column=0, columnspan=2, pady=5)
+
+        # Кнопка активации лицензии
+        tk.Button(main_frame, text="Активировать лицензию", command=lambda: controller.show_frame("LicensePage"),
+                  width=30).grid(row=6, column=0, columnspan=2, pady=20)
+
+    def set_progress(self, name, done, total):
+        """Обновить прогресс передачи (вызывается из фонового потока)."""
+        percent = int(done * 100 / total) if total else 100
+        self.controller.call_in_ui(self.show_progress, name, f"{name}: {percent}%")
+
+    def show_progress(self, name, text=None):
+        if text is None:
+            self.progress.pop(name, None)
+        else:
+            self.progress[name] = text
+        self.status_label.config(text="\n".join(self.progress.values()))
+
+    def upload_file(self):
+        """Загрузка файлов на сервер (несколько файлов передаются параллельно)."""
+        file_paths = filedialog.askopenfilenames()
+        if not file_paths:
+            logger.warning("Попытка загрузки файла без выбора файла")
+            return
+
+        if not self.transfer.encryption_key:
+            logger.error("Отсутствует ключ шифрования")
+            messagebox.showerror("Ошибка", "Не удалось загрузить файл: отсутствует ключ шифрования")
+            return
+
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+
+            def uploaded(result, name=name):
+                self.show_progress(name)
+                messagebox.showinfo("Успех", f"Файл {name} успешно загружен!")
+                logger.info(f"Файл {name} успешно загружен", extra=SAMPLED)
+
+            self.show_progress(name, f"{name}: 0%")
+            self.controller.run_in_background(self.transfer.delta_upload, uploaded, f"Ошибка загрузки файла {name}",
+                                   file_path, lambda done, total, name=name: self.set_progress(name, done, total))
+
+    def backup_folder(self):
+        """Инкрементальное резервное копирование выбранной папки."""
+        folder = filedialog.askdirectory(title="Папка для резервного копирования")
+        if not folder:
+            return
+
+        if not self.transfer.encryption_key:
+            logger.error("Отсутствует ключ шифрования")
+            messagebox.showerror("Ошибка", "Не удалось загрузить файлы: отсутствует ключ шифрования")
+            return
+
+        name = os.path.basename(folder)
+
+        def finished(summary):
+            self.show_progress(name)
+            text = f"Загружено: {summary['uploaded']}, без изменений: {summary['skipped']}"
+            if summary["failed"]:
+                text += f", ошибок: {len(summary['failed'])}"
+                messagebox.showwarning("Резервное копирование папки", text)
+            else:
+                messagebox.showinfo("Резервное копирование папки", text)
+            logger.info(f"Резервное копирование папки {folder}: {text}")
+
+        self.show_progress(name, f"{name}: сканирование...")
+        self.controller.run_in_background(self.transfer.backup_folder, finished, f"Ошибка резервного копирования папки {name}",
+                               folder, lambda done, total: self.set_progress(name, done, total))
+
+    def list_backups(self):
+        """Загрузить список резервных копий заново, начиная с первой страницы."""
+        self.list_generation += 1
+        self.backup_listbox.delete(0, tk.END)
+        self.next_cursor = None
+        self.page_loading = False
+        self.load_next_page(first=True)
+
+    def load_next_page(self, first=False):
+        """Запросить следующую страницу списка, если она есть и ещё не запрошена."""
+        if self.page_loading or (not first and not self.next_cursor):
+            return
+        self.page_loading = True
+        generation = self.list_generation
+
+        def show(page):
+            if generation != self.list_generation:
+                return  # Список успели обновить, страница устарела
+            self.page_loading = False
+            self.next_cursor = page["next_cursor"]
+            logger.info(f"Получена страница списка резервных копий: {len(page['items'])} записей")
+            for backup in page["items"]:
+                display_text = f"{backup['filename']} | {backup['size']} байт | {backup['upload_date']}"
+                self.backup_listbox.insert(tk.END, display_text)
+
+        def failed():
+            if generation == self.list_generation:
+                self.page_loading = False
+
+        self.controller.run_in_background(self.transfer.list_backups, show, "Ошибка получения списка",
+                               None if first else self.next_cursor, on_error=failed)
+
+    def on_list_scroll(self, first, last):
+        """Прокрутка списка: обновить полосу прокрутки и при приближении к концу догрузить страницу."""
+        self.list_scrollbar.set(first, last)
+        if float(last) >= LIST_PRELOAD_THRESHOLD:
+            self.load_next_page()
+
+    def delete_backup(self):
+        """Удаление выбранной резервной копии."""
+        selection = self.backup_listbox.curselection()
+        if not selection:
+            messagebox.showerror("Ошибка", "Выберите резервную копию для удаления!")
+            return
+
+        selected_item = self.backup_listbox.get(selection[0])
+        filename = selected_item.split(" | ")[0]  # Извлекаем имя файла из строки
+
+        def deleted(result):
+            messagebox.showinfo("Успех", f"Резервная копия {filename} успешно удалена!")
+            logger.info(f"Резервная копия {filename} успешно удалена")
+
+            # Обновляем список резервных копий
+            self.list_backups()
+
+        self.controller.run_in_background(self.transfer.delete_backup, deleted, "Ошибка удаления резервной копии", filename)
+
+    def download_backup(self):
+        """Скачивание выбранных резервных копий (несколько файлов скачиваются параллельно)."""
+        selection = self.backup_listbox.curselection()
+        if not selection:
+            messagebox.showerror("Ошибка", "Выберите резервную копию для скачивания!")
+            return
+
+        filenames = [self.backup_listbox.get(index).split(" | ")[0] for index in selection]
+        plain_names = {filename: filename[:-4] if filename.endswith(".enc") else filename for filename in filenames}
+        if len(filenames) == 1:
+            save_path = filedialog.asksaveasfilename(initialfile=plain_names[filenames[0]])
+            if not save_path:
+                return
+            targets = [(filenames[0], save_path)]
+        else:
+            save_dir = filedialog.askdirectory(title="Папка для сохранения резервных копий")
+            if not save_dir:
+                return
+            targets = [(filename, os.path.join(save_dir, plain_names[filename])) for filename in filenames]
+
+        for filename, save_path in targets:
+            def downloaded(result, filename=filename, save_path=save_path):
+                self.show_progress(filename)
+                messagebox.showinfo("Успех", f"Резервная копия {filename} успешно загружена!")
+                logger.info(f"Резервная копия {filename} успешно загружена и сохранена в {save_path}")
+
+            self.show_progress(filename, f"{filename}: 0%")
+            self.controller.run_in_background(self.transfer.stream_download, downloaded,
+                                   f"Ошибка скачивания резервной копии {filename}", filename, save_path,
+                                   lambda done, total, filename=filename: self.set_progress(filename, done, total))
+
+
+class LicensePage(tk.Frame):
+    """Страница активации лицензии."""
+
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+
+        tk.Label(self, text="Активация лицензии", font=("Arial", 16)).pack(pady=10)
+
+        tk.Label(self, text="Ключ лицензии").pack(pady=5)
+        self.license_entry = tk.Entry(self, width=30)
+        self.license_entry.pack()
+
+        tk.Button(self, text="Активировать ключ", command=self.activate_license).pack(pady=10)
+        tk.Label(self, text="Или загрузите файл лицензии:").pack(pady=10)
+
+        tk.Button(self, text="Выбрать файл лицензии", command=self.select_license_file).pack(pady=5)
+        self.file_label = tk.Label(self, text="Файл не выбран", font=("Arial", 10))
+        self.file_label.pack()
+
+        tk.Button(self, text="Активировать через файл", command=self.activate_license_from_file).pack(pady=10)
+        tk.Button(self, text="Перейти к главной", command=lambda: controller.show_frame("MainPage")).pack()
+
+        self.selected_file = None  # Выбранный файл лицензии
+
+    def activate_license(self):
+        """Активация лицензии по ключу."""
+        license_key = self.license_entry.get()
+        if not license_key:
+            messagebox.showerror("Ошибка", "Введите ключ лицензии!")
+            logger.warning("Попытка активации без ввода ключа лицензии")
+            return
+
+        def activated(_):
+            self.controller.license_key = license_key
+            messagebox.showinfo("Успех", "Лицензия активирована!")
+            logger.info("Лицензия активирована по ключу")
+
+        self.controller.run_in_background(self.controller.transfer.activate_license, activated,
+                                          "Ошибка активации лицензии", license_key)
+
+    def select_license_file(self):
+        """Выбор файла лицензии."""
+        self.selected_file = filedialog.askopenfilename(
+            title="Выберите файл лицензии",
+            filetypes=[("License Files", "*.lic")]
+        )
+        if self.selected_file:
+            self.file_label.config(text=f"Выбран файл: {os.path.basename(self.selected_file)}")
+            logger.info(f"Выбран файл лицензии: {self.selected_file}")
+
+    def activate_license_from_file(self):
+        """Активация лицензии через файл."""
+        if not self.selected_file:
+            messagebox.showerror("Ошибка", "Файл лицензии не выбран!")
+            logger.warning("Попытка активации без выбора файла лицензии")
+            return
+
+        license_path = self.selected_file
+        try:
+            # Читаем файл лицензии
+            with open(license_path, "r") as f:
+                license_data = f.read()
+
+            # Разделяем данные и подпись
+            try:
+                data, signature = license_data.rsplit("\n", 1)
+            except ValueError:
+                raise ValueError("Формат файла лицензии неверный!")
+        except FileNotFoundError:
+            logger.error("Файл лицензии не найден")
+            messagebox.showerror("Ошибка", "Файл лицензии не найден!")
+            return
+        except ValueError as e:
+            logger.error(f"Ошибка формата файла лицензии: {e}")
+            messagebox.showerror("Ошибка", "Формат файла лицензии неверный!")
+            return
+
+        def verified(valid):
+            if valid:
+                messagebox.showinfo("Успех", "Лицензия успешно активирована!")
+                logger.info(f"Лицензия из файла {license_path} успешно активирована")
+            else:
+                messagebox.showerror("Ошибка", "Лицензия недействительна!")
+                logger.error(f"Лицензия из файла {license_path} недействительна")
+
+        # Проверка подписи на сервере - в фоновом потоке
+        self.controller.run_in_background(self.controller.transfer.verify_license, verified,
+                                          "Ошибка активации лицензии", data, signature)
+
+
+def main():
+    app = Application()
+    app.mainloop()
+
+
+if __name__ == "__main__":
+    main()
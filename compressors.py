@@ -0,0 +1,106 @@
+"""
+Сжатие блоков перед шифрованием.
+
+Зашифрованные данные не сжимаются, поэтому сжатие выполняется на клиенте до шифрования,
+отдельно для каждого блока (chunking.py). Первый байт сжатого блока - идентификатор
+кодека, поэтому при расшифровке кодек определяется по самим данным. Если сжатие не
+уменьшило блок, он сохраняется без сжатия (кодек "none"). Результат детерминирован
+для одного кодека и уровня, поэтому одинаковые блоки по-прежнему дедуплицируются.
+
+zlib и lzma входят в стандартную библиотеку; zstd и lz4 доступны, если установлены
+пакеты zstandard и lz4.
+"""
+import lzma
+import zlib
+
+CODEC_HEADER_SIZE = 1  # Байт идентификатора кодека перед сжатыми данными
+DEFAULT_CODEC = "none"
+# Все известные кодеки (сервер принимает их имена, не имея самих библиотек)
+KNOWN_CODECS = ("none", "zlib", "lzma", "zstd", "lz4")
+
+
+class CompressionError(ValueError):
+    """Неизвестный, недоступный или повреждённый кодек."""
+
+
+# Имя -> (compress(data, level), decompress(data), уровень по умолчанию).
+# Идентификатор кодека в данных - его номер в KNOWN_CODECS.
+_CODECS = {
+    "none": (lambda data, level: data, lambda data: data, None),
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress, 6),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 1),
+}
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+else:
+    _CODECS["zstd"] = (
+        lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+        3,
+    )
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+else:
+    _CODECS["lz4"] = (
+        lambda data, level: lz4.frame.compress(data, compression_level=level),
+        lz4.frame.decompress,
+        0,
+    )
+
+AVAILABLE_CODECS = tuple(_CODECS)  # Кодеки, доступные в этой установке
+_BY_ID = {KNOWN_CODECS.index(name): (name, decompress) for name, (_, decompress, _) in _CODECS.items()}
+
+
+def parse_codec(spec: str):
+    """Разобрать строку вида "zstd" или "zstd:9". Возвращает (имя, уровень)."""
+    name, _, level = (spec or DEFAULT_CODEC).partition(":")
+    name = name.strip().lower()
+    if name not in KNOWN_CODECS:
+        raise CompressionError(f"Неизвестный кодек {name}, доступны: {', '.join(AVAILABLE_CODECS)}")
+    if name not in _CODECS:
+        raise CompressionError(f"Кодек {name} недоступен: не установлен пакет {'zstandard' if name == 'zstd' else name}")
+    if not level:
+        return name, _CODECS[name][2]
+    try:
+        return name, int(level)
+    except ValueError:
+        raise CompressionError(f"Неверный уровень сжатия: {level}")
+
+
+class Compressor:
+    """Сжатие блоков выбранным кодеком; безопасно для использования из нескольких потоков."""
+
+    def __init__(self, spec: str = DEFAULT_CODEC):
+        self.name, self.level = parse_codec(spec)
+        self._header = bytes([KNOWN_CODECS.index(self.name)])
+        self._compress = _CODECS[self.name][0]
+
+    def encode(self, data: bytes) -> bytes:
+        """Сжать блок и добавить байт кодека."""
+        if self.name != "none":
+            compressed = self._compress(data, self.level)
+            if len(compressed) < len(data):
+                return self._header + compressed
+        return b"\x00" + data
+
+
+def decode(payload: bytes) -> bytes:
+    """Распаковать блок, сжатый Compressor.encode."""
+    if not payload:
+        raise CompressionError("Пустой блок")
+    codec_id = payload[0]
+    if codec_id not in _BY_ID:
+        if codec_id < len(KNOWN_CODECS):
+            raise CompressionError(f"Для распаковки нужен кодек {KNOWN_CODECS[codec_id]}, он не установлен")
+        raise CompressionError(f"Неизвестный кодек блока: {codec_id}")
+    name, decompress = _BY_ID[codec_id]
+    try:
+        return decompress(payload[CODEC_HEADER_SIZE:])
+    except Exception as e:
+        raise CompressionError(f"Не удалось распаковать блок ({name}): {e}")
@@ -0,0 +1,365 @@
+"""
+Формат зашифрованного контейнера резервной копии.
+
+Контейнер - это заголовок CONTAINER_MAGIC и последовательность кадров:
+
+    длина шифртекста (4 байта, big-endian) | nonce (12 байт) | шифртекст AES-GCM с тегом
+
+Каждый кадр - отдельный блок исходного файла, разбитого по содержимому (chunking.py).
+Начиная с версии 2 блок перед шифрованием сжимается (compressors.py), и первый байт
+открытого текста кадра - идентификатор кодека; в версии 1 (CONTAINER_MAGIC_V1) сжатия нет.
+Nonce вычисляется как HMAC от открытого текста кадра, поэтому одинаковые блоки дают
+одинаковые кадры: сервер может дедуплицировать их, не видя содержимого. Шифрование и
+расшифровка выполняются потоково, память ограничена размером одного кадра.
+
+В версии 3 заголовок контейнера передаётся в AAD каждого кадра, а последний кадр -
+завершающий: его открытый текст - TRAILER_MARKER, число кадров с данными и цепочка
+хешей всех предыдущих кадров (h0 = SHA-256(заголовок), hi = SHA-256(hi-1 | кадр i)).
+Номер кадра в сам кадр не входит, иначе одинаковые блоки на разных местах давали бы
+разные кадры и дедупликация перестала бы работать; порядок, повторы и обрезка
+обнаруживаются по завершающему кадру. Поток без него считается обрезанным.
+"""
+import hmac
+import struct
+import base64
+from hashlib import sha256
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+import compressors
+from chunking import Chunker, CHUNK_MAX_SIZE
+
+CONTAINER_MAGIC = b"BKPCHNK3"  # Заголовок контейнера (формат версии 3, с завершающим кадром)
+CONTAINER_MAGIC_V2 = b"BKPCHNK2"  # Формат версии 2, блоки со сжатием, без завершающего кадра
+CONTAINER_MAGIC_V1 = b"BKPCHNK1"  # Формат версии 1, блоки без сжатия
+CONTAINER_MAGICS = (CONTAINER_MAGIC_V1, CONTAINER_MAGIC_V2, CONTAINER_MAGIC)
+NONCE_SIZE = 12
+TAG_SIZE = 16
+FRAME_HEADER = struct.Struct(">I")
+FRAME_OVERHEAD = FRAME_HEADER.size + NONCE_SIZE + TAG_SIZE
+TRAILER_MARKER = b"\xff"  # Первый байт открытого текста завершающего кадра (не идентификатор кодека)
+TRAILER = struct.Struct(">Q32s")  # Число кадров с данными, цепочка хешей
+# Максимальный размер кадра: несжимаемый блок хранится как есть, плюс байт кодека
+MAX_FRAME_SIZE = CHUNK_MAX_SIZE + compressors.CODEC_HEADER_SIZE + FRAME_OVERHEAD
+
+
+class ContainerError(ValueError):
+    """Повреждённый или чужой контейнер."""
+
+
+class ContainerKeys:
+    """Ключи контейнера, выведенные из ключа шифрования пользователя."""
+
+    def __init__(self, encryption_key):
+        if isinstance(encryption_key, str):
+            encryption_key = encryption_key.encode()
+        master = base64.urlsafe_b64decode(encryption_key)
+        self.aead = AESGCM(self._derive(master, b"backup-container-aead"))
+        self.nonce_key = self._derive(master, b"backup-container-nonce")
+
+    @staticmethod
+    def _derive(master: bytes, info: bytes) -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(master)
+
+    def nonce(self, plaintext: bytes) -> bytes:
+        """Детерминированный nonce: одинаковый открытый текст - одинаковый кадр."""
+        return hmac.new(self.nonce_key, plaintext, sha256).digest()[:NONCE_SIZE]
+
+
+def _encrypt_frame(keys: ContainerKeys, plaintext: bytes) -> bytes:
+    nonce = keys.nonce(plaintext)
+    ciphertext = keys.aead.encrypt(nonce, plaintext, CONTAINER_MAGIC)
+    return FRAME_HEADER.pack(len(ciphertext)) + nonce + ciphertext
+
+
+def encrypt_chunk(keys: ContainerKeys, chunk: bytes, compressor: compressors.Compressor) -> bytes:
+    """Сжать и зашифровать блок в кадр контейнера."""
+    return _encrypt_frame(keys, compressor.encode(chunk))
+
+
+def encrypt_trailer(keys: ContainerKeys, frames: int, chain: bytes) -> bytes:
+    """Завершающий кадр: число кадров с данными и цепочка их хешей."""
+    return _encrypt_frame(keys, TRAILER_MARKER + TRAILER.pack(frames, chain))
+
+
+def chain_start(magic: bytes = CONTAINER_MAGIC) -> bytes:
+    return sha256(magic).digest()
+
+
+def chain_frame(chain: bytes, frame: bytes) -> bytes:
+    """Следующее звено цепочки хешей кадров."""
+    return sha256(chain + frame).digest()
+
+
+def _decrypt_plaintext(keys: ContainerKeys, frame: bytes, magic: bytes) -> bytes:
+    nonce = frame[FRAME_HEADER.size:FRAME_HEADER.size + NONCE_SIZE]
+    try:
+        return keys.aead.decrypt(nonce, frame[FRAME_HEADER.size + NONCE_SIZE:],
+                                 CONTAINER_MAGIC if magic == CONTAINER_MAGIC else None)
+    except Exception:
+        raise ContainerError("Кадр контейнера повреждён или зашифрован другим ключом")
+
+
+def _decode_plaintext(plaintext: bytes, magic: bytes) -> bytes:
+    if magic == CONTAINER_MAGIC_V1:
+        return plaintext
+    try:
+        return compressors.decode(plaintext)
+    except compressors.CompressionError as e:
+        raise ContainerError(str(e))
+
+
+def decrypt_frame(keys: ContainerKeys, frame: bytes, magic: bytes = CONTAINER_MAGIC) -> bytes:
+    """Расшифровать (и распаковать) один кадр с данными вместе с заголовком длины."""
+    return _decode_plaintext(_decrypt_plaintext(keys, frame, magic), magic)
+
+
+def _iter_plain_chunks(file_obj, read_size: int):
+    """Разбить файл на блоки по содержимому, начиная с текущей позиции."""
+    chunker = Chunker()
+    for data in iter(lambda: file_obj.read(read_size), b""):
+        yield from chunker.update(data)
+    yield from chunker.finish()
+
+
+def iter_encrypted_frames(keys: ContainerKeys, file_obj, read_size: int = CHUNK_MAX_SIZE,
+                          codec: str = compressors.DEFAULT_CODEC):
+    """Разбить открытый файл на блоки и отдать заголовок, зашифрованные кадры и завершающий кадр."""
+    compressor = compressors.Compressor(codec)
+    yield CONTAINER_MAGIC
+    chain = chain_start()
+    frames = 0
+    for chunk in _iter_plain_chunks(file_obj, read_size):
+        frame = encrypt_chunk(keys, chunk, compressor)
+        chain = chain_frame(chain, frame)
+        frames += 1
+        yield frame
+    yield encrypt_trailer(keys, frames, chain)
+
+
+class EncryptingReader:
+    """
+    Файлоподобный объект: контейнер, который шифруется на лету при чтении из исходного файла.
+
+    Временная зашифрованная копия не создаётся. Позиции начала кадров запоминаются, поэтому
+    можно вернуться назад (seek) - например, чтобы продолжить прерванную загрузку с
+    подтверждённого сервером смещения. Кадры детерминированы, поэтому повторно
+    сгенерированные байты совпадают с отправленными ранее. В checksum накапливается
+    SHA-256 всего контейнера.
+    """
+
+    def __init__(self, keys: ContainerKeys, file_obj, read_size: int = CHUNK_MAX_SIZE,
+                 codec: str = compressors.DEFAULT_CODEC):
+        self.keys = keys
+        self.file_obj = file_obj
+        self.read_size = read_size
+        self.compressor = compressors.Compressor(codec)
+        self.checksum = sha256(CONTAINER_MAGIC)
+        self._chain = chain_start()  # Цепочка хешей уже учтённых кадров
+        self._trailer = None  # Завершающий кадр; вычисляется один раз, когда учтены все кадры
+        # Начала кадров: (смещение в контейнере, смещение в исходном файле)
+        self._frame_starts = [(len(CONTAINER_MAGIC), 0)]
+        self._hashed = len(CONTAINER_MAGIC)  # До какого смещения контейнер учтён в checksum
+        self._pos = 0
+        self._buffer = CONTAINER_MAGIC
+        self._frames = None
+        self._frames_pos = len(CONTAINER_MAGIC)  # Смещение, с которого начнётся следующий кадр
+        self._plain_pos = 0  # Смещение в исходном файле, соответствующее _frames_pos
+
+    def _restart(self, cipher_pos: int, plain_pos: int):
+        self.file_obj.seek(plain_pos)
+        self._frames = self._iter_frames()
+        self._frames_pos = cipher_pos
+        self._plain_pos = plain_pos
+
+    def _iter_frames(self):
+        # Пары (кадр, размер исходного блока): со сжатием размер блока по кадру не восстановить
+        for chunk in _iter_plain_chunks(self.file_obj, self.read_size):
+            yield encrypt_chunk(self.keys, chunk, self.compressor), len(chunk)
+        if self._trailer is None:
+            # Кадры генерируются по порядку, поэтому к концу файла все они уже учтены в цепочке
+            self._trailer = encrypt_trailer(self.keys, len(self._frame_starts) - 1, self._chain)
+        yield self._trailer, 0
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int):
+        """Перейти к смещению, не превышающему уже сгенерированную часть контейнера."""
+        if offset == self._pos:
+            return
+        if offset > self._hashed:
+            raise ValueError("Нельзя перейти дальше уже сгенерированной части контейнера")
+        if offset < len(CONTAINER_MAGIC):
+            self._restart(*self._frame_starts[0])
+            self._pos, self._buffer = offset, CONTAINER_MAGIC[offset:]
+            return
+        # Последний известный кадр, начинающийся не позже offset
+        cipher_pos, plain_pos = max(start for start in self._frame_starts if start[0] <= offset)
+        self._restart(cipher_pos, plain_pos)
+        self._pos, self._buffer = cipher_pos, b""
+        self.read(offset - cipher_pos)
+
+    def _next_frame(self) -> bytes:
+        if self._frames is None:
+            self._restart(*self._frame_starts[0])
+        frame_start = self._frames_pos
+        frame, chunk_size = next(self._frames, (b"", 0))
+        if not frame:
+            return b""
+        self._frames_pos += len(frame)
+        self._plain_pos += chunk_size
+        if frame_start == self._hashed:
+            if frame is not self._trailer:
+                self._chain = chain_frame(self._chain, frame)
+            self.checksum.update(frame)
+            self._hashed += len(frame)
+            self._frame_starts.append((self._frames_pos, self._plain_pos))
+        return frame
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if not self._buffer:
+                self._buffer = self._next_frame()
+                if not self._buffer:
+                    break
+            part = self._buffer if size < 0 else self._buffer[:size]
+            self._buffer = self._buffer[len(part):]
+            self._pos += len(part)
+            if size > 0:
+                size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+
+class FrameSplitter:
+    """
+    Потоковый разбор контейнера на кадры без расшифровки.
+
+    Используется сервером: кадры контейнера сохраняются как отдельные блоки хранилища.
+    Заголовок контейнера отдаётся первым «кадром», версия формата - в magic. Разбор можно
+    начать с границы кадра offset (например, при докачке), тогда заголовок не ожидается.
+    """
+
+    def __init__(self, offset: int = 0):
+        self._buffer = bytearray()
+        self._header_done = offset > 0
+        self.magic = None  # Заголовок контейнера, если он был в потоке
+        self.consumed = offset  # Сколько байт потока разобрано в полные кадры
+
+    def update(self, data: bytes) -> list:
+        """Добавить данные и вернуть полностью принятые кадры."""
+        self._buffer += data
+        frames = []
+        if not self._header_done:
+            if len(self._buffer) < len(CONTAINER_MAGIC):
+                return frames
+            self.magic = bytes(self._buffer[:len(CONTAINER_MAGIC)])
+            if self.magic not in CONTAINER_MAGICS:
+                raise ContainerError("Неизвестный формат контейнера")
+            frames.append(self.magic)
+            del self._buffer[:len(CONTAINER_MAGIC)]
+            self._header_done = True
+            self.consumed += len(CONTAINER_MAGIC)
+        while len(self._buffer) >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(self._buffer)
+            if length > MAX_FRAME_SIZE or length < TAG_SIZE:
+                raise ContainerError("Неверная длина кадра контейнера")
+            frame_size = FRAME_HEADER.size + NONCE_SIZE + length
+            if len(self._buffer) < frame_size:
+                break
+            frames.append(bytes(self._buffer[:frame_size]))
+            del self._buffer[:frame_size]
+            self.consumed += frame_size
+        return frames
+
+    def finish(self) -> list:
+        """Проверить, что поток закончился на границе кадра."""
+        if self._buffer or not self._header_done:
+            raise ContainerError("Контейнер обрезан")
+        return []
+
+
+class ContainerDecoder:
+    """
+    Потоковая расшифровка контейнера: данные подаются порциями, например при скачивании.
+
+    offset - граница кадра, с которой начинаются данные (для продолжения прерванной загрузки);
+    в этом случае заголовка в данных нет и версию формата нужно передать в magic, а для
+    версии 3 - ещё и resume_state, сохранённый на той же границе.
+    """
+
+    def __init__(self, keys: ContainerKeys, offset: int = 0, magic: bytes = CONTAINER_MAGIC,
+                 resume_state: dict = None):
+        self.keys = keys
+        self.splitter = FrameSplitter(offset)
+        self.magic = magic
+        self.frames = 0  # Кадров с данными от начала контейнера
+        self.chain = chain_start(magic)
+        self.trailer_seen = False
+        if offset:
+            if resume_state is None:
+                if magic == CONTAINER_MAGIC:
+                    raise ValueError("Для продолжения контейнера версии 3 нужен resume_state")
+            else:
+                self.frames = resume_state["frames"]
+                self.chain = bytes.fromhex(resume_state["chain"])
+
+    @property
+    def consumed(self) -> int:
+        """Сколько байт контейнера полностью расшифровано (граница последнего кадра)."""
+        return self.splitter.consumed
+
+    @property
+    def resume_state(self) -> dict:
+        """Состояние проверки на границе consumed - для продолжения с этого смещения."""
+        return {"frames": self.frames, "chain": self.chain.hex()}
+
+    def update(self, data: bytes) -> list:
+        """Добавить данные и вернуть расшифрованные блоки."""
+        frames = self.splitter.update(data)
+        if frames and frames[0] is self.splitter.magic:
+            self.magic = frames.pop(0)
+            self.chain = chain_start(self.magic)
+        chunks = []
+        for frame in frames:
+            if self.trailer_seen:
+                raise ContainerError("Данные после завершающего кадра контейнера")
+            plaintext = _decrypt_plaintext(self.keys, frame, self.magic)
+            if self.magic == CONTAINER_MAGIC and plaintext[:1] == TRAILER_MARKER:
+                self._check_trailer(plaintext[1:])
+                continue
+            chunks.append(_decode_plaintext(plaintext, self.magic))
+            self.chain = chain_frame(self.chain, frame)
+            self.frames += 1
+        return chunks
+
+    def _check_trailer(self, payload: bytes):
+        if len(payload) != TRAILER.size:
+            raise ContainerError("Повреждён завершающий кадр контейнера")
+        frames, chain = TRAILER.unpack(payload)
+        if frames != self.frames or not hmac.compare_digest(chain, self.chain):
+            raise ContainerError("Кадры контейнера пропущены, повторены или переставлены")
+        self.trailer_seen = True
+
+    def finish(self):
+        """Проверить, что поток закончился на границе кадра (и, в версии 3, завершающим кадром)."""
+        self.splitter.finish()
+        if self.magic == CONTAINER_MAGIC and not self.trailer_seen:
+            raise ContainerError("Контейнер обрезан: нет завершающего кадра")
+
+
+def iter_decrypted_frames(keys: ContainerKeys, file_obj, read_size: int = CHUNK_MAX_SIZE):
+    """Прочитать контейнер из открытого файла и отдать расшифрованные блоки."""
+    decoder = ContainerDecoder(keys)
+    for data in iter(lambda: file_obj.read(read_size), b""):
+        yield from decoder.update(data)
+    decoder.finish()
+
+
+def is_container(file_path: str) -> bool:
+    """Проверить, что файл начинается с заголовка контейнера."""
+    with open(file_path, "rb") as f:
+        return f.read(len(CONTAINER_MAGIC)) in CONTAINER_MAGICS
@@ -0,0 +1,176 @@
+"""
+Периодические фоновые задачи сервера: политики хранения и сборка мусора.
+
+Задачи (apply_retention и collect_garbage в app.py) работают небольшими порциями,
+каждая в своей короткой транзакции и с паузой между порциями, поэтому не держат
+блокировку базы и не отнимают процессор у обработки запросов.
+
+Планировщик запускается в процессе сервера (BACKGROUND_JOBS=1, по умолчанию) или
+отдельно. Задачи по расписанию выполняет только процесс, захвативший файл блокировки
+(JOBS_LOCK_FILE): при нескольких рабочих процессах на одной машине остальные ждут и
+подхватывают расписание, если этот процесс завершится. Если серверы работают на
+нескольких машинах с общей базой, задачи в них нужно выключить и запускать один
+экземпляр планировщика:
+
+    BACKGROUND_JOBS=0 uvicorn app:app --workers 4
+    python jobs.py                 # по расписанию, пока не остановят
+    python jobs.py --once gc       # один проход сборки мусора и выход (без блокировки)
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SingleRunnerLock:
+    """
+    Блокировка flock на файле: в каждый момент её держит не больше одного процесса.
+
+    Блокировка снимается системой при завершении процесса, поэтому после падения
+    держателя её захватывает следующий процесс.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.held = False
+        self._file = None
+
+    def try_acquire(self) -> bool:
+        """Захватить блокировку без ожидания; True, если она у этого процесса."""
+        if self.held:
+            return True
+        if fcntl is None:
+            logger.warning("Блокировка фоновых задач недоступна на этой платформе, задачи выполняются без неё")
+            self.held = True
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        self.held = True
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # Закрытие файла снимает flock
+            self._file = None
+        self.held = False
+
+
+class JobScheduler:
+    """
+    Выполнение задач с заданными интервалами в одном фоновом потоке.
+
+    Если задан lock_path, задачи по расписанию выполняются, только пока процесс держит
+    блокировку (SingleRunnerLock); run() вызывается напрямую и блокировку не проверяет.
+    """
+
+    def __init__(self, lock_path: str = None):
+        self._jobs = []  # [имя, интервал в секундах, функция, время следующего запуска]
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = SingleRunnerLock(lock_path) if lock_path else None
+
+    def add(self, name: str, interval: float, func):
+        """Добавить задачу; первый запуск - через interval после старта."""
+        self._jobs.append([name, interval, func, time.monotonic() + interval])
+
+    def run(self, name: str):
+        """Выполнить задачу сразу; ошибки записываются в журнал и не останавливают планировщик."""
+        for job in self._jobs:
+            if job[0] == name:
+                start = time.perf_counter()
+                try:
+                    result = job[2]()
+                    logger.info(f"Задача {name} выполнена за {time.perf_counter() - start:.1f} с: {result}")
+                except Exception:
+                    logger.exception(f"Ошибка фоновой задачи {name}")
+                job[3] = time.monotonic() + job[1]
+                return
+        raise KeyError(name)
+
+    def run_pending(self):
+        for job in self._jobs:
+            if self._stop.is_set():
+                return
+            if job[3] <= time.monotonic():
+                self.run(job[0])
+
+    @property
+    def names(self) -> list:
+        return [job[0] for job in self._jobs]
+
+    def keep_only(self, names):
+        """Оставить в расписании только перечисленные задачи."""
+        self._jobs = [job for job in self._jobs if job[0] in names]
+
+    def _is_runner(self) -> bool:
+        """Держит ли процесс блокировку планировщика (без lock_path - всегда)."""
+        if self._lock is None or self._lock.held:
+            return True
+        if not self._lock.try_acquire():
+            return False
+        logger.info(f"Фоновые задачи выполняются в процессе {os.getpid()}")
+        # Отсчёт интервалов - с момента захвата, а не со старта процесса
+        for job in self._jobs:
+            job[3] = time.monotonic() + job[1]
+        return True
+
+    def loop(self):
+        while not self._stop.wait(1):
+            if self._is_runner():
+                self.run_pending()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.loop, name="jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """Остановить планировщик; выполняющаяся порция задачи дорабатывает до конца."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._lock is not None:
+            self._lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Выполнить задачи один раз и выйти")
+    parser.add_argument("jobs", nargs="*", help="Какие задачи выполнить (по умолчанию все)")
+    args = parser.parse_args()
+
+    import app as server
+
+    scheduler = server.create_scheduler()
+    names = args.jobs or scheduler.names
+    unknown = set(names) - set(scheduler.names)
+    if unknown:
+        parser.error(f"Неизвестные задачи: {', '.join(sorted(unknown))}; есть: {', '.join(scheduler.names)}")
+    if args.once:
+        for name in names:
+            scheduler.run(name)
+        return
+    scheduler.keep_only(names)
+    try:
+        scheduler.loop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
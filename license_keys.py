@@ -0,0 +1,163 @@
+"""
+Реестр ключей RSA для подписи и проверки лицензий.
+
+Ключи читаются с диска один раз при создании реестра, поэтому подпись и проверка
+лицензии - только вычисления, без чтения файлов и разбора PEM на каждый запрос.
+
+Раскладка каталога ключей:
+
+    private_key.pem     - текущий ключ подписи
+    public_key.pem      - его открытый ключ (раздаётся клиентам)
+    retired/<kid>.pem   - открытые ключи, которыми подписывали раньше
+
+Каждый ключ имеет идентификатор kid (начало SHA-256 от открытого ключа в DER). Он
+записывается в данные лицензии, поэтому после смены ключа (rotate) старые лицензии
+проверяются прежним открытым ключом, а новые подписываются новым.
+
+Пакетная проверка подписей выполняется в пуле процессов (RSA - работа для процессора):
+каждый процесс пула создаёт свой реестр в init_verify_worker и проверяет порции
+пар (данные, подпись) функцией verify_licenses.
+
+Смена ключа из командной строки (сервер подхватит новый ключ после перезапуска):
+
+    python license_keys.py rotate [каталог ключей]
+"""
+import base64
+import os
+import sys
+from hashlib import sha256
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+PRIVATE_KEY_FILE = "private_key.pem"
+PUBLIC_KEY_FILE = "public_key.pem"
+RETIRED_DIR = "retired"
+KEY_SIZE = 2048
+
+
+def key_id(public_key) -> str:
+    """Идентификатор открытого ключа."""
+    der = public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return sha256(der).hexdigest()[:16]
+
+
+def license_key_id(license_data: str):
+    """Идентификатор ключа из данных лицензии ("...;KID:<kid>") или None для старых лицензий."""
+    for field in license_data.split(";"):
+        name, _, value = field.partition(":")
+        if name == "KID":
+            return value
+    return None
+
+
+def _write_private_key(path: str, private_key):
+    fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=serialization.NoEncryption(),
+        ))
+    os.replace(path + ".tmp", path)
+
+
+def _write_public_key(path: str, public_key):
+    with open(path + ".tmp", "wb") as f:
+        f.write(public_key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    os.replace(path + ".tmp", path)
+
+
+class KeyRegistry:
+    """Текущий ключ подписи и все открытые ключи (текущий и выведенные из использования)."""
+
+    def __init__(self, keys_dir: str):
+        self.keys_dir = keys_dir
+        self.reload()
+
+    def reload(self):
+        """Перечитать ключи с диска (например, после rotate)."""
+        private_path = os.path.join(self.keys_dir, PRIVATE_KEY_FILE)
+        if not os.path.exists(private_path):
+            raise FileNotFoundError(f"Ключ подписи лицензий не найден: {os.path.abspath(private_path)}")
+        with open(private_path, "rb") as f:
+            private_key = serialization.load_pem_private_key(f.read(), password=None)
+
+        public_keys = {}
+        retired_dir = os.path.join(self.keys_dir, RETIRED_DIR)
+        if os.path.isdir(retired_dir):
+            for name in sorted(os.listdir(retired_dir)):
+                if name.endswith(".pem"):
+                    with open(os.path.join(retired_dir, name), "rb") as f:
+                        public_key = serialization.load_pem_public_key(f.read())
+                    public_keys[key_id(public_key)] = public_key
+        current_kid = key_id(private_key.public_key())
+        public_keys[current_kid] = private_key.public_key()
+
+        # Замена ссылок атомарна: параллельные запросы видят либо старый, либо новый набор ключей
+        self.private_key, self.public_keys, self.current_kid = private_key, public_keys, current_kid
+
+    def sign(self, data: str) -> str:
+        """Подписать данные текущим ключом (PKCS#1 v1.5, SHA-256); подпись в base64."""
+        signature = self.private_key.sign(data.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return base64.b64encode(signature).decode()
+
+    def verify(self, data: str, signature: str, kid: str = None) -> bool:
+        """
+        Проверить подпись лицензии.
+
+        Если kid известен, проверяется только соответствующим ключом; иначе (лицензии,
+        выпущенные до появления kid) - всеми ключами, начиная с текущего.
+        """
+        try:
+            signature_bytes = base64.b64decode(signature, validate=True)
+        except ValueError:
+            return False
+        if kid is not None:
+            candidates = [self.public_keys[kid]] if kid in self.public_keys else []
+        else:
+            candidates = [self.public_keys[self.current_kid]] + [
+                public_key for other_kid, public_key in self.public_keys.items() if other_kid != self.current_kid]
+        for public_key in candidates:
+            try:
+                public_key.verify(signature_bytes, data.encode(), padding.PKCS1v15(), hashes.SHA256())
+                return True
+            except InvalidSignature:
+                continue
+        return False
+
+    def rotate(self) -> str:
+        """Создать новый ключ подписи; прежний открытый ключ остаётся для проверки. Возвращает новый kid."""
+        retired_dir = os.path.join(self.keys_dir, RETIRED_DIR)
+        os.makedirs(retired_dir, exist_ok=True)
+        _write_public_key(os.path.join(retired_dir, f"{self.current_kid}.pem"), self.private_key.public_key())
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=KEY_SIZE)
+        _write_private_key(os.path.join(self.keys_dir, PRIVATE_KEY_FILE), private_key)
+        _write_public_key(os.path.join(self.keys_dir, PUBLIC_KEY_FILE), private_key.public_key())
+        self.reload()
+        return self.current_kid
+
+
+_worker_registry = None  # Реестр ключей процесса пула проверки
+
+
+def init_verify_worker(keys_dir: str):
+    """Инициализатор процесса пула: загрузить ключи один раз на процесс."""
+    global _worker_registry
+    _worker_registry = KeyRegistry(keys_dir)
+
+
+def verify_licenses(items: list) -> list:
+    """Проверить порцию пар (данные лицензии, подпись) в процессе пула."""
+    return [_worker_registry.verify(data, signature, license_key_id(data)) for data, signature in items]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rotate":
+        print("Использование: python license_keys.py rotate [каталог ключей]")
+        sys.exit(2)
+    registry = KeyRegistry(sys.argv[2] if len(sys.argv) > 2 else "keys")
+    old_kid = registry.current_kid
+    print(f"Ключ {old_kid} выведен из использования, новый ключ подписи: {registry.rotate()}")
@@ -0,0 +1,130 @@
+"""
+Настройка журналирования сервера и клиента.
+
+Вызов logger.info() только кладёт запись в очередь в памяти. Запись в файл и вывод в
+консоль выполняет отдельный поток (QueueListener), поэтому запросы и поток интерфейса
+не ждут диска. Если очередь переполнена, запись отбрасывается, а не задерживает вызывающий
+поток; число отброшенных записей выводится при остановке журналирования.
+
+В файл записи пишутся по одной в строке в формате JSON: время, уровень, имя журнала,
+сообщение, поля из extra и текст исключения. Файл ротируется по размеру. В консоль
+выводится прежний текстовый формат.
+
+Сообщения горячих путей (по несколько на каждый файл) помечаются extra=SAMPLED. Из них
+в журнал попадает каждое LOG_SAMPLE_EVERY-е для каждого места вызова. Предупреждения
+и ошибки не отбрасываются никогда.
+
+Переменные окружения: LOG_LEVEL (INFO), LOG_MAX_BYTES (10 МБ), LOG_BACKUP_COUNT (5),
+LOG_SAMPLE_EVERY (10; 1 - без выборки), LOG_QUEUE_SIZE (10000).
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+SAMPLED = {"sampled": True}  # extra для сообщений горячих путей
+
+# Атрибуты LogRecord; всё остальное в записи - поля, переданные через extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись журнала в виде одной строки JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускать каждое every-е сообщение с extra=SAMPLED уровня INFO и ниже для каждого места вызова."""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counters = {}  # (файл, строка) -> счётчик; next() у itertools.count потокобезопасен
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or not getattr(record, "sampled", False) or record.levelno > logging.INFO:
+            return True
+        key = (record.pathname, record.lineno)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        return next(counter) % self.every == 0
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись вместо ожидания."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение и исключение превращаются в строки сразу: аргументы могут измениться
+        # до того, как запись будет обработана в потоке журналирования
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(log_file: str, console_format: str = "%(asctime)s - %(levelname)s - %(message)s"):
+    """Направить корневой журнал через очередь в ротируемый JSON-файл log_file и в консоль."""
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.environ.get("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(console_format))
+
+    log_queue = queue.Queue(int(os.environ.get("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(int(os.environ.get("LOG_SAMPLE_EVERY", "10"))))
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    listener.start()
+
+    def stop():
+        listener.stop()  # Дописывает оставшиеся в очереди записи
+        if queue_handler.dropped:
+            print(f"Журнал: отброшено записей при переполнении очереди: {queue_handler.dropped}", file=sys.stderr)
+
+    atexit.register(stop)
+    return listener
@@ -0,0 +1,226 @@
+"""
+Метрики сервера в формате Prometheus, собираемые в памяти процесса.
+
+Метрики создаются на уровне модуля и регистрируются в REGISTRY; GET /metrics отдаёт
+REGISTRY.render(). Поддерживаются счётчики (Counter), текущие значения (Gauge) и
+гистограммы (Histogram), с метками или без. Значения локальны для процесса: при
+нескольких рабочих процессах uvicorn каждый отдаёт свои.
+
+    REQUESTS = Counter("http_requests_total", "Число запросов", ["method", "route"])
+    REQUESTS.labels("GET", "/backups/").inc()
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограммы задержек, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Registry:
+    """Набор метрик процесса."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    """
+    Общая часть метрик: дочерние значения по наборам меток.
+
+    Метрика без меток сама ведёт себя как своё единственное значение.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Значение метрики для набора меток (создаётся при первом обращении)."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), child) for key, child in items]
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for labels, child in self._items():
+            yield "", labels, child.value
+
+
+class Gauge(_Metric):
+    """Текущее значение (например, число активных передач)."""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def samples(self):
+        for labels, child in self._items():
+            yield "", labels, child.value
+
+
+class _HistogramValue:
+    """
+    Счётчики корзин, сумма и количество наблюдений.
+
+    Память не растёт с числом наблюдений; безопасно для нескольких потоков.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Последняя корзина - больше всех границ
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Измерить длительность блока with."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        """Вернуть (накопленные счётчики по границам корзин, сумма, количество)."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, running
+
+
+class Histogram(_Metric):
+    """Распределение наблюдений (длительностей, размеров) по корзинам с фиксированными границами."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def snapshot(self):
+        return self._children[()].snapshot()
+
+    def samples(self):
+        for labels, child in self._items():
+            cumulative, total, count = child.snapshot()
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), cumulative):
+                yield "_bucket", {**labels, "le": _format_value(bound)}, bucket_count
+            yield "_sum", labels, total
+            yield "_count", labels, count
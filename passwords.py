@@ -0,0 +1,78 @@
+"""
+Хеширование паролей (bcrypt) в отдельном пуле процессов.
+
+bcrypt намеренно медленный и занимает процессор; если считать его в потоках сервера,
+волна входов занимает весь пул потоков и задерживает загрузки и скачивания. Поэтому
+хеширование выполняется в пуле из PASSWORD_HASH_WORKERS процессов, а число ожидающих
+операций ограничено: лишние запросы сразу получают отказ (PasswordHasherBusy), а не
+копятся в очереди.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+from metrics import Counter, Gauge, Histogram
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+HASH_SECONDS = Histogram("password_hash_seconds", "Длительность операций bcrypt, включая ожидание в очереди пула",
+                         ["operation"])
+HASH_PENDING = Gauge("password_hash_pending", "Операции bcrypt, ожидающие или выполняющиеся в пуле")
+HASH_REJECTED = Counter("password_hash_rejected_total", "Операции bcrypt, отклонённые из-за переполнения очереди")
+
+
+class PasswordHasherBusy(Exception):
+    """Слишком много ожидающих операций хеширования."""
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Асинхронное хеширование и проверка паролей в пуле процессов.
+
+    workers - число процессов (одновременных bcrypt), max_pending - сколько операций
+    может ждать и выполняться сразу. Методы вызываются из цикла событий.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self._pending = 0  # Меняется только в цикле событий, блокировка не нужна
+        # spawn, а не fork: у сервера есть потоки
+        self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def _run(self, operation: str, func, *args):
+        if self._pending >= self.max_pending:
+            HASH_REJECTED.inc()
+            raise PasswordHasherBusy()
+        self._pending += 1
+        HASH_PENDING.inc()
+        start = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._pool.submit(func, *args))
+        finally:
+            self._pending -= 1
+            HASH_PENDING.dec()
+            HASH_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify, password, hashed_password)
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
@@ -0,0 +1,220 @@
+"""
+Хранилище объектов резервных копий.
+
+Обработчики API работают с объектами по ключам ("chunks/ab/abcd...", "<id пользователя>/<имя файла>")
+через интерфейс StorageBackend и не знают, где лежат данные. Реализации:
+
+* LocalStorage - каталог на локальном диске (ключ - относительный путь);
+* S3Storage - S3-совместимое хранилище (AWS S3, MinIO, Ceph RGW). Для локальной проверки
+  подходит MinIO или moto в режиме сервера, например:
+
+      moto_server -p 9000
+      STORAGE_BACKEND=s3 S3_BUCKET=backups S3_ENDPOINT_URL=http://127.0.0.1:9000 \\
+      AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test uvicorn app:app
+
+Выбор реализации - create_storage(), параметры берутся из переменных окружения.
+Соответствие реализаций контракту StorageBackend проверяет check_storage.py.
+"""
+import os
+import shutil
+import tempfile
+from typing import Iterator, NamedTuple, Optional
+
+READ_SIZE = 1024 * 1024  # Размер порции при потоковом чтении (1 МБ)
+
+
+class ObjectStat(NamedTuple):
+    size: int
+    modified: float  # Время изменения, секунды с начала эпохи
+
+
+class StorageBackend:
+    """
+    Интерфейс хранилища объектов.
+
+    put принимает bytes или открытый двоичный файл (передаётся потоково), get_range
+    отдаёт содержимое порциями, поэтому объём памяти не зависит от размера объекта.
+    """
+
+    def put(self, key: str, body) -> None:
+        """Записать объект целиком; запись атомарна - читатели не увидят частичный объект."""
+        raise NotImplementedError
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Прочитать байты [start, end] включительно (end=None - до конца объекта)."""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        """Размер и время изменения объекта или None, если объекта нет."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def delete(self, key: str) -> None:
+        """Удалить объект; отсутствие объекта не считается ошибкой."""
+        raise NotImplementedError
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        """Ключи объектов, начинающиеся с prefix."""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """
+    Объекты в каталоге на локальном диске.
+
+    Файлы и каталоги, имена которых начинаются с точки, объектами не считаются: это
+    временные файлы записи и служебные файлы приложения (например, части загрузок).
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        parts = key.split("/")
+        if not key or any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Недопустимый ключ объекта: {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def put(self, key: str, body) -> None:
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(body, (bytes, bytearray, memoryview)):
+                    f.write(body)
+                else:
+                    shutil.copyfileobj(body, f, READ_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end + 1 - start
+            while remaining is None or remaining > 0:
+                data = f.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        try:
+            file_stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return ObjectStat(file_stat.st_size, file_stat.st_mtime)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        # Обходим только каталог, в котором может начинаться префикс
+        base = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        top = os.path.join(self.root, *base.split("/")) if base else self.root
+        for directory, dirnames, filenames in os.walk(top):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for name in filenames:
+                if name.startswith("."):
+                    continue
+                key = name if relative == "." else f"{relative}/{name}"
+                if key.startswith(prefix):
+                    yield key
+
+
+class S3Storage(StorageBackend):
+    """
+    Объекты в S3-совместимом хранилище (нужен пакет boto3).
+
+    endpoint_url задаёт адрес совместимого сервиса (MinIO, Ceph, moto); для AWS S3 не нужен.
+    Учётные данные берутся стандартными средствами boto3 (переменные окружения AWS_*,
+    ~/.aws/credentials, роль экземпляра).
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region_name: Optional[str] = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("Для хранилища S3 нужен пакет boto3: pip install boto3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        # Клиент boto3 потокобезопасен, один на всё приложение
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+        self._client_error = ClientError
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _is_not_found(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, key: str, body) -> None:
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=bytes(body))
+        else:
+            # upload_fileobj сам переходит на multipart-загрузку для больших объектов
+            self.client.upload_fileobj(body, self.bucket, self._key(key))
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=byte_range)
+        except self._client_error as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(key)
+            raise
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(READ_SIZE)
+        finally:
+            body.close()
+
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return ObjectStat(response["ContentLength"], response["LastModified"].timestamp())
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix):]
+
+
+def create_storage(backend: str, root: str) -> StorageBackend:
+    """
+    Создать хранилище по имени реализации: "local" (каталог root) или "s3".
+
+    Для S3 используются переменные окружения S3_BUCKET (обязательна), S3_PREFIX,
+    S3_ENDPOINT_URL и S3_REGION.
+    """
+    if backend == "local":
+        return LocalStorage(root)
+    if backend == "s3":
+        bucket = os.environ.get("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("Для STORAGE_BACKEND=s3 нужно задать S3_BUCKET")
+        return S3Storage(bucket, os.environ.get("S3_PREFIX", ""), os.environ.get("S3_ENDPOINT_URL"),
+                         os.environ.get("S3_REGION"))
+    raise RuntimeError(f"Неизвестное хранилище: {backend}")
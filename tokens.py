@@ -0,0 +1,98 @@
+"""
+Подписанные токены доступа.
+
+Токен - это base64url(JSON с утверждениями) и base64url(HMAC-SHA256 подписи), разделённые
+точкой. Сервер проверяет подпись и срок действия в памяти, без обращения к базе данных,
+а подделать токен без секретного ключа нельзя.
+"""
+import base64
+import hmac
+import json
+import os
+import tempfile
+import time
+from hashlib import sha256
+
+
+class TokenError(ValueError):
+    """Токен повреждён, подделан или просрочен."""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+SECRET_SIZE = 32  # Длина секретного ключа подписи, байт
+
+
+def load_secret(path: str) -> bytes:
+    """
+    Прочитать секретный ключ подписи из файла, создав его при первом запуске.
+
+    Ключ сначала записывается во временный файл и публикуется через os.link: если
+    несколько процессов стартуют одновременно, ключ создаст только один, а остальные
+    прочитают уже полностью записанный файл. Файл с ключом не той длины - ошибка.
+    """
+    if not os.path.exists(path):
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".secret-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(os.urandom(SECRET_SIZE).hex())
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(tmp_path, path)
+            except FileExistsError:
+                pass  # Ключ уже создал другой процесс
+        finally:
+            os.remove(tmp_path)
+    with open(path, "r") as f:
+        content = f.read().strip()
+    try:
+        secret = bytes.fromhex(content)
+    except ValueError:
+        secret = b""
+    if len(secret) != SECRET_SIZE:
+        raise RuntimeError(f"Файл {path} не содержит ключ подписи ({SECRET_SIZE} байт в hex); "
+                           f"удалите его, чтобы создать новый ключ")
+    return secret
+
+
+class TokenSigner:
+    """Выпуск и проверка токенов с ограниченным сроком действия."""
+
+    def __init__(self, secret: bytes, ttl: int):
+        self.secret = secret
+        self.ttl = ttl  # Срок действия токена, секунды
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self.secret, payload.encode(), sha256).digest())
+
+    def issue(self, claims: dict) -> str:
+        now = int(time.time())
+        payload = _b64encode(json.dumps({**claims, "iat": now, "exp": now + self.ttl}).encode())
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str, leeway: int = 0) -> dict:
+        """
+        Проверить подпись и срок действия, вернуть утверждения токена.
+
+        leeway - сколько секунд после истечения срока токен ещё принимается
+        (используется при обновлении токена).
+        """
+        payload, _, signature = token.partition(".")
+        if not signature or not hmac.compare_digest(signature, self._sign(payload)):
+            raise TokenError("Неверная подпись токена")
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise TokenError("Повреждённый токен")
+        if claims.get("exp", 0) + leeway < time.time():
+            raise TokenError("Срок действия токена истёк")
+        return claims